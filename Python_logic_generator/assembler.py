@@ -0,0 +1,360 @@
+# pylint: disable=line-too-long
+"""
+This module contains a two-pass 6502 assembler for the oldstyle syntax used by
+the programs under /asm/ (vasm6502_oldstyle -dotdir), so no external tool is
+needed to build a binary.
+
+Supported syntax:
+- labels at the start of a line (optional ':'), constants with 'name = expr'
+- directives .org, .word, .byte (.db/.dw are accepted as aliases)
+- numbers in hex ($ff), binary (%1010), decimal and character ('a')
+- expressions made of numbers, labels and '*' joined by + and -, with the
+  < (low byte) and > (high byte) operators
+- operands: #imm, zp, zp,x, abs, abs,x, abs,y, (ind), (zp,x), (zp),y and A
+- comments starting with ';'
+
+The opcode table is built from the Instruction objects of pla_generator.py, so
+only opcodes implemented by the microcode are accepted. Operand sizes follow the
+6502 encoding (as vasm does). The microcode of the implied instructions (like
+BRK) increments PC over the byte following the opcode: the assembler emits a
+padding byte ($ea) after them, the length of every opcode being read from its
+microcode (microcode_optimizer.instruction_length), so the sources are written
+as for a 6502. The padding makes the image differ from the one of vasm for the
+programs using these instructions: assemble(padding=False) (--no-padding) emits
+the bytes of vasm instead, which the microcode does not run correctly.
+
+The first pass parses every line once, chooses the addressing modes (zero page
+when the value is already known and fits in a byte) and assigns the addresses.
+The second pass only evaluates the operands and writes the bytes. The
+throughput is about 250 lines/ms in CPython (the per line work of the parsing
+dominates), well short of thousands of lines/ms, but without the process launch
+of vasm.
+"""
+import argparse
+import re
+from microcode_optimizer import instruction_length
+from pla_generator import AdressModesList, Instruction, build_instructions
+
+# Operand bytes following the opcode for every addressing mode
+OPERAND_SIZES = {
+    AdressModesList.A: 0, AdressModesList.IMP: 0,
+    AdressModesList.IMM: 1, AdressModesList.ZPG: 1, AdressModesList.ZPGX: 1, AdressModesList.ZPGY: 1,
+    AdressModesList.XIND: 1, AdressModesList.INDY: 1, AdressModesList.REL: 1,
+    AdressModesList.ABS: 2, AdressModesList.ABSX: 2, AdressModesList.ABSY: 2, AdressModesList.IND: 2,
+}
+
+PADDING_BYTE = 0xEA
+
+# Zero page mode used instead of the absolute one when the operand fits in a byte
+ZERO_PAGE_MODES = {AdressModesList.ABS: AdressModesList.ZPG, AdressModesList.ABSX: AdressModesList.ZPGX, AdressModesList.ABSY: AdressModesList.ZPGY}
+
+_LINE_RE = re.compile(r"^(?:([A-Za-z_][\w.]*)\s*:?)?\s*(?:([.\w]+)\s*(.*?))?\s*(?:;.*)?$")
+_CONSTANT_RE = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*(?:=|\.equ\s|\.set\s)\s*(.+?)\s*$", re.IGNORECASE)
+_HEX_RE = re.compile(r"^\$[0-9A-Fa-f]+$")
+_TERM_RE = re.compile(r"\s*([+-]?)\s*(\$[0-9A-Fa-f]+|%[01]+|\d+|'.'|\*|[A-Za-z_.][\w.]*)\s*")
+
+
+class Program:
+    """
+    This class represents an assembled program: its image starting at origin and its symbols.
+    """
+
+    def __init__(self, origin: int, image: bytearray, symbols: dict[str, int], lines: dict[int, int]):
+        self.origin = origin
+        self.image = image
+        self.symbols = symbols
+        # Address of the first byte emitted by every source line {address: line number}
+        self.lines = lines
+
+    def labels(self) -> dict[int, str]:
+        """
+        This function returns the labels by address (the first one defined for an address).
+        """
+        labels: dict[int, str] = {}
+        for name, address in self.symbols.items():
+            labels.setdefault(address, name)
+        return labels
+
+
+def build_opcode_table(instructions: list[Instruction]) -> dict[tuple[str, AdressModesList], int]:
+    """
+    This function maps (mnemonic, addressing mode) to the opcode of every implemented instruction.
+    """
+    return {(instruction.name.value, instruction.addressing_mode): instruction.opcode for instruction in instructions}
+
+
+def build_padding_table(instructions: list[Instruction]) -> dict[int, int]:
+    """
+    This function returns the number of padding bytes following the operand of every opcode whose microcode increments PC past it.
+    """
+    paddings = {}
+    for instruction in instructions:
+        padding = instruction_length(instruction) - 1 - OPERAND_SIZES[instruction.addressing_mode]
+        if padding > 0:
+            paddings[instruction.opcode] = padding
+    return paddings
+
+
+def _error(line_number: int, message: str) -> ValueError:
+    return ValueError(f"line {line_number}: {message}")
+
+
+def _evaluate(expression: str, symbols: dict[str, int], pc: int, line_number: int, strict: bool) -> int | None:
+    """
+    This function evaluates an expression, an unknown symbol gives None unless strict is set.
+    """
+    expression = expression.strip()
+    if expression in symbols:
+        return symbols[expression]
+    if expression[:1] == "$" and _HEX_RE.match(expression):
+        return int(expression[1:], 16)
+    selector = ""
+    if expression[:1] in ("<", ">"):
+        selector, expression = expression[0], expression[1:]
+    value, position = 0, 0
+    while position < len(expression):
+        match = _TERM_RE.match(expression, position)
+        if match is None or (position > 0 and match.group(1) == ""):
+            raise _error(line_number, f"invalid expression '{expression}'")
+        sign, term = match.groups()
+        position = match.end()
+        if term[0] == "$":
+            term_value = int(term[1:], 16)
+        elif term[0] == "%":
+            term_value = int(term[1:], 2)
+        elif term[0].isdigit():
+            term_value = int(term)
+        elif term[0] == "'":
+            term_value = ord(term[1])
+        elif term == "*":
+            term_value = pc
+        elif term in symbols:
+            term_value = symbols[term]
+        elif strict:
+            raise _error(line_number, f"undefined symbol '{term}'")
+        else:
+            return None
+        value = value - term_value if sign == "-" else value + term_value
+    if selector == "<":
+        return value & 0xFF
+    if selector == ">":
+        return value >> 8 & 0xFF
+    return value
+
+
+def _split_operand(operand: str) -> tuple[str, str]:
+    """
+    This function returns the addressing syntax ('', '#', 'a', ',x', ',y', '()', '(,x)', '(),y') and the expression of an operand.
+    """
+    compact = operand.replace(" ", "").replace("\t", "")
+    lowered = compact.lower()
+    if lowered == "":
+        return "", ""
+    if lowered == "a":
+        return "a", ""
+    if lowered[0] == "#":
+        return "#", operand.strip()[1:]
+    if lowered[0] == "(":
+        if lowered.endswith(",x)"):
+            return "(,x)", compact[1:-3]
+        if lowered.endswith("),y"):
+            return "(),y", compact[1:-3]
+        if lowered.endswith(")"):
+            return "()", compact[1:-1]
+    if lowered.endswith(",x"):
+        return ",x", compact[:-2]
+    if lowered.endswith(",y"):
+        return ",y", compact[:-2]
+    return "expr", operand.strip()
+
+
+# Candidate addressing modes for every operand syntax, the first implemented one is used
+_SYNTAX_MODES = {
+    "": (AdressModesList.IMP, AdressModesList.A),
+    "a": (AdressModesList.A,),
+    "#": (AdressModesList.IMM,),
+    "expr": (AdressModesList.REL, AdressModesList.ABS, AdressModesList.ZPG),
+    ",x": (AdressModesList.ABSX, AdressModesList.ZPGX),
+    ",y": (AdressModesList.ABSY, AdressModesList.ZPGY),
+    "()": (AdressModesList.IND,),
+    "(,x)": (AdressModesList.XIND,),
+    "(),y": (AdressModesList.INDY,),
+}
+
+
+def _strip_comment(line: str) -> str:
+    position = line.find(";")
+    if position < 0:
+        return line
+    # Keep a ';' inside a character constant
+    if line.count("'", 0, position) % 2 == 1:
+        end = line.find("'", position)
+        next_comment = line.find(";", end + 1) if end >= 0 else -1
+        return line if next_comment < 0 else line[:next_comment]
+    return line[:position]
+
+
+def _build_choices(opcodes: dict[tuple[str, AdressModesList], int]) -> dict[tuple[str, str], tuple[int, int, bool, int | None]]:
+    """
+    This function resolves every (mnemonic, operand syntax) to (opcode, operand size, relative, zero page opcode).
+    """
+    choices = {}
+    for mnemonic in {name for name, _ in opcodes}:
+        for syntax, modes in _SYNTAX_MODES.items():
+            mode = next((mode for mode in modes if (mnemonic, mode) in opcodes), None)
+            if mode is None:
+                continue
+            zero_page_opcode = opcodes.get((mnemonic, ZERO_PAGE_MODES[mode])) if mode in ZERO_PAGE_MODES else None
+            choices[(mnemonic, syntax)] = (opcodes[(mnemonic, mode)], OPERAND_SIZES[mode], mode == AdressModesList.REL, zero_page_opcode)
+    return choices
+
+
+def assemble(source: str, opcodes: dict[tuple[str, AdressModesList], int] | None = None, paddings: dict[int, int] | None = None, padding: bool = True) -> Program:
+    """
+    This function assembles a source file and returns the program (raises ValueError with the line number on error).
+    By default a padding byte ($ea) follows the opcodes whose microcode increments PC past their operand (BRK), so the
+    image is not byte-compatible with vasm for such programs; padding=False emits the bytes of vasm (as paddings={}).
+    """
+    if padding is False:
+        paddings = {}
+    if opcodes is None or paddings is None:
+        instructions = build_instructions()
+        opcodes = build_opcode_table(instructions) if opcodes is None else opcodes
+        paddings = build_padding_table(instructions) if paddings is None else paddings
+    choices = _build_choices(opcodes)
+    symbols: dict[str, int] = {}
+    # Pass 1: (line number, address, kind, data) with kind "op" (opcode, operand size, relative, expression, padding), "word", "byte" or "const"
+    statements = []
+    pc = None
+    for line_number, line in enumerate(source.splitlines(), 1):
+        if "'" in line:
+            line = _strip_comment(line)
+        if "=" in line or ".equ" in line or ".set" in line:
+            constant = _CONSTANT_RE.match(_strip_comment(line))
+            if constant is not None:
+                name, expression = constant.groups()
+                value = _evaluate(expression, symbols, pc or 0, line_number, False)
+                if value is None:
+                    statements.append((line_number, pc, "const", (name, expression)))
+                else:
+                    symbols[name] = value
+                continue
+        match = _LINE_RE.match(line)
+        if match is None:
+            raise _error(line_number, f"syntax error '{line.strip()}'")
+        label, keyword, operand = match.groups()
+        if label is not None:
+            if label in symbols:
+                raise _error(line_number, f"symbol '{label}' already defined")
+            if pc is None:
+                raise _error(line_number, f"label '{label}' before any .org")
+            symbols[label] = pc
+        if keyword is None:
+            continue
+        if keyword[0] != ".":
+            if pc is None:
+                raise _error(line_number, "code before any .org")
+            mnemonic = keyword.upper()
+            syntax, expression = _split_operand(operand)
+            choice = choices.get((mnemonic, syntax))
+            if choice is None:
+                raise _error(line_number, f"'{mnemonic} {operand}' is not implemented by the microcode")
+            opcode, size, relative, zero_page_opcode = choice
+            if zero_page_opcode is not None:
+                value = _evaluate(expression, symbols, pc, line_number, False)
+                if value is not None and 0 <= value < 0x100:
+                    opcode, size = zero_page_opcode, 1
+            padding = paddings.get(opcode, 0)
+            statements.append((line_number, pc, "op", (opcode, size, relative, expression, padding)))
+            pc += 1 + size + padding
+            continue
+        directive = keyword.lower()
+        if directive == ".org":
+            pc = _evaluate(operand, symbols, pc or 0, line_number, True)
+            continue
+        if pc is None:
+            raise _error(line_number, "data before any .org")
+        if directive in (".word", ".dw"):
+            expressions = operand.split(",")
+            statements.append((line_number, pc, "word", expressions))
+            pc += 2 * len(expressions)
+        elif directive in (".byte", ".db"):
+            expressions = operand.split(",")
+            statements.append((line_number, pc, "byte", expressions))
+            pc += len(expressions)
+        else:
+            raise _error(line_number, f"unknown directive '{keyword}'")
+
+    # Constants defined from forward references
+    for line_number, address, kind, data in statements:
+        if kind == "const":
+            symbols[data[0]] = _evaluate(data[1], symbols, address or 0, line_number, True)
+
+    # Pass 2: emit the bytes
+    emitted = [(address, line_number, kind, data) for line_number, address, kind, data in statements if kind != "const"]
+    if len(emitted) == 0:
+        return Program(0, bytearray(), symbols, {})
+    origin = min(address for address, _, _, _ in emitted)
+    end = max(address + _statement_size(kind, data) for address, _, kind, data in emitted)
+    image = bytearray(end - origin)
+    lines: dict[int, int] = {}
+    for address, line_number, kind, data in emitted:
+        lines.setdefault(address, line_number)
+        offset = address - origin
+        if kind == "op":
+            opcode, size, relative, expression, padding = data
+            image[offset] = opcode
+            image[offset + 1 + size:offset + 1 + size + padding] = bytes([PADDING_BYTE] * padding)
+            if size == 0:
+                continue
+            value = _evaluate(expression, symbols, address, line_number, True)
+            if relative is True:
+                value -= address + 2
+                if not -128 <= value <= 127:
+                    raise _error(line_number, f"branch out of range ({value})")
+                value &= 0xFF
+            elif not 0 <= value < 1 << (8 * size):
+                raise _error(line_number, f"operand ${value:x} does not fit in {size} byte(s)")
+            image[offset + 1] = value & 0xFF
+            if size == 2:
+                image[offset + 2] = value >> 8
+        else:
+            size = 2 if kind == "word" else 1
+            for index, expression in enumerate(data):
+                value = _evaluate(expression, symbols, address + index * size, line_number, True) & (0xFFFF if size == 2 else 0xFF)
+                image[offset + index * size] = value & 0xFF
+                if size == 2:
+                    image[offset + index * size + 1] = value >> 8
+    return Program(origin, image, symbols, lines)
+
+
+def _statement_size(kind: str, data) -> int:
+    if kind == "op":
+        return 1 + data[1] + data[4]
+    return (2 if kind == "word" else 1) * len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assemble a 6502 oldstyle source file for the Turtle Core.")
+    parser.add_argument("source", help="assembly source file")
+    parser.add_argument("-o", "--output", default="a.out", help="binary output file (image from the lowest .org to the last byte)")
+    parser.add_argument("--symbols", action="store_true", help="print the symbol table")
+    parser.add_argument("--no-padding", action="store_true", help="do not emit the padding byte after the implied instructions whose microcode skips it (same bytes as vasm)")
+    args = parser.parse_args()
+
+    with open(args.source, "r", encoding="utf-8") as file:
+        source = file.read()
+    try:
+        program = assemble(source, padding=not args.no_padding)
+    except ValueError as error:
+        parser.exit(1, f"{args.source}: {error}\n")
+    with open(args.output, "wb") as file:
+        file.write(program.image)
+    print(f"{args.source}: {len(program.image)} bytes at ${program.origin:04x} written to {args.output}")
+    if args.symbols is True:
+        for name, address in sorted(program.symbols.items(), key=lambda item: item[1]):
+            print(f"${address:04x} {name}")
+
+
+if __name__ == "__main__":
+    main()
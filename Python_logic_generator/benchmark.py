@@ -0,0 +1,332 @@
+# pylint: disable=line-too-long
+"""
+This module contains the benchmark suite of the generator, the generated tables
+and the execution engines.
+
+Three groups of results are measured:
+- generation: wall time of pla_generator.py end to end (new interpreter) and of
+  every stage (building the instructions, validate_instruction, get_decode_PLA
+  and every write_*_pla, written in a temporary directory)
+- tables: rows and input/output widths of every generated table, the cycles of
+  every opcode (as in generate_instruction_docs) and the hazards reported by
+  hazard_checker.py (bus conflicts, path flips...)
+- engines: simulated microcycles per second of every execution engine of
+  ENGINES on the reference programs (the *.s files of asm/, assembled with
+  assembler.py)
+- circuit: the reference programs whose memory writes on the TCORE circuit
+  (compiled by circuit_compiler.py with the generated tables) differ from the
+  emulator, as circuit_compiler.py --check
+
+Timings are the median of several repeats. The results are written as JSON so
+two commits can be compared: --compare reports the timings slower (or engines
+slower) than the baseline by more than --threshold, and any table row or opcode
+cycle added since the baseline, and exits with an error if there is one. A
+hazard of the generated microcode or a difference between the circuit and the
+emulator fails every run, with or without a baseline.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+from assembler import assemble
+from block_emulator import BlockEngine
+from circuit_compiler import CORE_CIRCUIT, GateLevelCore, compile_circuit, compare_with_emulator
+from emulator import Microcode, TurtleCore
+from pla_generator import build_instructions, generate_instruction_docs, get_irq_pla, get_decode_pla, get_flag_select_pla, get_reset_pla, get_vectors_pla, write_irq_pla, write_decode_pla, write_reset_pla, write_vectors_pla
+from pla_tables import parse_pla, get_pla_widths
+
+RESULTS_VERSION = 1
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PROGRAMS_DIRECTORY = os.path.join(os.path.dirname(SOURCE_DIRECTORY), "asm")
+CIRCUIT_PATH = os.path.join(os.path.dirname(SOURCE_DIRECTORY), "8bit_CPU.circ")
+VECTOR_LANES = 256
+
+
+def scalar_engine(microcode: Microcode, image: bytes) -> Callable[[int], int]:
+    core = TurtleCore(microcode)
+    core.load(image)
+    core.reset()
+
+    def run(cycles: int) -> int:
+        core.run(cycles)
+        return cycles
+    return run
+
+
+def block_engine(microcode: Microcode, image: bytes) -> Callable[[int], int]:
+    core = TurtleCore(microcode)
+    core.load(image)
+    core.reset()
+    engine = BlockEngine(core)
+
+    def run(cycles: int) -> int:
+        engine.run(cycles)
+        return cycles
+    return run
+
+
+def vector_engine(microcode: Microcode, image: bytes) -> Callable[[int], int]:
+    from vector_emulator import VectorCore
+    core = VectorCore(microcode, VECTOR_LANES)
+    core.load(image)
+    core.reset()
+
+    def run(cycles: int) -> int:
+        # Every lane runs the program, so a step simulates one microcycle per lane
+        steps = max(1, cycles // VECTOR_LANES)
+        core.run(steps)
+        return steps * VECTOR_LANES
+    return run
+
+
+# Execution engines {name: function(microcode, image) returning a function running the loaded program and returning the number of microcycles simulated}
+ENGINES: dict[str, Callable[[Microcode, bytes], Callable[[int], int]]] = {
+    "scalar": scalar_engine,
+    "block": block_engine,
+    "vector": vector_engine,
+}
+
+
+def median_time(function: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def generation_timings(repeat: int) -> dict[str, float]:
+    """
+    This function returns the median time (s) of every generation stage and of the whole generator run.
+    """
+    timings = {}
+    timings["build_instructions"] = median_time(lambda: build_instructions(validate=False), repeat)
+
+    def validate():
+        for instruction in build_instructions(validate=False):
+            instruction.validate_instruction()
+    timings["validate_instruction"] = median_time(validate, repeat) - timings["build_instructions"]
+
+    instructions = build_instructions()
+    timings["get_decode_PLA"] = median_time(lambda: [instruction.get_decode_PLA() for instruction in instructions], repeat)
+
+    current_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Writers use paths relative to the repository root (./PLAs)
+        os.makedirs(os.path.join(directory, "PLAs"))
+        os.chdir(directory)
+        try:
+            timings["write_irq_pla"] = median_time(lambda: write_irq_pla(instructions), repeat)
+            timings["write_decode_pla"] = median_time(lambda: write_decode_pla(instructions), repeat)
+            timings["write_reset_pla"] = median_time(write_reset_pla, repeat)
+            timings["write_vectors_pla"] = median_time(write_vectors_pla, repeat)
+            command = [sys.executable, os.path.join(SOURCE_DIRECTORY, "pla_generator.py")]
+            timings["end_to_end"] = median_time(lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL), repeat)
+        finally:
+            os.chdir(current_directory)
+    return timings
+
+
+def table_metrics(instructions) -> dict:
+    """
+    This function returns the rows and widths of every generated table.
+    """
+    tables = {
+        "IRQPLA": get_irq_pla(instructions),
+        "DecodePLA": get_decode_pla(instructions),
+        "DecodePLA_flagSelect": get_flag_select_pla(instructions),
+        "ResetPLA": get_reset_pla(),
+        "Vectors": get_vectors_pla(),
+    }
+    metrics = {}
+    for name, text in tables.items():
+        input_width, output_width = get_pla_widths(text)
+        metrics[name] = {"rows": len(parse_pla(text)), "input_width": input_width, "output_width": output_width}
+    return metrics
+
+
+def opcode_cycles(instructions) -> dict[str, dict]:
+    """
+    This function returns {opcode: {"name", "cycles", "flag_cycles"}} parsed from generate_instruction_docs.
+    """
+    cycles = {}
+    for line in generate_instruction_docs(instructions).splitlines()[2:]:
+        opcode, name, cost = (column.strip() for column in line.split("|"))
+        base, _, extra = cost.partition(" +(")
+        cycles[opcode.lstrip("$")] = {"name": name, "cycles": int(base), "flag_cycles": int(extra.rstrip(")")) if extra else 0}
+    return cycles
+
+
+def microcode_hazards(instructions) -> list[str]:
+    """
+    This function returns the hazards of the generated microcode found by hazard_checker.py (needs NumPy).
+    """
+    from hazard_checker import check_microcode
+    names = {instruction.opcode: f"{instruction.name.value} {instruction.addressing_mode.value.short_name}" for instruction in instructions}
+    hazards = check_microcode(Microcode.from_instructions(instructions), instructions)
+    return [f"{hazard.table} {'-' if hazard.opcode is None else f'${hazard.opcode:02x} ' + names[hazard.opcode]} cycle {hazard.cycle}: {hazard.kind} ({hazard.detail})" for hazard in hazards]
+
+
+def reference_programs(directory: str = PROGRAMS_DIRECTORY) -> dict[str, bytes]:
+    programs = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.s"))):
+        with open(path, "r", encoding="utf-8") as file:
+            programs[os.path.basename(path)] = bytes(assemble(file.read()).image)
+    return programs
+
+
+def engine_throughput(engines: list[str], cycles: int, repeat: int) -> dict[str, dict[str, float]]:
+    """
+    This function returns {engine: {program: simulated microcycles per second}}.
+    """
+    microcode = Microcode.from_instructions(build_instructions())
+    programs = reference_programs()
+    results = {}
+    for engine in engines:
+        results[engine] = {}
+        for name, image in programs.items():
+            # The engine is set up (tables compiled, program loaded and reset) before the timed runs
+            run = ENGINES[engine](microcode, image)
+            simulated = run(cycles)
+            results[engine][name] = simulated / median_time(lambda: run(cycles), repeat)
+    return results
+
+
+def circuit_mismatches(instructions, cycles: int) -> list[str]:
+    """
+    This function runs every reference program for cycles clock cycles on the TCORE circuit loaded with the generated tables
+    and returns the programs whose memory writes differ from the emulator.
+    """
+    if cycles == 0:
+        return []
+    current_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Writers use paths relative to the repository root (./PLAs)
+        os.makedirs(os.path.join(directory, "PLAs"))
+        os.chdir(directory)
+        try:
+            write_irq_pla(instructions)
+            write_decode_pla(instructions)
+            write_reset_pla()
+            write_vectors_pla()
+        finally:
+            os.chdir(current_directory)
+        pla_dir = os.path.join(directory, "PLAs")
+        circuit = compile_circuit(CIRCUIT_PATH, CORE_CIRCUIT, pla_dir)
+        mismatches = []
+        for name, image in reference_programs().items():
+            core = GateLevelCore(circuit)
+            core.load(image)
+            core.writes = []
+            core.reset()
+            core.run(cycles)
+            matches, report = compare_with_emulator(core, image, pla_dir)
+            if not matches:
+                mismatches.append(f"{name}: {report}")
+    return mismatches
+
+
+def git_revision() -> str | None:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SOURCE_DIRECTORY, capture_output=True, text=True, check=False)
+    return result.stdout.strip() or None
+
+
+def run_benchmarks(engines: list[str], cycles: int, repeat: int, circuit_cycles: int) -> dict:
+    instructions = build_instructions()
+    return {
+        "version": RESULTS_VERSION,
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "generation": generation_timings(repeat),
+        "tables": table_metrics(instructions),
+        "opcodes": opcode_cycles(instructions),
+        "hazards": microcode_hazards(instructions),
+        "engines": engine_throughput(engines, cycles, repeat),
+        "circuit": circuit_mismatches(instructions, circuit_cycles),
+    }
+
+
+def compare_results(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    This function returns the regressions of current against baseline (timings and throughputs beyond threshold, any added row or cycle, any hazard
+    or circuit mismatch).
+    """
+    regressions = [f"hazard {hazard}" for hazard in current["hazards"]]
+    regressions += [f"circuit {mismatch}" for mismatch in current["circuit"]]
+    for stage, elapsed in current["generation"].items():
+        previous = baseline["generation"].get(stage)
+        if previous is not None and elapsed > previous * (1 + threshold):
+            regressions.append(f"generation {stage}: {previous * 1000:.2f} ms -> {elapsed * 1000:.2f} ms")
+    for name, metrics in current["tables"].items():
+        previous = baseline["tables"].get(name)
+        if previous is not None and metrics["rows"] > previous["rows"]:
+            regressions.append(f"table {name}: {previous['rows']} -> {metrics['rows']} rows")
+    for opcode, metrics in current["opcodes"].items():
+        previous = baseline["opcodes"].get(opcode)
+        # The shortest and the longest path of the opcode are compared separately
+        if previous is not None and (metrics["cycles"] > previous["cycles"] or metrics["cycles"] + metrics["flag_cycles"] > previous["cycles"] + previous["flag_cycles"]):
+            regressions.append(f"opcode ${opcode} {metrics['name']}: {previous['cycles']} +({previous['flag_cycles']}) -> {metrics['cycles']} +({metrics['flag_cycles']}) cycles")
+    for engine, programs in current["engines"].items():
+        for program, throughput in programs.items():
+            previous = baseline["engines"].get(engine, {}).get(program)
+            if previous is not None and throughput < previous * (1 - threshold):
+                regressions.append(f"engine {engine} on {program}: {previous:,.0f} -> {throughput:,.0f} microcycles/s")
+    return regressions
+
+
+def to_markdown(results: dict) -> str:
+    report = f"Revision: {results['revision']} (Python {results['python']})\n\nStage | Time (ms)\n-- | --\n"
+    report += "".join(f"{stage} | {elapsed * 1000:.2f}\n" for stage, elapsed in results["generation"].items())
+    report += "\nTable | Rows | Input bits | Output bits\n-- | -- | -- | --\n"
+    report += "".join(f"{name} | {metrics['rows']} | {metrics['input_width']} | {metrics['output_width']}\n" for name, metrics in results["tables"].items())
+    cycles = [metrics["cycles"] for metrics in results["opcodes"].values()]
+    if cycles:
+        report += f"\nOpcodes: {len(cycles)}, cycles min {min(cycles)} / mean {statistics.mean(cycles):.2f} / max {max(cycles)}\n"
+    report += f"\nHazards: {len(results['hazards'])}\n" + "".join(f"- {hazard}\n" for hazard in results["hazards"])
+    report += "\nEngine | Program | Microcycles/s\n-- | -- | --\n"
+    for engine, programs in results["engines"].items():
+        report += "".join(f"{engine} | {program} | {throughput:,.0f}\n" for program, throughput in programs.items())
+    report += f"\nCircuit mismatches: {len(results['circuit'])}\n" + "".join(f"- {mismatch}\n" for mismatch in results["circuit"])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generator, the generated tables and the execution engines.")
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs of every timing (the median is kept)")
+    parser.add_argument("--cycles", type=int, default=100_000, help="microcycles simulated per engine and program")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES), help="execution engines to measure")
+    parser.add_argument("--circuit-cycles", type=int, default=10_000, help="clock cycles of every reference program on the circuit (0 skips the circuit check)")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare with the JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.engines, args.cycles, args.repeat, args.circuit_cycles)
+    print(to_markdown(results))
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("version") != RESULTS_VERSION:
+            raise ValueError(f"{args.compare}: unsupported results version {baseline.get('version')}!")
+        regressions = compare_results(results, baseline, args.threshold)
+        print(f"------ REGRESSIONS AGAINST {baseline.get('revision')} -------")
+        print("".join(f"- {regression}\n" for regression in regressions) or "None")
+        if regressions:
+            sys.exit(1)
+    if results["hazards"] or results["circuit"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+# pylint: disable=line-too-long
+"""
+This module contains the block translating emulator of the Turtle Core.
+
+The cycle accurate emulator pays a table lookup and a function call for every
+micro cycle. Here a basic block (the instructions from an address up to the
+first one loading the program counter, e.g. a branch, JMP or BRK) is decoded
+once and translated into a single generated Python function: the micro cycles
+of every instruction are taken from the decode table and their statements
+(emulator.microcycle_lines) are inlined one after the other, with the registers
+kept in local variables for the whole block. The fetch row (micro cycle 0) is
+still selected by the opcode of the previous instruction, which may have its
+last cycle carried into it by the microcycle fusion: it is taken from the
+previous instruction of the block, and a block is only entered at a plain
+fetch row.
+
+The flag select PLA only needs a test when the selected flag is unknown: at the
+start of an instruction and after a micro cycle writing it, so the flag paths
+of an instruction become a small if/else tree. Every leaf of the tree adds the
+micro cycles of its path, which are exactly the cycles charged by the microcode
+tables (page crossing, taken branches...).
+
+The generated function is then simplified on its syntax tree: constants (the
+undriven buses read $FF) and copies are propagated, and the statements whose
+value is never read (buses, ALU results or register latches overwritten before
+being used) are removed. Only the stores, the exit values and what they depend
+on are left.
+
+Operands are read from memory at run time, only the opcodes are fixed by the
+translation. A store to a byte of a translated instruction ends the block after
+the store and invalidates every block holding this byte. As a translation costs
+much more than running a block, an address is only translated once it has been
+reached a few times (the instructions are run cycle by cycle before) and never
+again once its block has been invalidated too often (self-modifying loops).
+
+BlockEngine.run() leaves the core in the same state as TurtleCore.run() for the
+same number of cycles: a block is only run if it fits in the remaining cycles,
+the rest is run cycle by cycle. Both can therefore be used in turn on the same
+core (e.g. the block engine to reach a point of interest, then the cycle
+accurate emulator to trace it).
+"""
+import argparse
+import ast
+import operator
+import time
+from control_flags import *
+from control_model import SIGNAL_WRITES, BRK_VECTOR_STEPS, BRK_OPCODE
+from emulator import Microcode, TurtleCore, FLAG_SELECT_MASKS, MEMORY_SIZE, microcycle_lines
+from microcode_optimizer import overlap_fetch
+from pla_generator import build_instructions
+
+BLOCK_MAX_INSTRUCTIONS = 64
+# Executions of an address before its block is translated, invalidations of a block before its address stays run cycle by cycle
+TRANSLATE_THRESHOLD = 4
+MAX_INVALIDATIONS = 4
+MICRO_CYCLES = 16
+# Bytes marked as code after an instruction with an unknown length (longest 6502 instruction)
+MAX_INSTRUCTION_LENGTH = 3
+
+REGISTERS = ("dl", "dor", "pcl", "pch", "pcls", "pchs", "abl", "abh", "s", "x", "y", "ac", "p", "ai", "bi", "add", "ir")
+
+# Signals writing the processor status bit sampled by the flag select PLA {mask: signals}
+STATUS_WRITERS = {
+    mask: sum(signal for signal, registers in SIGNAL_WRITES.items() if name in registers)
+    for mask, name in ((0x01, "C"), (0x02, "Z"), (0x04, "I"), (0x08, "D"), (0x40, "V"), (0x80, "N"))
+}
+
+
+# Operators folded when both operands are constants
+_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.BitAnd: operator.and_, ast.BitOr: operator.or_, ast.BitXor: operator.xor,
+    ast.LShift: operator.lshift, ast.RShift: operator.rshift, ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt, ast.LtE: operator.le,
+}
+
+
+def _names(node: ast.AST) -> set[str]:
+    return {child.id for child in ast.walk(node) if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load)}
+
+
+class _Substitute(ast.NodeTransformer):
+    """
+    This class replaces the names with a known value (constant or copied name) and folds the constant expressions.
+    """
+
+    def __init__(self, values: dict[str, ast.expr]):
+        self.values = values
+
+    def visit_Name(self, node: ast.Name) -> ast.expr:
+        value = self.values.get(node.id) if isinstance(node.ctx, ast.Load) else None
+        return ast.copy_location(type(value)(**{field: getattr(value, field) for field in value._fields}), node) if value is not None else node
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.expr:
+        node = self.generic_visit(node)
+        if isinstance(node.left, ast.Constant) and isinstance(node.right, ast.Constant):
+            return ast.copy_location(ast.Constant(_OPERATORS[type(node.op)](node.left.value, node.right.value)), node)
+        return node
+
+    def visit_Compare(self, node: ast.Compare) -> ast.expr:
+        node = self.generic_visit(node)
+        if isinstance(node.left, ast.Constant) and len(node.comparators) == 1 and isinstance(node.comparators[0], ast.Constant):
+            return ast.copy_location(ast.Constant(_OPERATORS[type(node.ops[0])](node.left.value, node.comparators[0].value)), node)
+        return node
+
+    def visit_IfExp(self, node: ast.IfExp) -> ast.expr:
+        node = self.generic_visit(node)
+        if isinstance(node.test, ast.Constant):
+            return node.body if node.test.value else node.orelse
+        return node
+
+
+def _forget(values: dict[str, ast.expr], name: str) -> None:
+    values.pop(name, None)
+    for other in [other for other, value in values.items() if isinstance(value, ast.Name) and value.id == name]:
+        del values[other]
+
+
+def _propagate(statements: list[ast.stmt], values: dict[str, ast.expr]) -> list[ast.stmt]:
+    """
+    This function propagates the constants and copies of a statement list (values holds the known values on entry and on exit).
+    """
+    result = []
+    for statement in statements:
+        if isinstance(statement, ast.Assign):
+            statement.value = _Substitute(values).visit(statement.value)
+            for target in statement.targets:
+                if isinstance(target, ast.Name):
+                    _forget(values, target.id)
+                else:
+                    _Substitute(values).visit(target)
+            if isinstance(statement.value, ast.Name) and [target.id for target in statement.targets if isinstance(target, ast.Name)] == [statement.value.id]:
+                continue
+            for target in statement.targets:
+                if isinstance(target, ast.Name) and isinstance(statement.value, (ast.Constant, ast.Name)) and _names(statement.value).isdisjoint({target.id}):
+                    values[target.id] = statement.value
+        elif isinstance(statement, ast.AugAssign):
+            value = _Substitute(values).visit(ast.BinOp(ast.Name(statement.target.id, ast.Load()), statement.op, statement.value))
+            _forget(values, statement.target.id)
+            if isinstance(value, ast.Constant):
+                statement = ast.copy_location(ast.Assign([statement.target], value), statement)
+                values[statement.targets[0].id] = value
+        elif isinstance(statement, ast.If):
+            statement.test = _Substitute(values).visit(statement.test)
+            if isinstance(statement.test, ast.Constant):
+                result += _propagate(statement.body if statement.test.value else statement.orelse, values)
+                continue
+            branches = []
+            for branch in ("body", "orelse"):
+                branch_values = dict(values)
+                setattr(statement, branch, _propagate(getattr(statement, branch), branch_values))
+                branches.append(branch_values)
+            values.clear()
+            values.update({name: value for name, value in branches[0].items() if name in branches[1] and ast.dump(branches[1][name]) == ast.dump(value)})
+        else:
+            _Substitute(values).visit(statement)
+        result.append(statement)
+    return result
+
+
+def _eliminate(statements: list[ast.stmt], live: set[str]) -> list[ast.stmt]:
+    """
+    This function removes the assignments of names which are not read afterwards (live holds the names read after the statements).
+    """
+    result = []
+    for statement in reversed(statements):
+        if isinstance(statement, ast.Return):
+            live.clear()
+            live |= _names(statement)
+        elif isinstance(statement, ast.Assign):
+            statement.targets = [target for target in statement.targets if not isinstance(target, ast.Name) or target.id in live]
+            if not statement.targets:
+                continue
+            for target in statement.targets:
+                if isinstance(target, ast.Name):
+                    live.discard(target.id)
+                else:
+                    live |= _names(target)
+            live |= _names(statement.value)
+        elif isinstance(statement, ast.AugAssign):
+            if statement.target.id not in live:
+                continue
+            live |= _names(statement.value)
+        elif isinstance(statement, ast.If):
+            branch_live = []
+            for branch in ("body", "orelse"):
+                names = set(live)
+                setattr(statement, branch, _eliminate(getattr(statement, branch), names))
+                branch_live.append(names)
+            if not statement.body and not statement.orelse:
+                continue
+            if not statement.body:
+                statement.body = [ast.Pass()]
+            live.clear()
+            live |= branch_live[0] | branch_live[1] | _names(statement.test)
+        else:
+            live |= _names(statement)
+        result.append(statement)
+    return result[::-1]
+
+
+def optimize_source(source: str, live: set[str] | None = None) -> ast.Module:
+    """
+    This function returns the syntax tree of a generated function with its constants propagated and its dead assignments removed (live: names still read after the function body).
+    """
+    module = ast.parse(source)
+    function = module.body[0]
+    body = _propagate(function.body, {})
+    # A register written back unchanged (cpu.x = r_x with r_x only loaded from cpu.x) is not stored
+    written = [node for node in ast.walk(ast.Module(body, [])) if isinstance(node, ast.Assign)]
+    loads = {node.targets[0].id: node.value.attr for node in body if isinstance(node, ast.Assign) and isinstance(node.value, ast.Attribute)}
+    changed = {target.id for node in written for target in node.targets if isinstance(target, ast.Name) and not (target.id in loads and isinstance(node.value, ast.Attribute))}
+
+    class _Unchanged(ast.NodeTransformer):
+        def visit_Assign(self, node: ast.Assign) -> ast.Assign | None:
+            target = node.targets[0]
+            if isinstance(target, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id not in changed and loads.get(node.value.id) == target.attr:
+                return None
+            return node
+    function.body = _eliminate(_Unchanged().visit(ast.Module(body, [])).body, set(live or ()))
+    return ast.fix_missing_locations(module)
+
+
+class Block:
+    """
+    This class represents a translated basic block.
+    """
+
+    def __init__(self, address: int, function, instructions: int, max_cycles: int, code: list[int]):
+        self.address = address
+        self.function = function
+        self.instructions = instructions
+        self.max_cycles = max_cycles
+        # Addresses of the bytes of the translated instructions
+        self.code = code
+
+
+class BlockTranslator:
+    """
+    This class translates the instructions of a memory into Python functions applying their micro cycles.
+    """
+
+    def __init__(self, microcode: Microcode):
+        self.microcode = microcode
+        self.flag_masks = [FLAG_SELECT_MASKS[flag & 0x7] for flag in microcode.flag_select]
+        # BRK is never fused, its fetch row is the plain opcode fetch
+        self.fetch_word = microcode.decode[BRK_OPCODE << 5]
+        self.__instructions: dict[tuple[int, int], tuple[list[str], list[int], list[int]]] = {}
+
+    def instruction_lines(self, opcode: int, previous: int = BRK_OPCODE) -> tuple[list[str], list[int], list[int]]:
+        """
+        This function returns the statements of an instruction (micro cycle 0 up to its reset cycle), and the cycles and program counter increments of every flag path.
+        The fetch row (micro cycle 0) is selected by the previous opcode, whose last cycle may have been carried into it by the fusion (on every flag path).
+        """
+        mask = self.flag_masks[opcode]
+        lines: list[str] = []
+        cycles: list[int] = []
+        increments: list[int] = []
+
+        def emit(micro_counter: int, flag: int | None, indent: str, spent: int, increment: int) -> None:
+            while micro_counter < MICRO_CYCLES:
+                address = (previous if micro_counter == 0 else opcode) << 5 | micro_counter
+                words = (self.microcode.decode[address], self.microcode.decode[address | 16])
+                if mask != 0 and words[0] != words[1] and flag is None:
+                    lines.append(f"{indent}if r_p & 0x{mask:02x}:")
+                    emit(micro_counter, 1, indent + "    ", spent, increment)
+                    lines.append(f"{indent}else:")
+                    emit(micro_counter, 0, indent + "    ", spent, increment)
+                    return
+                word = words[flag or 0]
+                vector = None
+                brk_cycle = micro_counter + 1 - self.microcode.ir_load_cycle
+                if opcode == BRK_OPCODE and brk_cycle in BRK_VECTOR_STEPS:
+                    vector = self.microcode.vectors[BRK_VECTOR_STEPS[brk_cycle]]
+                statements = microcycle_lines(word, micro_counter == self.microcode.ir_load_cycle, vector, opcode == BRK_OPCODE, "r_")
+                if word & RW:
+                    # The store is the second statement (after the address)
+                    statements.insert(2, "    if code[ab]:\n        written.append(ab)")
+                lines.extend(indent + statement[4:].replace("\n    ", "\n" + indent) for statement in statements)
+                spent += 1
+                increment += 1 if word & I_PC else 0
+                if mask != 0 and word & STATUS_WRITERS.get(mask, 0):
+                    flag = None
+                if word & RST_CYCLE:
+                    break
+                micro_counter += 1
+            # Reset cycle (or micro counter wrapping around)
+            lines.append(f"{indent}elapsed += {spent}")
+            cycles.append(spent)
+            increments.append(increment)
+
+        emit(0, None, "    ", 0, 0)
+        return lines, cycles, increments
+
+    def instruction(self, opcode: int, previous: int = BRK_OPCODE) -> tuple[list[str], list[int], list[int]]:
+        """
+        This function returns instruction_lines() of an opcode simplified alone (every register is read afterwards), the blocks are then simplified from these smaller statements.
+        """
+        instruction = self.__instructions.get((opcode, previous))
+        if instruction is None:
+            lines, cycles, increments = self.instruction_lines(opcode, previous)
+            live = {f"r_{register}" for register in REGISTERS} | {"elapsed"}
+            function = optimize_source("\n".join(["def instruction():"] + lines) + "\n", live).body[0]
+            source = "\n".join(ast.unparse(statement) for statement in function.body)
+            instruction = self.__instructions[opcode, previous] = (["    " + line for line in source.splitlines()], cycles, increments)
+        return instruction
+
+    def translate(self, memory, address: int, max_instructions: int = BLOCK_MAX_INSTRUCTIONS) -> Block:
+        """
+        This function translates the basic block whose first opcode is at address.
+        """
+        lines = ["def block(cpu, mem, code, written):", "    elapsed = 0"]
+        lines += [f"    r_{register} = cpu.{register}" for register in REGISTERS]
+        store = [f"    cpu.{register} = r_{register}" for register in REGISTERS] + ["    cpu.mc = 0"]
+        code: list[int] = []
+        max_cycles = 0
+        instructions = 0
+        # A block starts at a plain fetch row (BlockEngine.run)
+        previous = BRK_OPCODE
+        while instructions < max_instructions:
+            opcode = memory[address]
+            instruction, cycles, increments = self.instruction(opcode, previous)
+            previous = opcode
+            lines += instruction
+            instructions += 1
+            max_cycles += max(cycles)
+            length = increments[0] if len(set(increments)) == 1 else MAX_INSTRUCTION_LENGTH
+            code += [(address + offset) & 0xFFFF for offset in range(max(1, min(length, MAX_INSTRUCTION_LENGTH)))]
+            words = [self.microcode.decode[opcode << 5 | flag << 4 | micro_counter] for flag in (0, 1) for micro_counter in range(MICRO_CYCLES)]
+            if any(word & RW for word in words):
+                lines += ["    if written:"] + ["    " + statement for statement in store] + [f"        return elapsed, {instructions}"]
+            # The next instruction is only known if the program counter is incremented the same way by every flag path
+            if any(word & (ADL_PCL | ADH_PCH) for word in words) or len(set(increments)) != 1 or address + length > 0xFFFF:
+                break
+            address += length
+        lines += store + [f"    return elapsed, {instructions}"]
+        namespace: dict = {}
+        exec(compile(optimize_source("\n".join(lines) + "\n"), f"<block {code[0]:04x}>", "exec"), namespace)
+        return Block(code[0], namespace["block"], instructions, max_cycles, code)
+
+
+class BlockEngine:
+    """
+    This class runs a TurtleCore block by block, the same core can be run cycle by cycle between two runs.
+    """
+
+    def __init__(self, core: TurtleCore):
+        self.core = core
+        self.translator = BlockTranslator(core.microcode)
+        self.blocks: dict[int, Block] = {}
+        self.instructions = 0
+        self.translations = 0
+        self.invalidations = 0
+        # Number of translated blocks holding every byte of the memory
+        self.__code = bytearray(MEMORY_SIZE)
+        self.__written: list[int] = []
+        # Executions of the addresses not translated yet and invalidations of every block address
+        self.__hits: dict[int, int] = {}
+        self.__invalidated: dict[int, int] = {}
+        # Code read from memory mapped devices (memory_map.MemoryMap) is never translated
+        self.__is_device = getattr(core.memory, "is_device", None)
+
+    def entry_address(self) -> int:
+        """
+        This function returns the address of the next opcode (at an instruction boundary).
+        """
+        core = self.core
+        # With the fetch/execute overlap the opcode has been fetched by the previous instruction
+        return core.abh << 8 | core.abl if self.core.microcode.fetch_overlap else core.pc
+
+    def block(self, address: int) -> Block | None:
+        """
+        This function returns the translated block at address, or None while the address should still be run cycle by cycle.
+        """
+        block = self.blocks.get(address)
+        if block is None:
+            hits = self.__hits[address] = self.__hits.get(address, 0) + 1
+            # Cold code and code rewritten again and again are not worth a translation
+            if hits < TRANSLATE_THRESHOLD or self.__invalidated.get(address, 0) >= MAX_INVALIDATIONS:
+                return None
+            block = self.translator.translate(self.core.memory, address)
+            if self.__is_device is not None and any(self.__is_device(byte) for byte in block.code):
+                self.__invalidated[address] = MAX_INVALIDATIONS
+                return None
+            self.blocks[address] = block
+            for byte in block.code:
+                self.__code[byte] += 1
+            self.translations += 1
+        return block
+
+    def invalidate(self, address: int) -> None:
+        """
+        This function drops the translated blocks holding the byte at address.
+        """
+        for start, block in list(self.blocks.items()):
+            if address in block.code:
+                del self.blocks[start]
+                for byte in block.code:
+                    self.__code[byte] -= 1
+                self.__invalidated[start] = self.__invalidated.get(start, 0) + 1
+                self.invalidations += 1
+
+    def forget(self, pages: set[int]) -> None:
+        """
+        This function drops the translated blocks holding bytes of pages replaced outside of the program (snapshot restore), without counting them as invalidations.
+        """
+        for start, block in list(self.blocks.items()):
+            if any(byte >> 8 in pages for byte in block.code):
+                del self.blocks[start]
+                for byte in block.code:
+                    self.__code[byte] -= 1
+
+    def run(self, cycles: int) -> None:
+        core = self.core
+        memory = core.memory
+        code = self.__code
+        written = self.__written
+        blocks = self.blocks
+        fetch_word = self.translator.fetch_word
+        while cycles > 0:
+            # Finish the current instruction cycle by cycle
+            while cycles > 0 and core.mc != 0:
+                core.step()
+                cycles -= 1
+            if cycles == 0:
+                break
+            # The last cycle of the previous instruction carried into the fetch by the fusion is run cycle by cycle
+            if core.control_word != fetch_word:
+                core.step()
+                cycles -= 1
+                continue
+            address = self.entry_address()
+            block = blocks.get(address) or self.block(address)
+            if block is None:
+                core.step()
+                cycles -= 1
+                continue
+            if block.max_cycles > cycles:
+                break
+            elapsed, instructions = block.function(core, memory, code, written)
+            cycles -= elapsed
+            core.cycles += elapsed
+            self.instructions += instructions
+            if written:
+                for address in set(written):
+                    self.invalidate(address)
+                written.clear()
+        core.run(cycles)
+
+
+def compare_cores(core: TurtleCore, reference: TurtleCore) -> list[str]:
+    """
+    This function returns the registers (and "memory") of a core which differ from a reference core.
+    """
+    differences = [register for register in REGISTERS + ("mc", "cycles") if getattr(core, register) != getattr(reference, register)]
+    if core.memory != reference.memory:
+        differences.append("memory")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a binary on the Turtle Core microcode, translated block by block.")
+    parser.add_argument("binary", help="binary image loaded at the ROM start ($8000)")
+    parser.add_argument("--cycles", type=int, default=10_000_000, help="number of microcycles to run")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--generate", action="store_true", help="build the microcode from pla_generator instead of the PLA files")
+    parser.add_argument("--fetch-overlap", action="store_true", help="microcode generated with the fetch/execute overlap")
+    parser.add_argument("--switch", type=int, metavar="CYCLES", help="alternate the block and the cycle accurate engines every CYCLES microcycles")
+    parser.add_argument("--check", action="store_true", help="compare the final state with the cycle accurate emulator")
+    args = parser.parse_args()
+
+    if args.generate:
+        instructions = build_instructions()
+        if args.fetch_overlap:
+            for instruction in instructions:
+                overlap_fetch(instruction)
+        microcode = Microcode.from_instructions(instructions, args.fetch_overlap)
+    else:
+        microcode = Microcode.from_directory(args.pla_dir, args.fetch_overlap)
+    with open(args.binary, "rb") as file:
+        image = file.read()
+    core = TurtleCore(microcode)
+    core.load(image)
+    core.reset()
+    engine = BlockEngine(core)
+
+    start = time.perf_counter()
+    if args.switch is None:
+        engine.run(args.cycles)
+    else:
+        remaining, block_turn = args.cycles, True
+        while remaining > 0:
+            cycles = min(args.switch, remaining)
+            if block_turn:
+                engine.run(cycles)
+            else:
+                core.run(cycles)
+            remaining -= cycles
+            block_turn = not block_turn
+    elapsed = time.perf_counter() - start
+
+    print(core)
+    print(f"{args.cycles} microcycles in {elapsed:.3f}s ({args.cycles / elapsed:,.0f} microcycles/s, {engine.instructions / elapsed:,.0f} instructions/s in blocks)")
+    print(f"{len(engine.blocks)} blocks cached, {engine.translations} translations, {engine.invalidations} invalidations")
+
+    if args.check:
+        reference = TurtleCore(microcode)
+        reference.load(image)
+        reference.reset()
+        reference.run(args.cycles)
+        differences = compare_cores(core, reference)
+        print(f"Differences with the cycle accurate emulator: {', '.join(differences) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1187 @@
+# pylint: disable=line-too-long
+"""
+This module contains a compiler of the Logisim netlist (8bit_CPU.circ) into a
+levelized bit-parallel evaluator, which runs the hardware description without
+the Logisim GUI.
+
+- load_project() parses the circuits of the .circ file (components, wires and
+  custom appearance of the subcircuits).
+- component_ports() places the ports of a component like Logisim Evolution 3.7
+  does from its attributes (facing, size, inputs, fanout, appearance...). The
+  ports of a subcircuit come from its custom appearance or from the default
+  logisim_evolution one.
+- flatten() joins the wires and the tunnels into nets, splits every net into
+  bit nodes (a splitter only joins bits) and inlines the subcircuits, so the
+  netlist is a list of primitive components connected by bit nodes.
+- compile_netlist() levelizes the netlist (the registers, the counter and the
+  flip-flop are the state, the other components are sorted topologically) and
+  generates one Python function evaluating it level by level, every port being
+  an integer computed with bitmask operations. The bits driven by controlled
+  buffers are resolved as the AND of the enabled drivers (an undriven bit takes
+  the value of its pull resistor), like the wired-AND buses of the emulator. A
+  combinational loop (buses bridged by buffers in both directions) is iterated
+  until it is stable.
+- The generated function settles the circuit: after every evaluation the edge
+  triggered elements whose clock rose latch their input (all at once) and the
+  asynchronous clears are applied, until the state does not change any more.
+
+The PLA components load the table of PLAs/ given by their label (the tables
+stored in the .circ are copies made by Logisim when a table is loaded and may
+be stale, --embedded-tables uses them anyway).
+
+GateLevelCore runs the TCORE circuit with the memory of the emulators instead
+of the main test bench of the GUI (RAM, ROM, clock and power on reset): the
+memory is read asynchronously at ADDR and written at the rising edge of CLCK
+when RW is set.
+
+Differences with Logisim: the values have two states (a floating input reads
+0, a floating enable reads 1 and a conflict is the AND of the drivers instead
+of an error), there is no propagation delay and only the components used by
+the project are modeled. The empty RST_CYCLE rows of the microcode clear the
+micro counter asynchronously, so they take no clock cycle in the circuit while
+the emulator charges them one cycle.
+"""
+import argparse
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from emulator import Microcode, TurtleCore, MEMORY_SIZE, ROM_START
+from pla_tables import parse_pla, compile_pla, get_pla_widths
+
+CORE_CIRCUIT = "TCORE"
+CORE_PINS = {"clock": "CLCK", "reset": "RSTb", "data_in": "DATA_IN", "data_out": "DATA_OUT", "rw": "RW", "address": "ADDR"}
+PLA_FILES = {"DecodePLA": "DecodePLA.txt", "FlagSelect": "DecodePLA_flagSelect.txt", "ResetPLA": "ResetPLA.txt", "IRQPLA": "IRQPLA.txt", "Vectors": "Vectors.txt"}
+# Distance between the west and the east ports of the default appearance (box of fixed size)
+SUBCIRCUIT_WIDTH = 220
+SETTLE_LIMIT = 64
+RESET_CYCLES = 2
+REVERSE = {"east": "west", "west": "east", "north": "south", "south": "north"}
+
+
+class Component:
+    """
+    This class represents a component of a circuit (lib is None for a subcircuit).
+    """
+
+    def __init__(self, name: str, lib: str | None, loc: tuple[int, int], attributes: dict[str, str]):
+        self.name = name
+        self.lib = lib
+        self.loc = loc
+        self.attributes = attributes
+
+    def get(self, name: str, default: str | None) -> str | None:
+        return self.attributes.get(name, default)
+
+    def width(self, name: str = "width", default: int = 1) -> int:
+        return int(self.attributes.get(name, default))
+
+    @property
+    def label(self) -> str:
+        return self.attributes.get("label", "") or f"{self.name}{self.loc}"
+
+    def __repr__(self) -> str:
+        return f"{self.name}{self.loc}"
+
+
+class Circuit:
+    """
+    This class holds the components, the wires and the custom appearance ((pin location, port center) pairs) of a circuit.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.components: list[Component] = []
+        self.wires: list[tuple[tuple[int, int], tuple[int, int]]] = []
+        self.appearance: list[tuple[tuple[int, int], tuple[int, int]]] | None = None
+        self.anchor: tuple[int, int] = (0, 0)
+
+
+class Project:
+    def __init__(self, circuits: dict[str, Circuit], main: str):
+        self.circuits = circuits
+        self.main = main
+
+
+def _point(text: str) -> tuple[int, int]:
+    x, y = text.strip("()").split(",")
+    return int(x), int(y)
+
+
+def _center(shape: ElementTree.Element) -> tuple[int, int]:
+    return int(shape.get("x")) + int(shape.get("width")) // 2, int(shape.get("y")) + int(shape.get("height")) // 2
+
+
+def load_project(path: str) -> Project:
+    """
+    This function parses the circuits of a Logisim project file.
+    """
+    root = ElementTree.parse(path).getroot()
+    circuits = {}
+    for element in root.iter("circuit"):
+        circuit = Circuit(element.get("name"))
+        for child in element:
+            if child.tag == "comp":
+                attributes = {attribute.get("name"): attribute.get("val", attribute.text) for attribute in child.iter("a")}
+                circuit.components.append(Component(child.get("name"), child.get("lib"), _point(child.get("loc")), attributes))
+            elif child.tag == "wire":
+                circuit.wires.append((_point(child.get("from")), _point(child.get("to"))))
+            elif child.tag == "appear":
+                circuit.appearance = [(_point(shape.get("pin")), _center(shape)) for shape in child if shape.tag == "circ-port"]
+                circuit.anchor = next(_center(shape) for shape in child if shape.tag == "circ-anchor")
+        circuits[circuit.name] = circuit
+    main = root.find("main")
+    return Project(circuits, main.get("name") if main is not None else next(iter(circuits)))
+
+
+# Port layouts: (name, offset from the location of the component, width) for the attributes of a component
+
+def _rotate(offset: tuple[int, int], facing: str) -> tuple[int, int]:
+    dx, dy = offset
+    return {"east": (dx, dy), "west": (-dx, -dy), "north": (dy, -dx), "south": (-dy, dx)}[facing]
+
+
+def _translate(facing: str, distance: int, right: int = 0) -> tuple[int, int]:
+    return {"east": (distance, right), "west": (-distance, -right), "south": (-right, distance), "north": (right, -distance)}[facing]
+
+
+def _gate_ports(component: Component):
+    facing = component.get("facing", "east")
+    width = component.width()
+    size = int(component.get("size", "50"))
+    inputs = int(component.get("inputs", "2"))
+    # XOR gates have a wider back, negated outputs a bubble
+    axis = size + (10 if component.name in ("XOR Gate", "XNOR Gate") else 0) + (10 if component.name in ("NAND Gate", "NOR Gate", "XNOR Gate") else 0)
+    if inputs <= 3:
+        if size < 40:
+            start, distance, lower = -5, 10, 10
+        elif size < 60 or inputs <= 2:
+            start, distance, lower = -10, 20, 20
+        else:
+            start, distance, lower = -15, 30, 30
+    elif inputs == 4 and size >= 60:
+        start, distance, lower = -5, 20, 0
+    else:
+        start, distance, lower = -5, 10, 10
+    ports = [("out", (0, 0), width)]
+    for index in range(inputs):
+        if inputs & 1:
+            dy = start * (inputs - 1) + distance * index
+        else:
+            dy = start * inputs + distance * index + (lower if index >= inputs // 2 else 0)
+        dx = axis + (10 if component.get(f"negate{index}", "false") == "true" else 0)
+        ports.append((f"in{index}", {"north": (dy, dx), "south": (dy, -dx), "west": (dx, dy), "east": (-dx, dy)}[facing], width))
+    return ports
+
+
+def _not_ports(component: Component):
+    facing = component.get("facing", "east")
+    size = 20 if component.get("size", "30") == "20" else 30
+    return [("out", (0, 0), component.width()), ("in", _translate(REVERSE[facing], size), component.width())]
+
+
+def _buffer_ports(component: Component):
+    facing = component.get("facing", "east")
+    right = 10 if component.get("control", "right") == "left" else -10
+    return [("out", (0, 0), component.width()), ("in", _translate(REVERSE[facing], 20), component.width()),
+            ("enable", _translate(REVERSE[facing], 10, right), 1)]
+
+
+def splitter_distribution(component: Component) -> list[int | None]:
+    """
+    This function returns the end of every bit of a splitter (None if the bit is not connected).
+    """
+    fanout = int(component.get("fanout", "2"))
+    incoming = int(component.get("incoming", "2"))
+    # Default: the bits are spread in ascending order, the first ends get one more bit
+    if fanout >= incoming:
+        ends = list(range(incoming))
+    else:
+        ends = []
+        for end in range(fanout):
+            ends += [end] * (incoming // fanout + (1 if end < incoming % fanout else 0))
+    for bit in range(incoming):
+        value = component.get(f"bit{bit}", None)
+        if value is not None:
+            ends[bit] = None if value == "none" else int(value)
+        elif bit < 2 <= fanout:
+            # Logisim only saves the attributes differing from the factory splitter (2 bits, 2 ends): a missing bit0/bit1 goes to end 0/1
+            ends[bit] = bit
+    return ends
+
+
+def _splitter_ports(component: Component):
+    facing = component.get("facing", "east")
+    fanout = int(component.get("fanout", "2"))
+    appear = component.get("appear", "left")
+    justify = 0 if appear in ("center", "legacy") else 1 if appear == "right" else -1
+    gap = int(component.get("spacing", "1")) * 10
+    if facing in ("north", "south"):
+        m = 1 if facing == "north" else -1
+        x = gap * ((fanout + 1) // 2 - 1) if justify == 0 else -10 if m * justify < 0 else 10 + gap * (fanout - 1)
+        y, dx, dy = -m * 20, -gap, 0
+    else:
+        m = -1 if facing == "west" else 1
+        x = m * 20
+        y = -gap * (fanout // 2) if justify == 0 else 10 if m * justify > 0 else -(10 + gap * (fanout - 1))
+        dx, dy = 0, gap
+    ends = splitter_distribution(component)
+    return [("combined", (0, 0), len(ends))] + [(f"end{end}", (x + dx * end, y + dy * end), ends.count(end)) for end in range(fanout)]
+
+
+def _pla_ports(component: Component):
+    return [("in", (0, 0), component.width("in_width", 2)), ("out", _translate(component.get("facing", "east"), 50), component.width("out_width", 2))]
+
+
+# The memories below use the logisim_evolution appearance (ports around a box anchored at its top left corner)
+
+def _register_ports(component: Component):
+    width = component.width(default=8)
+    return [("in", (0, 30), width), ("enable", (0, 50), 1), ("clock", (0, 70), 1), ("clear", (30, 90), 1), ("out", (60, 30), width)]
+
+
+def _counter_ports(component: Component):
+    width = component.width(default=8)
+    return [("in", (0, 110), width), ("clear", (0, 20), 1), ("load", (0, 30), 1), ("up", (0, 50), 1), ("enable", (0, 70), 1), ("clock", (0, 80), 1), ("out", (190, 110), width)]
+
+
+def _flip_flop_ports(component: Component):
+    return [("in", (-10, 10), 1), ("clock", (-10, 50), 1), ("out", (50, 10), 1), ("inverted", (50, 50), 1), ("clear", (20, 60), 1), ("set", (20, 0), 1)]
+
+
+def _bit_extender_ports(component: Component):
+    ports = [("out", (0, 0), component.width("out_width", 16)), ("in", (-40, 0), component.width("in_width", 8))]
+    if component.get("type", "sign") == "input":
+        ports.append(("extension", (-20, -20), 1))
+    return ports
+
+
+def _adder_ports(component: Component):
+    width = component.width(default=8)
+    return [("out", (0, 0), width), ("in0", (-40, -10), width), ("in1", (-40, 10), width), ("carry_in", (-20, -20), 1), ("carry_out", (-20, 20), 1)]
+
+
+def _shifter_ports(component: Component):
+    width = component.width(default=8)
+    return [("out", (0, 0), width), ("in", (-40, -10), width), ("distance", (-40, 10), max(width - 1, 1).bit_length())]
+
+
+def _multiplexer_ports(component: Component):
+    facing = component.get("facing", "east")
+    select = component.width("select")
+    width = component.width()
+    sign = -1 if component.get("selloc", "bl") == "tr" else 1
+    inputs = 1 << select
+    if inputs == 2:
+        ends, select_location = {"west": (((30, -10), (30, 10)), (20, sign * 20)), "north": (((-10, 30), (10, 30)), (sign * -20, 20)),
+                                 "south": (((-10, -30), (10, -30)), (sign * -20, -20)), "east": (((-30, -10), (-30, 10)), (-20, sign * 20))}[facing]
+    else:
+        start = -(inputs // 2) * 10
+        ends, select_location = {"west": ([(40, start + 10 * index) for index in range(inputs)], (20, sign * (start + 10 * inputs))),
+                                 "north": ([(start + 10 * index, 40) for index in range(inputs)], (sign * start, 20)),
+                                 "south": ([(start + 10 * index, -40) for index in range(inputs)], (sign * start, -20)),
+                                 "east": ([(-40, start + 10 * index) for index in range(inputs)], (-20, sign * (start + 10 * inputs)))}[facing]
+    ports = [(f"in{index}", end, width) for index, end in enumerate(ends)] + [("select", select_location, select)]
+    if component.get("enable", "true") == "true":
+        step = _translate(facing, 10)
+        ports.append(("enable", (select_location[0] + step[0], select_location[1] + step[1]), 1))
+    return ports + [("out", (0, 0), width)]
+
+
+def _decoder_ports(component: Component):
+    facing = component.get("facing", "east")
+    select = component.width("select")
+    outputs = 1 << select
+    start = -10 * outputs if component.get("selloc", "bl") == "tr" else 0
+    if facing in ("north", "south"):
+        ends = [(start + 10 * index, -20 if facing == "north" else 20) for index in range(outputs)]
+    else:
+        ends = [(-20 if facing == "west" else 20, start + 10 * index) for index in range(outputs)]
+    ports = [(f"out{index}", end, 1) for index, end in enumerate(ends)] + [("select", (0, 0), select)]
+    if component.get("enable", "true") == "true":
+        ports.append(("enable", _translate(facing, -10), 1))
+    return ports
+
+
+def _priority_encoder_ports(component: Component):
+    facing = component.get("facing", "east")
+    select = component.width("select")
+    inputs = 1 << select
+    if facing in ("north", "south"):
+        x, y = -5 * inputs + 10, 40 if facing == "north" else -40
+        ends = [(x + 10 * index, y) for index in range(inputs)]
+        extra = [("enable_in", (x + 10 * inputs, y // 2)), ("enable_out", (x - 10, y // 2)), ("group", (10, 0))]
+    else:
+        x, y = -40 if facing == "east" else 40, -5 * inputs + 10
+        ends = [(x, y + 10 * index) for index in range(inputs)]
+        extra = [("enable_in", (x // 2, y + 10 * inputs)), ("enable_out", (x // 2, y - 10)), ("group", (0, 10))]
+    return [(f"in{index}", end, 1) for index, end in enumerate(ends)] + [("out", (0, 0), select)] + [(name, location, 1) for name, location in extra]
+
+
+def _bit_selector_ports(component: Component):
+    facing = component.get("facing", "east")
+    width = component.width(default=8)
+    group = component.width("group")
+    groups = (width + group - 1) // group
+    data, select = {"west": ((30, 0), (10, 10)), "north": ((0, 30), (-10, 10)), "south": ((0, -30), (-10, -10)), "east": ((-30, 0), (-10, 10))}[facing]
+    return [("out", (0, 0), group), ("in", data, width), ("select", select, max(groups - 1, 1).bit_length())]
+
+
+def _single_port(component: Component):
+    return [("io", (0, 0), component.width())]
+
+
+PORT_LAYOUTS = {
+    "AND Gate": _gate_ports, "OR Gate": _gate_ports, "XOR Gate": _gate_ports, "NAND Gate": _gate_ports, "NOR Gate": _gate_ports, "XNOR Gate": _gate_ports,
+    "NOT Gate": _not_ports, "Controlled Buffer": _buffer_ports, "Splitter": _splitter_ports, "PLA": _pla_ports,
+    "Register": _register_ports, "Counter": _counter_ports, "D Flip-Flop": _flip_flop_ports, "Bit Extender": _bit_extender_ports,
+    "Adder": _adder_ports, "Shifter": _shifter_ports, "Multiplexer": _multiplexer_ports, "Decoder": _decoder_ports,
+    "Priority Encoder": _priority_encoder_ports, "BitSelector": _bit_selector_ports,
+}
+
+
+class Port:
+    def __init__(self, name, location: tuple[int, int], width: int):
+        self.name = name
+        self.location = location
+        self.width = width
+
+
+def subcircuit_ports(circuit: Circuit) -> list[tuple[Component, tuple[int, int]]]:
+    """
+    This function returns the (pin, offset from the anchor) pairs of the appearance of a circuit used as a subcircuit.
+    """
+    pins = [component for component in circuit.components if component.name == "Pin"]
+    if circuit.appearance is not None:
+        by_location = {pin.loc: pin for pin in pins}
+        return [(by_location[location], (x - circuit.anchor[0], y - circuit.anchor[1])) for location, (x, y) in circuit.appearance]
+    # Default logisim_evolution appearance: inputs on the west edge and outputs on the east edge (sorted by position), anchored on the first output
+    inputs = sorted((pin for pin in pins if pin.get("output", "false") != "true"), key=lambda pin: (pin.loc[1], pin.loc[0]))
+    outputs = sorted((pin for pin in pins if pin.get("output", "false") == "true"), key=lambda pin: (pin.loc[1], pin.loc[0]))
+    west = -SUBCIRCUIT_WIDTH if outputs else 0
+    return [(pin, (west, 20 * index)) for index, pin in enumerate(inputs)] + [(pin, (0, 20 * index)) for index, pin in enumerate(outputs)]
+
+
+def component_ports(component: Component, project: Project) -> list[Port]:
+    """
+    This function returns the ports of a component at their location in its circuit (the ports of a subcircuit are named after the location of their pin).
+    """
+    x, y = component.loc
+    if component.lib is None:
+        facing = component.get("facing", "east")
+        ports = [(pin.loc, _rotate(offset, facing), pin.width()) for pin, offset in subcircuit_ports(project.circuits[component.name])]
+    else:
+        ports = PORT_LAYOUTS.get(component.name, _single_port)(component)
+    return [Port(name, (x + dx, y + dy), width) for name, (dx, dy), width in ports]
+
+
+# Flattening
+
+class Primitive:
+    """
+    This class represents a component of the flattened netlist, its ports are lists of bit nodes (least significant bit first).
+    """
+
+    def __init__(self, component: Component, path: str, ports: dict[str, list[int]]):
+        self.component = component
+        self.path = path
+        self.ports = ports
+
+    @property
+    def name(self) -> str:
+        return f"{self.path}/{self.component.label}"
+
+
+class Netlist:
+    """
+    This class holds the primitives of a flattened circuit, the pull resistors of its bit nodes and the bit nodes of its pins.
+    """
+
+    def __init__(self, top: str):
+        self.top = top
+        self.parent: list[int] = []
+        self.primitives: list[Primitive] = []
+        self.pulls: dict[int, int] = {}
+        self.inputs: dict[str, list[int]] = {}
+        self.outputs: dict[str, list[int]] = {}
+
+    def add_nodes(self, count: int) -> list[int]:
+        first = len(self.parent)
+        self.parent += range(first, first + count)
+        return list(range(first, first + count))
+
+    def find(self, node: int) -> int:
+        parent = self.parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def join(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[b] = a
+
+    def canonicalize(self) -> None:
+        """
+        This function replaces every bit node by the representative of the nodes joined with it.
+        """
+        for primitive in self.primitives:
+            primitive.ports = {name: [self.find(node) for node in nodes] for name, nodes in primitive.ports.items()}
+        self.pulls = {self.find(node): value for node, value in self.pulls.items()}
+        self.inputs = {name: [self.find(node) for node in nodes] for name, nodes in self.inputs.items()}
+        self.outputs = {name: [self.find(node) for node in nodes] for name, nodes in self.outputs.items()}
+
+
+def pin_name(pin: Component) -> str:
+    return pin.get("label", "") or f"pin_{pin.loc[0]}_{pin.loc[1]}"
+
+
+def _flatten_circuit(project: Project, circuit: Circuit, path: str, netlist: Netlist, external: dict | None) -> None:
+    # Points joined by wires or by tunnels of the same label form a net
+    parent: dict[tuple[int, int], tuple[int, int]] = {}
+
+    def find(point):
+        while parent.get(point, point) != point:
+            point = parent[point]
+        return point
+
+    def join(a, b):
+        a, b = find(a), find(b)
+        if a != b:
+            parent[b] = a
+
+    for a, b in circuit.wires:
+        join(a, b)
+    tunnels = {}
+    for component in circuit.components:
+        if component.name == "Tunnel":
+            join(tunnels.setdefault(component.get("label", ""), component.loc), component.loc)
+
+    placed = [(component, component_ports(component, project)) for component in circuit.components]
+    widths: dict[tuple[int, int], int] = {}
+    for _, ports in placed:
+        for port in ports:
+            net = find(port.location)
+            widths[net] = max(widths.get(net, 0), port.width)
+    nets = {net: netlist.add_nodes(width) for net, width in widths.items()}
+
+    def nodes(port: Port) -> list[int]:
+        return nets[find(port.location)][:port.width]
+
+    for component, ports in placed:
+        if component.lib is None:
+            child = project.circuits[component.name]
+            _flatten_circuit(project, child, f"{path}/{component.label}", netlist, {port.name: nodes(port) for port in ports})
+        elif component.name == "Splitter":
+            combined = nodes(ports[0])
+            ends = [nodes(port) for port in ports[1:]]
+            used = [0] * len(ends)
+            for bit, end in enumerate(splitter_distribution(component)):
+                if end is not None:
+                    netlist.join(combined[bit], ends[end][used[end]])
+                    used[end] += 1
+        elif component.name == "Pin":
+            if external is not None:
+                for a, b in zip(nodes(ports[0]), external[component.loc]):
+                    netlist.join(a, b)
+            elif component.get("output", "false") == "true":
+                netlist.outputs[pin_name(component)] = nodes(ports[0])
+            else:
+                netlist.inputs[pin_name(component)] = nodes(ports[0])
+        elif component.name == "Pull Resistor":
+            # A pull resistor takes the width of its net
+            if component.get("pull", "0") in ("0", "1"):
+                for node in nets[find(component.loc)]:
+                    netlist.pulls[node] = int(component.get("pull", "0"))
+        elif component.name in ("Tunnel", "NoConnect", "Probe", "Text"):
+            continue
+        elif component.name in _Compiler.PRIMITIVES:
+            netlist.primitives.append(Primitive(component, path, {port.name: nodes(port) for port in ports}))
+        else:
+            raise ValueError(f"{path}: {component.name} at {component.loc} is not supported")
+
+
+def flatten(project: Project, top: str = CORE_CIRCUIT) -> Netlist:
+    """
+    This function flattens a circuit and its subcircuits into a netlist of primitives connected by bit nodes.
+    """
+    netlist = Netlist(top)
+    _flatten_circuit(project, project.circuits[top], top, netlist, None)
+    netlist.canonicalize()
+    return netlist
+
+
+def load_pla_tables(netlist: Netlist, pla_dir: str | None) -> dict[str, list[tuple[str, int]]]:
+    """
+    This function returns the rows of every PLA of a netlist, read from pla_dir (or from the .circ if pla_dir is None).
+    """
+    tables = {}
+    for primitive in netlist.primitives:
+        component = primitive.component
+        if component.name != "PLA":
+            continue
+        text = component.get("table", "")
+        if pla_dir is not None:
+            with open(f"{pla_dir}/{PLA_FILES[component.label]}", "r", encoding="utf-8") as file:
+                text = file.read()
+        if get_pla_widths(text) != (component.width("in_width", 2), component.width("out_width", 2)):
+            raise ValueError(f"the table of {primitive.name} does not have the widths of the PLA")
+        tables[primitive.name] = parse_pla(text)
+    return tables
+
+
+# Code generation
+
+def _mask(width: int) -> str:
+    return f"0x{(1 << width) - 1:x}"
+
+
+class _Node:
+    """
+    This class represents the statements computing some variables of the evaluator from other variables.
+    """
+
+    def __init__(self, targets: list[str], lines: list[str], dependencies: set[str]):
+        self.targets = targets
+        self.lines = lines
+        self.dependencies = dependencies
+
+
+class _Sequential:
+    def __init__(self, primitive: Primitive, variable: str, width: int):
+        self.primitive = primitive
+        self.variable = variable
+        self.width = width
+
+
+class _Compiler:
+    """
+    This class generates the statements of the evaluator of a netlist.
+    """
+
+    PRIMITIVES = {"AND Gate", "OR Gate", "XOR Gate", "NAND Gate", "NOR Gate", "XNOR Gate", "NOT Gate", "Controlled Buffer", "PLA",
+                  "Register", "Counter", "D Flip-Flop", "Bit Extender", "Adder", "Shifter", "Multiplexer", "Decoder",
+                  "Priority Encoder", "BitSelector", "Constant", "Ground", "Power"}
+    SEQUENTIAL = {"Register", "Counter", "D Flip-Flop"}
+
+    def __init__(self, netlist: Netlist, tables: dict[str, list[tuple[str, int]]]):
+        self.netlist = netlist
+        self.namespace: dict[str, object] = {}
+        self.widths: dict[str, int] = {}
+        self.nodes: list[_Node] = []
+        self.sequential: list[_Sequential] = []
+        # Drivers of every bit node: (variable or None for a constant, bit or constant value, enable variable or None)
+        self.drivers: dict[int, list[tuple[str | None, int, str | None]]] = {}
+        self.sources: dict[int, tuple[str | None, int]] = {}
+        self.pins = sorted(netlist.inputs)
+        for index, name in enumerate(self.pins):
+            self._drive(f"p{index}", netlist.inputs[name])
+        for index, primitive in enumerate(netlist.primitives):
+            self._declare(index, primitive, tables)
+        self._resolve()
+        for index, primitive in enumerate(netlist.primitives):
+            getattr(self, "_" + primitive.component.name.split()[0].replace("-", "_").lower())(index, primitive)
+
+    def _drive(self, variable: str, nodes: list[int], enable: str | None = None) -> None:
+        self.widths[variable] = len(nodes)
+        for bit, node in enumerate(nodes):
+            self.drivers.setdefault(node, []).append((variable, bit, enable))
+
+    def _declare(self, index: int, primitive: Primitive, tables: dict) -> None:
+        """
+        This function declares the variables driven by the outputs of a primitive.
+        """
+        component, ports = primitive.component, primitive.ports
+        name = component.name
+        if name in self.SEQUENTIAL:
+            variable = f"q{len(self.sequential)}"
+            self.sequential.append(_Sequential(primitive, variable, len(ports["out"])))
+            self._drive(variable, ports["out"])
+            if name == "D Flip-Flop":
+                self._drive(f"v{index}", ports["inverted"])
+        elif name in ("Constant", "Ground", "Power"):
+            width = len(ports["io"])
+            value = int(component.get("value", "0x1"), 0) if name == "Constant" else (1 << width) - 1 if name == "Power" else 0
+            for bit, node in enumerate(ports["io"]):
+                self.drivers.setdefault(node, []).append((None, value >> bit & 1, None))
+        elif name == "Controlled Buffer":
+            self._drive(f"b{index}", ports["out"], f"e{index}" if self.connected(ports["enable"]) else None)
+        elif name in ("Adder", "Decoder", "Priority Encoder"):
+            for port, nodes in ports.items():
+                if port.startswith("out") or port in ("carry_out", "group", "enable_out"):
+                    self._drive(f"v{index}_{port}", nodes)
+        else:
+            if name == "PLA":
+                rows = tables[primitive.name]
+                mask = (1 << len(ports["out"])) - 1
+                self.namespace[f"T{index}"] = tuple(value & mask for value in compile_pla(rows, 1 << len(ports["in"])))
+            self._drive(f"v{index}", ports["out"])
+
+    def connected(self, nodes: list[int]) -> bool:
+        return any(node in self.drivers or node in self.netlist.pulls for node in nodes)
+
+    def _resolve(self) -> None:
+        """
+        This function gives a source to every driven bit node, the bits driven by several drivers or by buffers are gathered into resolved words.
+        """
+        groups: dict[tuple, list[int]] = {}
+        for node, drivers in self.drivers.items():
+            if len(drivers) == 1 and drivers[0][2] is None:
+                self.sources[node] = drivers[0][:2]
+            elif all(variable is None and enable is None for variable, _, enable in drivers):
+                self.sources[node] = (None, min(value for _, value, _ in drivers))
+            else:
+                key = (tuple(sorted({(variable, enable) for variable, _, enable in drivers}, key=str)), self.netlist.pulls.get(node, 0))
+                groups.setdefault(key, []).append(node)
+        for (drivers, pull), nodes in groups.items():
+            variable = f"w{len(self.nodes)}"
+            nodes.sort(key=lambda node: self.drivers[node][0][1])
+            width = len(nodes)
+            terms, enables, dependencies = [], [], set()
+            for driver, enable in drivers:
+                bits = [next(bit for source, bit, condition in self.drivers[node] if (source, condition) == (driver, enable)) for node in nodes]
+                if driver is None:
+                    term = f"0x{sum(bit << position for position, bit in enumerate(bits)):x}"
+                else:
+                    term = self._gather([(driver, bit) for bit in bits])
+                    dependencies.add(driver)
+                if enable is not None:
+                    term = f"({term} if {enable} else {_mask(width)})"
+                    enables.append(enable)
+                    dependencies.add(enable)
+                terms.append(term)
+            expression = " & ".join(terms)
+            if len(enables) == len(drivers) and pull == 0:
+                # Undriven bits read 0 (the value of a pull down, or a floating bit)
+                expression = f"({expression}) if ({' or '.join(enables)}) else 0"
+            self.nodes.append(_Node([variable], [f"{variable} = {expression}"], dependencies))
+            self.widths[variable] = width
+            for position, node in enumerate(nodes):
+                self.sources[node] = (variable, position)
+
+    def _gather(self, sources: list[tuple[str | None, int]]) -> str:
+        """
+        This function returns the expression of the bits given by their (variable, bit) sources ((None, value) for a constant bit).
+        """
+        terms = []
+        constant = 0
+        position = 0
+        while position < len(sources):
+            variable, low = sources[position]
+            if variable is None:
+                constant |= low << position
+                position += 1
+                continue
+            start = position
+            while position + 1 < len(sources) and sources[position + 1] == (variable, low + position + 1 - start):
+                position += 1
+            position += 1
+            count = position - start
+            term = variable if low == 0 else f"({variable} >> {low})"
+            if low + count < self.widths[variable]:
+                term = f"({term} & {_mask(count)})"
+            if start > 0:
+                term = f"({term} << {start})"
+            terms.append(term)
+        if constant or not terms:
+            terms.append(f"0x{constant:x}")
+        return terms[0] if len(terms) == 1 else f"({' | '.join(terms)})"
+
+    def expression(self, nodes: list[int]) -> tuple[str, set[str]]:
+        """
+        This function returns the expression of a port and the variables it reads (an undriven bit reads its pull resistor or 0).
+        """
+        sources = [self.sources.get(node, (None, self.netlist.pulls.get(node, 0))) for node in nodes]
+        return self._gather(sources), {variable for variable, _ in sources if variable is not None}
+
+    def _inputs(self, primitive: Primitive, *names: str) -> tuple[list[str], set[str]]:
+        expressions, dependencies = [], set()
+        for name in names:
+            expression, variables = self.expression(primitive.ports[name])
+            expressions.append(expression)
+            dependencies |= variables
+        return expressions, dependencies
+
+    def _emit(self, targets: list[str], lines: list[str], dependencies: set[str]) -> None:
+        self.nodes.append(_Node(targets, lines, dependencies))
+
+    # Combinational primitives
+
+    def _gate(self, index: int, primitive: Primitive, operator: str, negate: bool) -> None:
+        component = primitive.component
+        width = len(primitive.ports["out"])
+        names = [name for name in primitive.ports if name.startswith("in") and self.connected(primitive.ports[name])]
+        expressions, dependencies = self._inputs(primitive, *names)
+        expressions = [f"({expression} ^ {_mask(width)})" if component.get(f"negate{name[2:]}", "false") == "true" else expression for name, expression in zip(names, expressions)]
+        expression = f" {operator} ".join(expressions) or "0"
+        if negate:
+            expression = f"({expression}) ^ {_mask(width)}"
+        self._emit([f"v{index}"], [f"v{index} = {expression}"], dependencies)
+
+    def _and(self, index: int, primitive: Primitive) -> None:
+        self._gate(index, primitive, "&", False)
+
+    def _or(self, index: int, primitive: Primitive) -> None:
+        self._gate(index, primitive, "|", False)
+
+    def _xor(self, index: int, primitive: Primitive) -> None:
+        self._gate(index, primitive, "^", False)
+
+    def _nand(self, index: int, primitive: Primitive) -> None:
+        self._gate(index, primitive, "&", True)
+
+    def _nor(self, index: int, primitive: Primitive) -> None:
+        self._gate(index, primitive, "|", True)
+
+    def _xnor(self, index: int, primitive: Primitive) -> None:
+        self._gate(index, primitive, "^", True)
+
+    def _not(self, index: int, primitive: Primitive) -> None:
+        (value,), dependencies = self._inputs(primitive, "in")
+        self._emit([f"v{index}"], [f"v{index} = {value} ^ {_mask(len(primitive.ports['out']))}"], dependencies)
+
+    def _controlled(self, index: int, primitive: Primitive) -> None:
+        (value, enable), dependencies = self._inputs(primitive, "in", "enable")
+        lines = [f"b{index} = {value}"]
+        targets = [f"b{index}"]
+        if self.connected(primitive.ports["enable"]):
+            lines.append(f"e{index} = {enable}")
+            targets.append(f"e{index}")
+        self._emit(targets, lines, dependencies)
+
+    def _pla(self, index: int, primitive: Primitive) -> None:
+        (value,), dependencies = self._inputs(primitive, "in")
+        self._emit([f"v{index}"], [f"v{index} = T{index}[{value}]"], dependencies)
+
+    def _bit(self, index: int, primitive: Primitive) -> None:
+        component = primitive.component
+        (value,), dependencies = self._inputs(primitive, "in")
+        width, out_width = len(primitive.ports["in"]), len(primitive.ports["out"])
+        extension = ((1 << out_width) - 1) ^ ((1 << width) - 1)
+        kind = component.get("type", "sign")
+        lines = []
+        if out_width <= width or kind == "zero":
+            expression = f"{value} & {_mask(out_width)}"
+        elif kind == "one":
+            expression = f"{value} | 0x{extension:x}"
+        elif kind == "input":
+            (fill,), more = self._inputs(primitive, "extension")
+            dependencies |= more
+            expression = f"{value} | (0x{extension:x} if {fill} else 0)"
+        else:
+            lines.append(f"x = {value}")
+            expression = f"x | (0x{extension:x} if x{f' >> {width - 1}' if width > 1 else ''} else 0)"
+        self._emit([f"v{index}"], lines + [f"v{index} = {expression}"], dependencies)
+
+    def _adder(self, index: int, primitive: Primitive) -> None:
+        (a, b, carry), dependencies = self._inputs(primitive, "in0", "in1", "carry_in")
+        width = len(primitive.ports["out"])
+        self._emit([f"v{index}_out", f"v{index}_carry_out"],
+                   [f"x = {a} + {b} + {carry}", f"v{index}_out = x & {_mask(width)}", f"v{index}_carry_out = x >> {width}"], dependencies)
+
+    def _shifter(self, index: int, primitive: Primitive) -> None:
+        (value, distance), dependencies = self._inputs(primitive, "in", "distance")
+        width = len(primitive.ports["out"])
+        mask = _mask(width)
+        expression = {
+            "ll": f"(x << d) & {mask}", "lr": "x >> d", "ar": f"(x >> d) | ({mask} ^ ({mask} >> d) if x >> {width - 1} else 0)",
+            "rl": f"((x << d) | (x >> ({width} - d))) & {mask}", "rr": f"((x >> d) | (x << ({width} - d))) & {mask}",
+        }[primitive.component.get("shift", "ll")]
+        self._emit([f"v{index}"], [f"x = {value}", f"d = {distance}", f"v{index} = {expression}"], dependencies)
+
+    def _multiplexer(self, index: int, primitive: Primitive) -> None:
+        names = [name for name in primitive.ports if name.startswith("in")]
+        values, dependencies = self._inputs(primitive, *names, "select")
+        select = values.pop()
+        expression = f"{values[1]} if {select} else {values[0]}" if len(values) == 2 else f"({', '.join(values)})[{select}]"
+        if "enable" in primitive.ports and self.connected(primitive.ports["enable"]):
+            (enable,), more = self._inputs(primitive, "enable")
+            dependencies |= more
+            expression = f"({expression}) if {enable} else 0"
+        self._emit([f"v{index}"], [f"v{index} = {expression}"], dependencies)
+
+    def _decoder(self, index: int, primitive: Primitive) -> None:
+        (select,), dependencies = self._inputs(primitive, "select")
+        condition = ""
+        if "enable" in primitive.ports and self.connected(primitive.ports["enable"]):
+            (enable,), more = self._inputs(primitive, "enable")
+            dependencies |= more
+            condition = f" and {enable}"
+        for port in primitive.ports:
+            if port.startswith("out"):
+                # One node per output so that the unused outputs are not computed
+                self._emit([f"v{index}_{port}"], [f"v{index}_{port} = 1 if {select} == {port[3:]}{condition} else 0"], dependencies)
+
+    def _priority(self, index: int, primitive: Primitive) -> None:
+        names = [name for name in primitive.ports if name.startswith("in")]
+        values, dependencies = self._inputs(primitive, *names)
+        found = " or ".join(values)
+        expression = " else ".join(f"{position} if {value}" for position, value in reversed(list(enumerate(values))[1:])) + " else 0"
+        lines = [f"v{index}_out = {expression}", f"v{index}_group = 1 if ({found}) else 0", f"v{index}_enable_out = 1 - v{index}_group"]
+        if self.connected(primitive.ports["enable_in"]):
+            (enable,), more = self._inputs(primitive, "enable_in")
+            dependencies |= more
+            lines += [f"if not {enable}:", f"    v{index}_out = v{index}_group = v{index}_enable_out = 0"]
+        self._emit([f"v{index}_out", f"v{index}_group", f"v{index}_enable_out"], lines, dependencies)
+
+    def _bitselector(self, index: int, primitive: Primitive) -> None:
+        (value, select), dependencies = self._inputs(primitive, "in", "select")
+        group = len(primitive.ports["out"])
+        shift = str(int(select, 16) * group) if select.startswith("0x") else f"({select} * {group})"
+        self._emit([f"v{index}"], [f"v{index} = ({value} >> {shift}) & {_mask(group)}"], dependencies)
+
+    def _constant(self, index: int, primitive: Primitive) -> None:
+        pass
+
+    _ground = _power = _constant
+
+    # Sequential primitives: their output is read from the state, their next state is computed after the levels
+
+    def _register(self, index: int, primitive: Primitive) -> None:
+        pass
+
+    _counter = _register
+
+    def _d(self, index: int, primitive: Primitive) -> None:
+        (value,), dependencies = self._inputs(primitive, "out")
+        self._emit([f"v{index}"], [f"v{index} = {value} ^ 1"], dependencies)
+
+    def sequential_lines(self) -> tuple[list[str], set[str]]:
+        """
+        This function returns the statements computing the next state (n*) and the clock (c*) of every sequential element, and the variables they read.
+        """
+        lines, dependencies = [], set()
+
+        def port(primitive, name, default=None):
+            if default is not None and not self.connected(primitive.ports[name]):
+                return default
+            expression, variables = self.expression(primitive.ports[name])
+            dependencies.update(variables)
+            return expression
+
+        for element, sequential in enumerate(self.sequential):
+            primitive = sequential.primitive
+            name = primitive.component.name
+            state, following, clock = sequential.variable, f"n{element}", f"c{element}"
+            edge = {"rising": f"{clock} and not k{element}", "falling": f"k{element} and not {clock}", "high": clock, "low": f"not {clock}"}[primitive.component.get("trigger", "rising")]
+            lines += [f"# {primitive.name}", f"{clock} = {port(primitive, 'clock')}", f"{following} = {state}"]
+            if name == "Register":
+                enable = port(primitive, "enable", "1")
+                lines += [f"if {edge}{'' if enable == '1' else f' and {enable}'}:", f"    {following} = {port(primitive, 'in')}"]
+            elif name == "Counter":
+                maximum = int(primitive.component.get("max", "0xff"), 0)
+                enable, load, up = port(primitive, "enable", "1"), port(primitive, "load", "0"), port(primitive, "up", "1")
+                lines.append(f"if {edge}:")
+                if load != "0":
+                    lines += [f"    if {load}:", f"        {following} = {port(primitive, 'in')}", f"    elif {enable}:"]
+                else:
+                    lines.append(f"    if {enable}:")
+                count_up = f"{state} + 1 if {state} < {maximum} else 0"
+                count_down = f"{state} - 1 if {state} > 0 else {maximum}"
+                lines.append(f"        {following} = {count_up}" if up == "1" else f"        {following} = ({count_up}) if {up} else ({count_down})")
+            else:
+                lines += [f"if {edge}:", f"    {following} = {port(primitive, 'in')}"]
+                if self.connected(primitive.ports["set"]):
+                    lines += [f"if {port(primitive, 'set')}:", f"    {following} = 1"]
+            if self.connected(primitive.ports["clear"]):
+                lines += [f"if {port(primitive, 'clear')}:", f"    {following} = 0"]
+        return lines, dependencies
+
+
+def _strong_components(nodes: list[_Node], producers: dict[str, int]) -> list[list[int]]:
+    """
+    This function returns the strongly connected components of the node graph, dependencies first (iterative Tarjan).
+    """
+    def children(node):
+        return iter(sorted({producers[variable] for variable in nodes[node].dependencies if variable in producers}))
+
+    index_of, low, stack, on_stack, components = {}, {}, [], set(), []
+    for root in range(len(nodes)):
+        if root in index_of:
+            continue
+        index_of[root] = low[root] = len(index_of)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, children(root))]
+        while work:
+            node, pending = work[-1]
+            child = next(pending, None)
+            if child is None:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+            elif child not in index_of:
+                index_of[child] = low[child] = len(index_of)
+                stack.append(child)
+                on_stack.add(child)
+                work.append((child, children(child)))
+            elif child in on_stack:
+                low[node] = min(low[node], index_of[child])
+    return components
+
+
+class CompiledCircuit:
+    """
+    This class holds the evaluator of a netlist and the state of its sequential elements.
+    """
+
+    def __init__(self, netlist: Netlist, tables: dict[str, list[tuple[str, int]]]):
+        compiler = _Compiler(netlist, tables)
+        self.inputs = compiler.pins
+        self.outputs = sorted(netlist.outputs)
+        self.registers = [sequential.primitive.name for sequential in compiler.sequential]
+        # Value of every sequential element followed by the last value of its clock
+        self.state = [0] * (2 * len(compiler.sequential))
+        self.primitives = len(netlist.primitives)
+        self.bits = len(compiler.sources)
+
+        sequential_lines, sinks = compiler.sequential_lines()
+        outputs = []
+        for name in self.outputs:
+            expression, variables = compiler.expression(netlist.outputs[name])
+            outputs.append(expression)
+            sinks |= variables
+
+        # Only the nodes read by the sequential elements or the outputs are evaluated
+        nodes = compiler.nodes
+        producers = {target: position for position, node in enumerate(nodes) for target in node.targets}
+        live, pending = set(), [producers[variable] for variable in sinks if variable in producers]
+        while pending:
+            position = pending.pop()
+            if position not in live:
+                live.add(position)
+                pending += [producers[variable] for variable in nodes[position].dependencies if variable in producers]
+        levels: dict[int, int] = {}
+        body: dict[int, list[str]] = {}
+        self.loops = 0
+        for component in _strong_components(nodes, producers):
+            component = sorted(position for position in component if position in live)
+            if not component:
+                continue
+            members = set(component)
+            level = 1 + max((levels[producers[variable]] for position in component for variable in nodes[position].dependencies
+                             if variable in producers and producers[variable] not in members), default=0)
+            lines = [line for position in component for line in nodes[position].lines]
+            if len(component) > 1 or any(producers.get(variable) == component[0] for variable in nodes[component[0]].dependencies):
+                # Loop through enabled buffers: iterated from all ones (the identity of the wired-AND) until it is stable
+                self.loops += 1
+                targets = ", ".join(target for position in component for target in nodes[position].targets)
+                lines = [f"{targets.replace(', ', ' = ')} = -1", f"for _ in range({SETTLE_LIMIT}):", f"    previous = ({targets},)"] + \
+                        [f"    {line}" for line in lines] + \
+                        [f"    if ({targets},) == previous:", "        break", "else:", f"    raise RuntimeError('the loop of {targets} does not settle')"]
+            for position in component:
+                levels[position] = level
+            body.setdefault(level, []).extend(lines)
+        self.levels = max(body, default=0)
+        self.statements = sum(len(lines) for lines in body.values())
+
+        count = len(compiler.sequential)
+        state = ", ".join([f"q{element}" for element in range(count)] + [f"k{element}" for element in range(count)])
+        following = ", ".join([f"n{element}" for element in range(count)] + [f"c{element}" for element in range(count)])
+        lines = ["def settle(state, pins):"]
+        if self.inputs:
+            lines.append(f"    {', '.join(f'p{index}' for index in range(len(self.inputs)))}, = pins")
+        lines += [f"    for _ in range({SETTLE_LIMIT}):", f"        {state}, = state"]
+        for level in sorted(body):
+            lines.append(f"        # Level {level}")
+            lines += [f"        {line}" for line in body[level]]
+        lines.append("        # Sequential elements")
+        lines += [f"        {line}" for line in sequential_lines]
+        lines += [f"        following = [{following}]", "        if following == state:", f"            return ({', '.join(outputs)},)",
+                  "        state[:] = following", "    raise RuntimeError('the circuit does not settle')"]
+        self.source = "\n".join(lines) + "\n"
+        exec(compile(self.source, f"<{netlist.top} evaluator>", "exec"), compiler.namespace)  # pylint: disable=exec-used
+        self._settle = compiler.namespace["settle"]
+
+    def settle(self, pins: list[int]) -> tuple[int, ...]:
+        """
+        This function evaluates the circuit for its input pins (in the order of self.inputs) until its state is stable and returns its output pins (in the order of self.outputs).
+        """
+        return self._settle(self.state, pins)
+
+    def register(self, name: str) -> int:
+        return self.state[self.registers.index(name)]
+
+
+def compile_netlist(netlist: Netlist, tables: dict[str, list[tuple[str, int]]]) -> CompiledCircuit:
+    return CompiledCircuit(netlist, tables)
+
+
+def compile_circuit(path: str = "./8bit_CPU.circ", top: str = CORE_CIRCUIT, pla_dir: str | None = "./PLAs") -> CompiledCircuit:
+    """
+    This function compiles a circuit of a Logisim project, its PLA tables are read from pla_dir (None: the tables stored in the project).
+    """
+    netlist = flatten(load_project(path), top)
+    return compile_netlist(netlist, load_pla_tables(netlist, pla_dir))
+
+
+class GateLevelCore:
+    """
+    This class runs the compiled TCORE circuit with a memory (a bytearray or a MemoryMap) in place of the test bench of the main circuit.
+    """
+
+    def __init__(self, circuit: CompiledCircuit, memory=None, pins: dict[str, str] | None = None):
+        pins = pins or CORE_PINS
+        self.circuit = circuit
+        self.memory = memory if memory is not None else bytearray(MEMORY_SIZE)
+        self.cycles = 0
+        self.writes: list[tuple[int, int]] | None = None
+        self._pins = [0] * len(circuit.inputs)
+        self._clock = circuit.inputs.index(pins["clock"])
+        self._reset = circuit.inputs.index(pins["reset"])
+        self._data_in = circuit.inputs.index(pins["data_in"])
+        self._data_out = circuit.outputs.index(pins["data_out"])
+        self._rw = circuit.outputs.index(pins["rw"])
+        self._address = circuit.outputs.index(pins["address"])
+        self._outputs = self._settle()
+
+    def _settle(self) -> tuple[int, ...]:
+        # The memory is read asynchronously: settle again until the data input is the byte at the address. While RW is set the memory
+        # releases the data bus, which the input pin models with all ones (the identity of the wired-AND)
+        pins = self._pins
+        while True:
+            outputs = self.circuit.settle(pins)
+            data = 0xff if outputs[self._rw] else self.memory[outputs[self._address]]
+            if data == pins[self._data_in]:
+                return outputs
+            pins[self._data_in] = data
+
+    def load(self, data: bytes, start: int = ROM_START) -> None:
+        self.memory[start:start + len(data)] = data
+
+    def register(self, label: str) -> int:
+        return self.circuit.register(f"{CORE_CIRCUIT}/{label}")
+
+    def reset(self, cycles: int = RESET_CYCLES) -> None:
+        """
+        This function holds RSTb low for some clock cycles and releases it, the reset sequence runs on the next cycles.
+        """
+        self._pins[self._reset] = 0
+        self.run(cycles)
+        self._pins[self._reset] = 1
+        self._outputs = self._settle()
+
+    def save_state(self) -> dict:
+        """
+        This function returns the state of the circuit (sequential elements and last clocks) and of its input pins.
+        """
+        return {"state": list(self.circuit.state), "pins": list(self._pins), "cycles": self.cycles}
+
+    def load_state(self, state: dict) -> None:
+        if len(state["state"]) != len(self.circuit.state) or len(state["pins"]) != len(self._pins):
+            raise ValueError("The state was saved from another circuit!")
+        self.circuit.state[:] = state["state"]
+        self._pins[:] = state["pins"]
+        self.cycles = state["cycles"]
+        self._outputs = self._settle()
+
+    def run(self, cycles: int) -> None:
+        """
+        This function runs clock cycles: the memory is written before the rising edge of CLCK, then CLCK rises and falls.
+        """
+        pins = self._pins
+        memory = self.memory
+        for _ in range(cycles):
+            outputs = self._outputs
+            if outputs[self._rw]:
+                memory[outputs[self._address]] = outputs[self._data_out]
+                if self.writes is not None:
+                    self.writes.append((outputs[self._address], outputs[self._data_out]))
+            pins[self._clock] = 1
+            self._settle()
+            pins[self._clock] = 0
+            self._outputs = self._settle()
+        self.cycles += cycles
+
+    def __repr__(self) -> str:
+        registers = {label: self.register(label) for label in ("PCH", "PCL", "AC", "X", "Y", "S", "P", "IR")}
+        return (f"GateLevelCore(PC={registers['PCH']:02x}{registers['PCL']:02x}, AC={registers['AC']:02x}, X={registers['X']:02x}, Y={registers['Y']:02x}, "
+                f"S={registers['S']:02x}, P={registers['P']:08b}, IR={registers['IR']:02x}, cycles={self.cycles})")
+
+
+class _WriteLog(bytearray):
+    """
+    This class is a memory recording the writes of the emulator.
+    """
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.writes: list[tuple[int, int]] = []
+
+    def __setitem__(self, address, value):
+        if isinstance(address, int):
+            self.writes.append((address, value))
+        super().__setitem__(address, value)
+
+
+def compare_with_emulator(core: GateLevelCore, binary: bytes, pla_dir: str) -> tuple[bool, str]:
+    """
+    This function compares the memory writes of the compiled circuit (already run) with the ones of the emulator running the same binary.
+    It returns whether they match and the report of the comparison.
+    """
+    emulator = TurtleCore(Microcode.from_directory(pla_dir), _WriteLog(MEMORY_SIZE))
+    emulator.load(binary)
+    emulator.reset()
+    # The emulator charges one cycle to every RST_CYCLE row, so it needs more cycles for the same writes
+    while len(emulator.memory.writes) < len(core.writes) and emulator.cycles < 4 * core.cycles:
+        emulator.run(100)
+    expected = emulator.memory.writes[:len(core.writes)]
+    for index, (write, reference) in enumerate(zip(core.writes, expected)):
+        if write != reference:
+            return False, f"Write {index} differs: circuit ${write[0]:04x} = ${write[1]:02x}, emulator ${reference[0]:04x} = ${reference[1]:02x}"
+    if len(expected) < len(core.writes):
+        return False, f"The emulator made {len(expected)} writes in {emulator.cycles} cycles, the circuit {len(core.writes)}"
+    return True, f"The {len(core.writes)} writes match the emulator ({core.cycles} circuit cycles, {emulator.cycles} emulator cycles)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the Logisim netlist of the Turtle Core and run a binary on it.")
+    parser.add_argument("binary", help="binary image loaded at the ROM start ($8000)")
+    parser.add_argument("--cycles", type=int, default=10_000, help="number of clock cycles to run")
+    parser.add_argument("--circuit", default="./8bit_CPU.circ", help="Logisim project")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the PLA tables loaded into the PLA components")
+    parser.add_argument("--embedded-tables", action="store_true", help="use the PLA tables stored in the project instead of --pla-dir")
+    parser.add_argument("--source", action="store_true", help="print the generated evaluator")
+    parser.add_argument("--check", action="store_true", help="compare the memory writes with the emulator")
+    parser.add_argument("--dump", type=lambda value: int(value, 0), default=0x10, help="number of zero page bytes to print")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    circuit = compile_circuit(args.circuit, CORE_CIRCUIT, None if args.embedded_tables else args.pla_dir)
+    elapsed = time.perf_counter() - start
+    if args.source:
+        print(circuit.source)
+    print(f"{CORE_CIRCUIT}: {circuit.primitives} primitives, {circuit.bits} bit nodes, {len(circuit.registers)} sequential elements, "
+          f"{circuit.levels} levels, {circuit.statements} statements, {circuit.loops} loop(s), compiled in {elapsed:.3f}s")
+
+    core = GateLevelCore(circuit)
+    with open(args.binary, "rb") as file:
+        binary = file.read()
+    core.load(binary)
+    core.writes = []
+    core.reset()
+    start = time.perf_counter()
+    core.run(args.cycles)
+    elapsed = time.perf_counter() - start
+
+    print(core)
+    print("Zero page:", " ".join(f"{value:02x}" for value in core.memory[:args.dump]))
+    print(f"{args.cycles} clock cycles in {elapsed:.3f}s ({args.cycles / elapsed:,.0f} cycles/s)")
+    if args.check:
+        matches, report = compare_with_emulator(core, binary, args.pla_dir)
+        print(report)
+        if not matches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# pylint: disable=line-too-long
+"""
+This module contains the vertical (field) encoding of the control word.
+
+Every signal of control_flags.py has its own bit in the 63 bits control word,
+but many of them are never asserted in the same cycle (bus drivers, ALU
+operations...). The co-activation relation of the generated microcode (decode
+and reset tables) is a graph whose edges join the signals asserted together in
+at least one control word; a coloring of this graph gives groups of mutually
+exclusive signals. Each group becomes a binary field (0 = no signal, n = n-th
+signal of the group) and a small decoder table gives the one-hot signals back.
+
+The coloring is greedy (highest degree first, DSatur-like) and puts a signal in
+the compatible field where it costs the fewest extra bits. Signals never
+asserted by the microcode are not encoded.
+"""
+import argparse
+import os
+import numpy as np
+from control_flags import *
+from control_model import CONTROL_SIGNALS
+from pla_tables import parse_pla, compile_pla, get_pla_widths
+from signal_profile import SIGNAL_NAMES, signal_matrix
+
+PLA_HEADER = "# Logisim PLA program table\n"
+
+
+def field_width(signals: int) -> int:
+    """
+    This function returns the number of bits of a field holding mutually exclusive signals (and the 'none' code).
+    """
+    return signals.bit_length()
+
+
+def conflict_matrix(words) -> np.ndarray:
+    """
+    This function returns the (signals, signals) matrix of the signals asserted together in at least one control word.
+    """
+    matrix = signal_matrix(words).astype(np.int64)
+    return (matrix.T @ matrix) > 0
+
+
+def color_signals(conflicts: np.ndarray) -> list[list[int]]:
+    """
+    This function groups the asserted signals (indices of CONTROL_SIGNALS) in fields of mutually exclusive signals.
+    """
+    asserted = [index for index in range(len(conflicts)) if conflicts[index, index]]
+    degree = {index: int(conflicts[index, asserted].sum()) for index in asserted}
+    fields: list[list[int]] = []
+    uncolored = set(asserted)
+    while uncolored:
+        # Most constrained signal first: conflicting with most fields, then highest degree
+        def saturation(index):
+            return sum(1 for field in fields if conflicts[index, field].any())
+        index = max(sorted(uncolored), key=lambda index: (saturation(index), degree[index]))
+        uncolored.remove(index)
+        best, best_cost = None, 1
+        for field in fields:
+            if conflicts[index, field].any():
+                continue
+            cost = field_width(len(field) + 1) - field_width(len(field))
+            if best is None or cost < best_cost or (cost == best_cost and len(field) > len(best)):
+                best, best_cost = field, cost
+        if best is None:
+            fields.append([index])
+        else:
+            best.append(index)
+    return fields
+
+
+class ControlEncoding:
+    """
+    This class represents a field encoded control word: every field is a group of mutually exclusive signals.
+    """
+
+    def __init__(self, fields: list[list[int]]):
+        # Signals values of every field, code n of a field selects fields[n - 1]
+        self.fields = [[CONTROL_SIGNALS[index][1] for index in field] for field in fields]
+        self.names = [[CONTROL_SIGNALS[index][0] for index in field] for field in fields]
+        self.widths = [field_width(len(field)) for field in fields]
+        self.offsets = [sum(self.widths[:index]) for index in range(len(fields))]
+        self.__codes = {}
+        for field_index, field in enumerate(self.fields):
+            for code, signal in enumerate(field, 1):
+                self.__codes[signal] = (field_index, code)
+        self.__encoded_mask = sum(self.__codes)
+
+    @staticmethod
+    def from_words(words) -> "ControlEncoding":
+        return ControlEncoding(color_signals(conflict_matrix(words)))
+
+    @property
+    def width(self) -> int:
+        return sum(self.widths)
+
+    def encode(self, word: int) -> int:
+        if word & ~self.__encoded_mask:
+            raise ValueError(f"Control word {word:063b} uses signals not covered by the encoding!")
+        code = 0
+        for signal, (field_index, value) in self.__codes.items():
+            if word & signal:
+                if code >> self.offsets[field_index] & ((1 << self.widths[field_index]) - 1):
+                    raise ValueError(f"Control word {word:063b} asserts two signals of field {field_index}!")
+                code |= value << self.offsets[field_index]
+        return code
+
+    def decode(self, code: int) -> int:
+        word = 0
+        for field, width, offset in zip(self.fields, self.widths, self.offsets):
+            value = code >> offset & ((1 << width) - 1)
+            if value:
+                word |= field[value - 1]
+        return word
+
+    def decoder_pla(self, field_index: int) -> str:
+        """
+        This function returns the Logisim PLA decoding a field into its one-hot control signals.
+        """
+        width = self.widths[field_index]
+        return PLA_HEADER + "".join(f"{code:0{width}b} {signal:063b}\n" for code, signal in enumerate(self.fields[field_index], 1))
+
+    def encode_pla(self, text: str) -> str:
+        """
+        This function re-encodes the output words of a control word PLA table.
+        """
+        rows = parse_pla(text)
+        encoded = [(pattern, self.encode(word)) for pattern, word in rows]
+        # Logisim ORs the outputs of overlapping rows, which is only valid for one-hot words
+        size = 1 << len(rows[0][0]) if rows else 0
+        if [self.decode(code) for code in compile_pla(encoded, size)] != compile_pla(rows, size):
+            raise ValueError("Overlapping PLA rows cannot be field encoded!")
+        return PLA_HEADER + "".join(f"{pattern} {code:0{self.width}b}\n" for pattern, code in encoded)
+
+    def to_markdown(self, tables: dict[str, str]) -> str:
+        report = f"Control word width: {PLAOUT_LEN} -> {self.width} bits ({len(self.fields)} fields)\n\n"
+        report += "Field | Bits | Signals\n-- | -- | --\n"
+        for index, (width, names) in enumerate(zip(self.widths, self.names)):
+            report += f"{index} | {width} | {', '.join(names)}\n"
+        report += "\nTable | Rows | Bits (one-hot) | Bits (encoded)\n-- | -- | -- | --\n"
+        for name, text in tables.items():
+            rows = len(parse_pla(text))
+            width, _ = get_pla_widths(text)
+            report += f"{name} | {rows} | {rows * (width + PLAOUT_LEN)} | {rows * (width + self.width)}\n"
+        decoder_bits = sum(len(field) * (width + PLAOUT_LEN) for field, width in zip(self.fields, self.widths))
+        report += f"Field decoders | {sum(len(field) for field in self.fields)} | - | {decoder_bits}\n"
+        unused = [name for name in SIGNAL_NAMES if not any(name in names for names in self.names)]
+        report += "\nSignals not encoded (never asserted): " + (", ".join(unused) or "none") + "\n"
+        return report
+
+
+def main():
+    from emulator import Microcode
+
+    parser = argparse.ArgumentParser(description="Field encode the control word of the generated microcode.")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--write", metavar="DIR", help="write the encoded decode/reset PLAs and the field decoders to DIR")
+    args = parser.parse_args()
+
+    tables = {}
+    for name in ("DecodePLA", "ResetPLA"):
+        with open(f"{args.pla_dir}/{name}.txt", "r", encoding="utf-8") as file:
+            tables[name] = file.read()
+    microcode = Microcode.from_directory(args.pla_dir)
+    words = sorted(set(microcode.decode) | set(microcode.reset))
+    encoding = ControlEncoding.from_words(words)
+    if any(encoding.decode(encoding.encode(word)) != word for word in words):
+        raise ValueError("Field encoding does not round trip!")
+    print(encoding.to_markdown(tables))
+
+    if args.write is not None:
+        os.makedirs(args.write, exist_ok=True)
+        for name, text in tables.items():
+            with open(f"{args.write}/{name}.txt", "w", encoding="utf-8") as file:
+                file.write(encoding.encode_pla(text))
+        for index in range(len(encoding.fields)):
+            with open(f"{args.write}/FieldDecoder{index}.txt", "w", encoding="utf-8") as file:
+                file.write(encoding.decoder_pla(index))
+
+
+if __name__ == "__main__":
+    main()
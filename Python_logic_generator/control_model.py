@@ -0,0 +1,130 @@
+# pylint: disable=line-too-long
+"""
+This module contains the resource model of the control signals: which signals
+drive or read each internal bus and which registers each signal reads or writes.
+It is shared by the tools reasoning about control words (optimizer, checkers...).
+"""
+import control_flags
+from control_flags import *
+
+# (name, value) of every control signal ordered by bit position
+CONTROL_SIGNALS = [(name, value) for name, value in vars(control_flags).items() if not name.startswith("_") and name != "PLAOUT_LEN"]
+
+BUSES = ("DB", "SB", "ADL", "ADH")
+
+# Signals driving a bus
+BUS_DRIVERS = {
+    "DB": DL_DB | PCL_DB | PCH_DB | AC_DB | P_DB,
+    "SB": S_SB | AC_SB | X_SB | Y_SB | ADD_SB06 | ADD_SB7,
+    "ADL": DL_ADL | PCL_ADL | S_ADL | ADD_ADL | O_ADL0 | O_ADL1 | O_ADL2,
+    "ADH": DL_ADH | PCH_ADH | O_ADH0 | O_ADH17,
+}
+
+# Signals latching or sampling a bus
+BUS_READERS = {
+    "DB": DB_ADD | DBx_ADD | DB0_C | DB1_Z | DBZ_Z | DB2_I | DB3_D | DB6_V | DB7_N,
+    "SB": SB_ADD | SB_AC | SB_X | SB_Y | SB_S,
+    "ADL": ADL_ABL | ADL_PCL | ADL_ADD,
+    "ADH": ADH_ABH | ADH_PCH,
+}
+
+# Pass transistors connecting two buses
+BUS_BRIDGES = ((SB_DB, "DB", "SB"), (SB_ADH, "SB", "ADH"))
+
+ALU_OPERATIONS = SUMS | ANDS | EORS | ORS | SRS
+# Signals taking effect at the end of the cycle (CL2), after the registers and the flags latched: ADD, PCL/PCH and the micro counter
+END_OF_CYCLE_SIGNALS = ALU_OPERATIONS | DDA | DSA | I_ADDC | I_PC | RST_CYCLE
+ALU_SIGNALS = DBx_ADD | DB_ADD | ADL_ADD | O_ADD | SB_ADD | I_ADDC | DDA | DSA | ALU_OPERATIONS
+
+STATUS_FLAGS = ("C", "Z", "I", "D", "V", "N")
+
+# Registers read at the start of the cycle by a signal ("MEM" is the memory, "DOR" the data output register)
+SIGNAL_READS = {
+    DL_DB: ("ABL", "ABH", "MEM"), DL_ADL: ("ABL", "ABH", "MEM"), DL_ADH: ("ABL", "ABH", "MEM"),
+    I_PC: ("PCL", "PCH"), PCL_DB: ("PCL",), PCL_ADL: ("PCL",), PCH_DB: ("PCH",), PCH_ADH: ("PCH",),
+    S_ADL: ("S",), S_SB: ("S",), AC_DB: ("AC",), AC_SB: ("AC",), X_SB: ("X",), Y_SB: ("Y",),
+    P_DB: STATUS_FLAGS, ADD_ADL: ("ADD",), ADD_SB06: ("ADD",), ADD_SB7: ("ADD",),
+    IR5_C: ("IR",), IR5_I: ("IR",), IR5_D: ("IR",), RW: ("ABL", "ABH", "DOR"),
+}
+
+# Registers latched at the end of the cycle by a signal
+SIGNAL_WRITES = {
+    ADH_ABH: ("ABH",), ADL_ABL: ("ABL",), ADL_PCL: ("PCL",), ADH_PCH: ("PCH",), I_PC: ("PCL", "PCH"),
+    SB_S: ("S",), SB_AC: ("AC",), SB_X: ("X",), SB_Y: ("Y",),
+    SUMS: ("ADD",), ANDS: ("ADD",), EORS: ("ADD",), ORS: ("ADD",), SRS: ("ADD",),
+    DB0_C: ("C",), IR5_C: ("C",), ACR_C: ("C",), DB1_Z: ("Z",), DBZ_Z: ("Z",), DB2_I: ("I",), IR5_I: ("I",),
+    DB3_D: ("D",), IR5_D: ("D",), DB6_V: ("V",), AVR_V: ("V",), I_V: ("V",), DB7_N: ("N",),
+    RW: ("MEM",), RST_CYCLE: ("MC",),
+}
+
+# Control words of the opcode fetch rows shared by every instruction (micro cycles 0 and 1), the fetch reloads the PC
+# select latches (PCLS/PCHS) which the last cycle of the instruction may have left behind
+FETCH_CYCLE = ADH_ABH | ADL_ABL | I_PC | PCL_ADL | PCH_ADH | PCL_PCL | PCH_PCH
+OPCODE_CYCLE = PCL_PCL | PCH_PCH
+
+# Micro cycles during which the vector PLA drives the address bus {micro_counter: vector row}
+RESET_VECTOR_STEPS = {0: 0b010, 1: 0b011}
+BRK_VECTOR_STEPS = {9: 0b100, 10: 0b101}
+# The IRQ entry shares the vector of BRK, the NMI entry drives its own rows at the same micro cycles
+NMI_VECTOR_STEPS = {9: 0b110, 10: 0b111}
+BRK_OPCODE = 0x00
+
+# Outputs of the IRQ PLA (indexed by the instruction register)
+IRQ_PLA_BRK = 0b01
+IRQ_PLA_RTI = 0b10
+# Interrupt disable flag (I) in P
+IRQ_DISABLE = 0x04
+
+
+def signal_names(word: int) -> list[str]:
+    """
+    This function returns the names of the control signals set in a control word.
+    """
+    return [name for name, value in CONTROL_SIGNALS if word & value]
+
+
+def bus_groups(word: int) -> list[set[str]]:
+    """
+    This function returns the buses connected together by the bridges of a control word.
+    """
+    groups = [{bus} for bus in BUSES]
+    for signal, bus_a, bus_b in BUS_BRIDGES:
+        if word & signal:
+            group_a = next(group for group in groups if bus_a in group)
+            group_b = next(group for group in groups if bus_b in group)
+            if group_a is not group_b:
+                group_a |= group_b
+                groups.remove(group_b)
+    return groups
+
+
+def used_buses(word: int) -> set[str]:
+    """
+    This function returns the buses (and "ALU") driven or read by a control word, including the buses bridged to them.
+    """
+    used = set()
+    for group in bus_groups(word):
+        if any(word & (BUS_DRIVERS[bus] | BUS_READERS[bus]) for bus in group) or (len(group) > 1):
+            used |= group
+    if word & ALU_SIGNALS:
+        used.add("ALU")
+    return used
+
+
+def word_reads(word: int) -> set[str]:
+    reads = set()
+    for signal, registers in SIGNAL_READS.items():
+        if word & signal:
+            reads.update(registers)
+    # The ALU carry in is the C flag unless I_ADDC forces it
+    if word & (SUMS | SRS) and not word & I_ADDC:
+        reads.add("C")
+    return reads
+
+
+def word_writes(word: int) -> set[str]:
+    writes = {"DOR"}
+    for signal, registers in SIGNAL_WRITES.items():
+        if word & signal:
+            writes.update(registers)
+    return writes
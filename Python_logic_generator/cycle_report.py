@@ -0,0 +1,254 @@
+# pylint: disable=line-too-long
+"""
+This module contains the workload cycle report: the cycle cost of a program
+(total cycles, CPI and breakdown per opcode and per addressing mode) for the
+microcode built from the Instruction list.
+
+Two analyses are available:
+- static: the program is decoded linearly from its entry point up to the first
+  BRK or unknown opcode, every instruction costs the cycles of its flag cleared
+  path and the extra cycles of the flag set path (page crossing of ABSX/ABSY)
+  are only reported as a possible worst case.
+- dynamic: the program is executed on the emulator instruction by instruction,
+  so loops are accounted for and the extra cycles of the flag set path are
+  counted only when they actually happen.
+
+The cost of an instruction is the number of micro cycles executed from micro
+cycle 0 up to and including its reset cycle (the "Cycles" column of the
+instruction docs + 1).
+
+The branch report runs every branch opcode alone on the emulator (not taken,
+taken forward/backward in the same page and across a page) and gives its cost
+next to the cycles of the 6502 (2, 3 and 4).
+"""
+import argparse
+from control_flags import *
+from control_model import BRK_OPCODE
+from emulator import Microcode, TurtleCore, ROM_START, MICRO_COUNTER_MASK
+from microcode_optimizer import fuse_instructions, overlap_fetch_instructions, path_lengths, instruction_length
+from pla_generator import Instruction, AdressModesList, BRANCH_CONDITIONS, build_instructions
+
+RESET_VECTOR = 0xFFFC
+
+# (name, address of the branch, offset, taken, cycles on a 6502)
+BRANCH_SCENARIOS = [
+    ("Not taken", 0x8010, 0x10, False, 2),
+    ("Taken", 0x8010, 0x10, True, 3),
+    ("Taken backward", 0x8040, 0xF0, True, 3),
+    ("Taken, half page cross", 0x8070, 0x20, True, 3),
+    ("Taken, page cross", 0x80F0, 0x20, True, 4),
+    ("Taken backward, page cross", 0x8102, 0xF0, True, 4),
+]
+
+
+class InstructionStats:
+    """
+    This class accumulates the executions of one opcode (or addressing mode).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.cycles = 0
+        self.extra_cycles = 0
+        self.possible_extra_cycles = 0
+
+    def add(self, cycles: int, extra_cycles: int = 0, possible_extra_cycles: int = 0) -> None:
+        self.count += 1
+        self.cycles += cycles
+        self.extra_cycles += extra_cycles
+        self.possible_extra_cycles += possible_extra_cycles
+
+
+class CycleReport:
+    """
+    This class holds the cycle breakdown of a workload.
+    """
+
+    def __init__(self, instructions: list[Instruction]):
+        self.__instructions = {instruction.opcode: instruction for instruction in instructions}
+        self.opcodes: dict[int, InstructionStats] = {}
+        self.addressing_modes: dict[str, InstructionStats] = {}
+        self.reset_cycles = 0
+
+    @property
+    def total_cycles(self) -> int:
+        return sum(stats.cycles for stats in self.opcodes.values())
+
+    @property
+    def instruction_count(self) -> int:
+        return sum(stats.count for stats in self.opcodes.values())
+
+    @property
+    def cpi(self) -> float:
+        return self.total_cycles / self.instruction_count if self.instruction_count > 0 else 0.0
+
+    def add(self, opcode: int, cycles: int, extra_cycles: int = 0, possible_extra_cycles: int = 0) -> None:
+        instruction = self.__instructions[opcode]
+        name = f"{instruction.name.value} {instruction.addressing_mode.value.short_name}"
+        self.opcodes.setdefault(opcode, InstructionStats(name)).add(cycles, extra_cycles, possible_extra_cycles)
+        mode = instruction.addressing_mode.value.full_name
+        self.addressing_modes.setdefault(mode, InstructionStats(mode)).add(cycles, extra_cycles, possible_extra_cycles)
+
+    def to_markdown(self) -> str:
+        """
+        This function formats the report as markdown tables sorted by cycle share.
+        """
+        total = self.total_cycles
+        report = f"Instructions: {self.instruction_count}\nCycles: {total} (+ {self.reset_cycles} reset cycles)\nCPI: {self.cpi:.2f}\n\n"
+        report += "OpCode | Instruction | Count | Cycles | Share | Flag path cycles | Possible flag path cycles\n-- | -- | -- | -- | -- | -- | --\n"
+        for opcode, stats in sorted(self.opcodes.items(), key=lambda item: -item[1].cycles):
+            report += f"${opcode:02x} | {stats.name} | {stats.count} | {stats.cycles} | {_share(stats.cycles, total)} | {stats.extra_cycles} | {stats.possible_extra_cycles}\n"
+        report += "\nAddressing mode | Count | Cycles | Share | CPI\n-- | -- | -- | -- | --\n"
+        for mode, stats in sorted(self.addressing_modes.items(), key=lambda item: -item[1].cycles):
+            report += f"{mode} | {stats.count} | {stats.cycles} | {_share(stats.cycles, total)} | {stats.cycles / stats.count:.2f}\n"
+        return report
+
+
+def _share(cycles: int, total: int) -> str:
+    return f"{100 * cycles / total:.1f}%" if total > 0 else "-"
+
+
+def instruction_cycles(instruction: Instruction) -> list[int]:
+    """
+    This function returns the number of micro cycles of the flag cleared path and, if the instruction selects a flag, of the flag set path.
+    """
+    return [length + 1 for length in path_lengths(instruction)]
+
+
+def read_entry(image: bytes, start: int = ROM_START) -> int:
+    offset = RESET_VECTOR - start
+    if 0 <= offset < len(image) - 1:
+        return image[offset] | image[offset + 1] << 8
+    return start
+
+
+def static_report(instructions: list[Instruction], image: bytes, start: int = ROM_START, entry: int | None = None) -> CycleReport:
+    """
+    This function decodes straight-line code from the entry point (default: reset vector) up to the first BRK or unknown opcode.
+    """
+    by_opcode = {instruction.opcode: instruction for instruction in instructions}
+    report = CycleReport(instructions)
+    address = read_entry(image, start) if entry is None else entry
+    while 0 <= address - start < len(image):
+        instruction = by_opcode.get(image[address - start])
+        if instruction is None:
+            break
+        cycles = instruction_cycles(instruction)
+        report.add(instruction.opcode, cycles[0], 0, max(cycles) - cycles[0])
+        if instruction.opcode == BRK_OPCODE:
+            break
+        address += instruction_length(instruction)
+    return report
+
+
+def dynamic_report(instructions: list[Instruction], image: bytes, max_cycles: int = 1_000_000, stop_at_brk: bool = True, fetch_overlap: bool = False, start: int = ROM_START) -> CycleReport:
+    """
+    This function executes the program on the emulator and accounts the micro cycles of every instruction executed.
+    """
+    base_cycles = {instruction.opcode: instruction_cycles(instruction)[0] for instruction in instructions}
+    report = CycleReport(instructions)
+    core = TurtleCore(Microcode.from_instructions(instructions, fetch_overlap))
+    core.load(image, start)
+    report.reset_cycles = core.reset()
+    while core.cycles - report.reset_cycles < max_cycles:
+        cycles = 0
+        while True:
+            core.step()
+            cycles += 1
+            if core.mc == 0:
+                break
+            if cycles > MICRO_COUNTER_MASK:
+                raise ValueError(f"Opcode ${core.ir:02x} at ${core.pc:04x} never reaches its reset cycle (not implemented?)")
+        # IR still holds the opcode of the instruction which just ended
+        opcode = core.ir
+        if opcode not in base_cycles:
+            raise ValueError(f"Opcode ${opcode:02x} at ${core.pc:04x} is not implemented!")
+        report.add(opcode, cycles, max(0, cycles - base_cycles[opcode]))
+        if stop_at_brk and opcode == BRK_OPCODE:
+            break
+    return report
+
+
+def branch_cycles(microcode: Microcode, opcode: int, address: int, offset: int, status: int) -> tuple[int, int, int]:
+    """
+    This function executes the branch opcode at address and returns the micro cycles spent, PC and P after it.
+    """
+    core = TurtleCore(microcode)
+    core.memory[address:address + 2] = bytes([opcode, offset])
+    core.p = status
+    pc = address
+    if microcode.fetch_overlap:
+        # The opcode has been fetched by the last cycle of the previous instruction
+        core.abl, core.abh = address & 0xFF, address >> 8
+        pc += 1
+    core.pcl, core.pch = pc & 0xFF, pc >> 8
+    cycles = 0
+    while cycles == 0 or core.mc != 0:
+        if cycles > MICRO_COUNTER_MASK:
+            raise ValueError(f"Branch ${opcode:02x} never reaches its reset cycle!")
+        core.step()
+        cycles += 1
+    return cycles, core.pc, core.p
+
+
+def branch_report(instructions: list[Instruction], fetch_overlap: bool = False) -> str:
+    """
+    This function returns the markdown table of the micro cycles of every branch per scenario, with the 6502 cycles in parentheses.
+    The target and the processor status (which no branch changes) are checked.
+    """
+    microcode = Microcode.from_instructions(instructions, fetch_overlap)
+    report = "OpCode | Instruction | " + " | ".join(name for name, _, _, _, _ in BRANCH_SCENARIOS) + "\n"
+    report += "-- | --" + " | --" * len(BRANCH_SCENARIOS) + "\n"
+    for instruction in instructions:
+        if instruction.addressing_mode != AdressModesList.REL:
+            continue
+        flag, taken_value = BRANCH_CONDITIONS[instruction.name]
+        mask = 1 << (flag.value - 1) if flag.value < 6 else 1 << flag.value
+        report += f"${instruction.opcode:02x} | {instruction.name.value} {instruction.addressing_mode.value.short_name}"
+        for name, address, offset, taken, reference in BRANCH_SCENARIOS:
+            status = 0x20 | (mask if taken == bool(taken_value) else 0)
+            cycles, pc, flags = branch_cycles(microcode, instruction.opcode, address, offset, status)
+            target = (address + 2 + (offset - 0x100 if offset & 0x80 else offset) if taken else address + 2) & 0xFFFF
+            if pc != target + int(fetch_overlap):
+                raise ValueError(f"{instruction.name.value} {name.lower()}: PC ${pc:04x} instead of ${target:04x}!")
+            if flags != status:
+                raise ValueError(f"{instruction.name.value} {name.lower()}: P {flags:08b} instead of {status:08b}!")
+            report += f" | {cycles} ({reference})"
+        report += "\n"
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the cycle cost of a program on the Turtle Core microcode.")
+    parser.add_argument("binary", nargs="?", help="binary image loaded at the ROM start ($8000)")
+    parser.add_argument("--branches", action="store_true", help="report the cycles of every branch against the 6502 instead of a program")
+    parser.add_argument("--static", action="store_true", help="decode straight-line code instead of executing the program")
+    parser.add_argument("--max-cycles", type=int, default=1_000_000, help="maximum number of microcycles executed")
+    parser.add_argument("--no-brk-stop", action="store_true", help="keep running after a BRK instead of ending the workload")
+    parser.add_argument("--fuse", action="store_true", help="apply the microcycle fusion before measuring")
+    parser.add_argument("--fetch-overlap", action="store_true", help="apply the fetch/execute overlap before measuring")
+    args = parser.parse_args()
+
+    instructions = build_instructions()
+    if args.fuse is True:
+        fuse_instructions(instructions)
+    if args.fetch_overlap is True:
+        overlap_fetch_instructions(instructions)
+    if args.branches is True:
+        print(branch_report(instructions, args.fetch_overlap))
+        return
+    if args.binary is None:
+        parser.error("a binary is required unless --branches is given")
+    with open(args.binary, "rb") as file:
+        image = file.read()
+
+    if args.static is True:
+        report = static_report(instructions, image)
+    else:
+        report = dynamic_report(instructions, image, args.max_cycles, not args.no_brk_stop, args.fetch_overlap)
+    print(report.to_markdown())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# pylint: disable=line-too-long
+"""
+This module contains the micro cycle trace subsystem of the emulator.
+
+A trace is a pipeline of generators: trace_cycles() yields one TraceRecord per
+micro cycle executed by a TurtleCore, the filter stages (filter_opcodes,
+filter_pc_range, filter_signals) drop records and write_trace() streams them to
+a binary file.
+
+Binary format (little endian):
+- header: the magic "TCTRACE1", the record size and the record count (u32 each)
+- fixed width records of RECORD_SIZE bytes described by TRACE_FIELDS. The
+  63 bits control word is delta encoded: every record holds the XOR of its control
+  word with the one of the previous record of the file (0 for a repeated word).
+
+read_trace() maps the file with NumPy (no parsing) and control_words() rebuilds
+the control words with a cumulative XOR. The text dump (format_record(), "view"
+command) is only a view over the binary file.
+"""
+import argparse
+import struct
+from typing import Iterable, Iterator, NamedTuple
+from control_model import CONTROL_SIGNALS, signal_names
+
+TRACE_MAGIC = b"TCTRACE1"
+HEADER = struct.Struct("<8sII")
+
+# (field, NumPy type, struct format) of a record
+TRACE_FIELDS = (
+    ("cycle", "<u8", "Q"), ("control_delta", "<u8", "Q"),
+    ("pc", "<u2", "H"), ("ab", "<u2", "H"), ("address", "<u2", "H"),
+    ("ir", "u1", "B"), ("mc", "u1", "B"), ("flag", "u1", "B"),
+    ("ac", "u1", "B"), ("x", "u1", "B"), ("y", "u1", "B"), ("s", "u1", "B"), ("p", "u1", "B"), ("dl", "u1", "B"), ("dor", "u1", "B"),
+)
+RECORD = struct.Struct("<" + "".join(fmt for _, _, fmt in TRACE_FIELDS))
+RECORD_SIZE = RECORD.size
+
+
+class TraceRecord(NamedTuple):
+    """
+    This class represents the state of the core at the start of a micro cycle and the control word it executes.
+    """
+    cycle: int
+    control_word: int
+    pc: int
+    ab: int
+    address: int
+    ir: int
+    mc: int
+    flag: int
+    ac: int
+    x: int
+    y: int
+    s: int
+    p: int
+    dl: int
+    dor: int
+
+
+def trace_cycles(core, cycles: int) -> Iterator[TraceRecord]:
+    """
+    This function runs a TurtleCore for a number of micro cycles and yields a record before every cycle.
+    """
+    decode = core.microcode.decode
+    for _ in range(cycles):
+        address = core.address
+        yield TraceRecord(core.cycles, decode[address], core.pch << 8 | core.pcl, core.abh << 8 | core.abl, address,
+                          core.ir, core.mc, address >> 4 & 1, core.ac, core.x, core.y, core.s, core.p, core.dl, core.dor)
+        core.step()
+
+
+def filter_opcodes(records: Iterable[TraceRecord], opcodes: set[int]) -> Iterator[TraceRecord]:
+    return (record for record in records if record.ir in opcodes)
+
+
+def filter_pc_range(records: Iterable[TraceRecord], start: int, end: int) -> Iterator[TraceRecord]:
+    """
+    This function keeps the records with start <= PC < end.
+    """
+    return (record for record in records if start <= record.pc < end)
+
+
+def filter_signals(records: Iterable[TraceRecord], mask: int) -> Iterator[TraceRecord]:
+    """
+    This function keeps the records whose control word drives at least one of the signals of mask.
+    """
+    return (record for record in records if record.control_word & mask)
+
+
+def write_trace(records: Iterable[TraceRecord], path: str, chunk: int = 4096) -> int:
+    """
+    This function streams records to a binary trace file and returns the number of records written.
+    """
+    count = 0
+    previous = 0
+    pack = RECORD.pack
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(TRACE_MAGIC, RECORD_SIZE, 0))
+        buffer = []
+        for record in records:
+            buffer.append(pack(record[0], record[1] ^ previous, *record[2:]))
+            previous = record[1]
+            count += 1
+            if len(buffer) >= chunk:
+                file.write(b"".join(buffer))
+                buffer.clear()
+        file.write(b"".join(buffer))
+        file.seek(0)
+        file.write(HEADER.pack(TRACE_MAGIC, RECORD_SIZE, count))
+    return count
+
+
+def _read_header(file) -> int:
+    magic, record_size, count = HEADER.unpack(file.read(HEADER.size))
+    if magic != TRACE_MAGIC or record_size != RECORD_SIZE:
+        raise ValueError("Not a Turtle Core trace file (or unsupported record size)!")
+    return count
+
+
+def iter_trace(path: str) -> Iterator[TraceRecord]:
+    """
+    This function reads back a binary trace file record by record (without NumPy).
+    """
+    with open(path, "rb") as file:
+        count = _read_header(file)
+        word = 0
+        for values in RECORD.iter_unpack(file.read(count * RECORD_SIZE)):
+            word ^= values[1]
+            yield TraceRecord(values[0], word, *values[2:])
+
+
+def trace_dtype():
+    import numpy as np
+    return np.dtype([(name, dtype) for name, dtype, _ in TRACE_FIELDS])
+
+
+def read_trace(path: str):
+    """
+    This function memory-maps a binary trace file as a NumPy structured array (fields of TRACE_FIELDS).
+    """
+    import numpy as np
+    with open(path, "rb") as file:
+        count = _read_header(file)
+    return np.memmap(path, dtype=trace_dtype(), mode="r", offset=HEADER.size, shape=(count,))
+
+
+def control_words(records):
+    """
+    This function decodes the control words of a NumPy trace (cumulative XOR of the deltas).
+    """
+    import numpy as np
+    return np.bitwise_xor.accumulate(records["control_delta"])
+
+
+def format_record(record: TraceRecord) -> str:
+    return (f"{record.cycle:>10} PC={record.pc:04x} AB={record.ab:04x} IR={record.ir:02x} MC={record.mc:>2} F={record.flag} "
+            f"AC={record.ac:02x} X={record.x:02x} Y={record.y:02x} S={record.s:02x} P={record.p:08b} DL={record.dl:02x} DOR={record.dor:02x} "
+            f"{record.control_word:016x} {'|'.join(signal_names(record.control_word))}")
+
+
+def _parse_range(value: str) -> tuple[int, int]:
+    start, end = value.split(":")
+    return int(start, 16), int(end, 16)
+
+
+def main():
+    # Emulator imported here so that reading a trace does not build the microcode
+    from emulator import Microcode, TurtleCore
+
+    parser = argparse.ArgumentParser(description="Record or view micro cycle traces of the Turtle Core.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="run a binary and write a binary trace")
+    record_parser.add_argument("binary", help="binary image loaded at the ROM start ($8000)")
+    record_parser.add_argument("-o", "--output", default="out.trace", help="binary trace file")
+    record_parser.add_argument("--cycles", type=int, default=100_000, help="number of microcycles to run")
+    record_parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    record_parser.add_argument("--opcode", type=lambda value: int(value, 16), action="append", help="keep only these opcodes (hex, repeatable)")
+    record_parser.add_argument("--pc-range", type=_parse_range, help="keep only start:end PC range (hex, end excluded)")
+    record_parser.add_argument("--signal", action="append", help="keep only cycles driving one of these control signals (repeatable)")
+    view_parser = subparsers.add_parser("view", help="print a binary trace as text")
+    view_parser.add_argument("trace", help="binary trace file")
+    view_parser.add_argument("--limit", type=int, default=None, help="number of records to print")
+    args = parser.parse_args()
+
+    if args.command == "view":
+        for index, record in enumerate(iter_trace(args.trace)):
+            if args.limit is not None and index >= args.limit:
+                break
+            print(format_record(record))
+        return
+
+    core = TurtleCore(Microcode.from_directory(args.pla_dir))
+    with open(args.binary, "rb") as file:
+        core.load(file.read())
+    core.reset()
+    records = trace_cycles(core, args.cycles)
+    if args.opcode:
+        records = filter_opcodes(records, set(args.opcode))
+    if args.pc_range:
+        records = filter_pc_range(records, *args.pc_range)
+    if args.signal:
+        flags = dict(CONTROL_SIGNALS)
+        unknown = [name for name in args.signal if name not in flags]
+        if unknown:
+            parser.error(f"unknown control signal(s): {', '.join(unknown)}")
+        mask = 0
+        for name in args.signal:
+            mask |= flags[name]
+        records = filter_signals(records, mask)
+    count = write_trace(records, args.output)
+    print(f"{count} records ({count * RECORD_SIZE + HEADER.size} bytes) written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+# pylint: disable=line-too-long
+"""
+This module contains a cycle accurate emulator of the Turtle Core.
+
+The emulator is driven directly by the microcode: the PLA tables (read from the
+files written by pla_generator.py or built from the in-memory Instruction objects)
+are precompiled into a dense lookup table indexed by Instruction.create_adress().
+Every distinct control word is then compiled once into a small Python function
+applying the signals of control_flags.py, so a microcycle costs one table lookup
+and one call.
+
+Datapath model:
+- Buses (DB, SB, ADL, ADH) are precharged to $FF and every driver pulls them low
+  (wired-AND), this is also how the O_ADL*/O_ADH* signals force bits to 0.
+  SB_DB and SB_ADH are one way buffers: SB drives DB and ADH, they never drive SB.
+- At the start of a cycle DL latches the memory at the address bus (ABH:ABL) or,
+  if RW is set, the data output register is written to memory instead.
+- At the end of a cycle every selected register latches its bus and DOR latches
+  DB. The ALU inputs are the AI (SB or 0) and BI (DB, ~DB or ADL) latches, which
+  load with the other registers and hold their value when they are not
+  selected; the ALU result is then stored into the adder hold register (ADD),
+  every cycle ($00 when no operation is selected).
+- The ALU carry in is the C flag OR I_ADDC (as wired in the TCORE circuit).
+- ACR and AVR come from the ALU before AI and BI load: ACR_C and AVR_V sample
+  the sum of the inputs latched by the previous cycle, with the operations and
+  the carry in of the current one (the cycle after SUMS keeps SUMS selected).
+- PCL and PCH load PCLS + I_PC and PCHS (+ the carry) every cycle, the select
+  latches PCLS/PCHS only load PCL/ADL (PCL_PCL/ADL_PCL) and PCH/ADH
+  (PCH_PCH/ADH_PCH): a cycle without them reloads the previous PC.
+- The instruction register latches DL at the end of micro cycle 1 (micro cycle 0
+  with the fetch/execute overlap).
+- A reset cycle alone (RST_CYCLE) takes no clock in the circuit: the micro
+  counter clears as soon as it selects the row. It changes no register here
+  but is still charged one cycle.
+- The flags latch with the registers and the flag select PLA is combinational:
+  a row writing the flag of its instruction switches to the row of the other
+  path before ADD, PC and the micro counter latch. The emulator runs the whole
+  row, hazard_checker.py checks that both rows end the cycle the same way.
+
+Interrupts (the TCORE circuit has no IRQ/NMI input, they are modeled here): an
+interrupt is taken at an opcode fetch cycle (micro cycle 0, or the reset cycle
+of the previous instruction with the fetch/execute overlap). The fetch runs
+without incrementing PC, the instruction register is forced to BRK's opcode and
+the interrupt sequence of BRK runs without its PC increments (I_PC dropped),
+with the B flag clear in the pushed P and the IRQ ($FFFE) or NMI ($FFFA, rows
+110/111 of the vector PLA, only selected here) vector. The decode PLA has no
+interrupt select input, so none of this is generated in the PLAs. IRQ is masked
+by the I flag (set by the sequence with DB2_I, SEI and the reset, cleared by CLI
+and RTI).
+"""
+import argparse
+import time
+from control_flags import *
+from control_model import RESET_VECTOR_STEPS, BRK_VECTOR_STEPS, NMI_VECTOR_STEPS, BRK_OPCODE, IRQ_DISABLE
+from microcode_optimizer import overlap_fetch
+from pla_generator import Instruction, build_instructions, get_decode_pla, get_flag_select_pla, get_reset_pla, get_vectors_pla
+from pla_tables import parse_pla, load_pla, compile_pla
+
+DECODE_TABLE_SIZE = 1 << 13
+RESET_TABLE_SIZE = 1 << 4
+FLAG_SELECT_SIZE = 1 << 8
+MEMORY_SIZE = 1 << 16
+ROM_START = 0x8000
+MICRO_COUNTER_MASK = 0xF
+
+# Processor status bit sampled by the flag select PLA (indexed by Flag.value)
+FLAG_SELECT_MASKS = (0x00, 0x01, 0x02, 0x04, 0x08, 0x10, 0x40, 0x80)
+
+
+class Microcode:
+    """
+    This class holds the dense tables of the microcode (decode, reset, flag select and vectors).
+    """
+
+    def __init__(self, decode_rows: list[tuple[str, int]], flag_select_rows: list[tuple[str, int]], reset_rows: list[tuple[str, int]], vectors_rows: list[tuple[str, int]], fetch_overlap: bool = False):
+        # With the fetch/execute overlap the opcode is fetched by the previous instruction and latched at micro cycle 0
+        self.fetch_overlap = fetch_overlap
+        self.ir_load_cycle = 0 if fetch_overlap else 1
+        self.decode = compile_pla(decode_rows, DECODE_TABLE_SIZE)
+        self.flag_select = compile_pla(flag_select_rows, FLAG_SELECT_SIZE)
+        self.reset = compile_pla(reset_rows, RESET_TABLE_SIZE)
+        self.vectors = compile_pla(vectors_rows, 1 << 3)
+
+    @staticmethod
+    def from_directory(pla_dir: str = "./PLAs", fetch_overlap: bool = False) -> "Microcode":
+        return Microcode(load_pla(f"{pla_dir}/DecodePLA.txt"), load_pla(f"{pla_dir}/DecodePLA_flagSelect.txt"),
+                         load_pla(f"{pla_dir}/ResetPLA.txt"), load_pla(f"{pla_dir}/Vectors.txt"), fetch_overlap)
+
+    @staticmethod
+    def from_instructions(instructions: list[Instruction], fetch_overlap: bool = False) -> "Microcode":
+        """
+        fetch_overlap must be set if overlap_fetch() has been applied to the instructions.
+        """
+        return Microcode(parse_pla(get_decode_pla(instructions, fetch_overlap)), parse_pla(get_flag_select_pla(instructions)),
+                         parse_pla(get_reset_pla(fetch_overlap)), parse_pla(get_vectors_pla()), fetch_overlap)
+
+
+def _bus_expression(terms: list[str]) -> str:
+    constant = 0xFF
+    variables = []
+    for term in terms:
+        if isinstance(term, int):
+            constant &= term
+        else:
+            variables.append(term)
+    if constant != 0xFF or len(variables) == 0:
+        variables.append(f"0x{constant:02x}")
+    return " & ".join(variables)
+
+
+def _alu_lines(word: int, a: str, b: str, carry: str, flags: bool) -> list[str]:
+    """
+    This function returns the statements computing the ALU output (res) for the operations of a control word, and its ACR (acr) and AVR (avr) outputs if flags is set.
+    """
+    lines = [f"    a = {a}", f"    b = {b}", f"    carry = {carry}"]
+    results = []
+    carries = []
+    if word & SUMS:
+        lines += ["    total = a + b + carry", "    acr_sum = total >> 8", "    res_sum = total & 0xff"]
+        if word & DDA:
+            lines += ["    if (a & 0x0f) + (b & 0x0f) + carry > 0x09:", "        total += 0x06",
+                      "    if total > 0x99:", "        total += 0x60", "    acr_sum = int(total > 0xff)", "    res_sum = total & 0xff"]
+        elif word & DSA:
+            lines += ["    if (a & 0x0f) + (b & 0x0f) + carry <= 0x0f:", "        res_sum = (res_sum & 0xf0) | ((res_sum - 0x06) & 0x0f)",
+                      "    if not acr_sum:", "        res_sum = (res_sum - 0x60) & 0xff"]
+        results.append("res_sum")
+        carries.append("acr_sum")
+    if word & SRS:
+        results.append("(a >> 1)")
+        carries.append("(a & 1)")
+    if word & ANDS:
+        results.append("(a & b)")
+    if word & EORS:
+        results.append("(a ^ b)")
+    if word & ORS:
+        results.append("(a | b)")
+    lines.append(f"    res = {' & '.join(results) or '0x00'}")
+    if flags:
+        lines += [f"    acr = {' | '.join(carries) or '0'}", "    avr = ((a ^ res) & (b ^ res)) >> 7"]
+    return lines
+
+
+def microcycle_lines(word: int, load_ir: bool, vector: int | None, brk: bool, cpu: str = "cpu.") -> list[str]:
+    """
+    This function returns the statements applying a control word, the registers are accessed with the cpu prefix ("cpu." for the attributes of a core).
+    """
+    # A reset cycle alone takes no clock in the circuit (the micro counter clears as soon as it selects the row)
+    if word == RST_CYCLE:
+        return []
+    lines = ["    ab = cpu.abh << 8 | cpu.abl"]
+    if word & RW:
+        lines += ["    mem[ab] = cpu.dor", "    dl = cpu.dl"]
+    else:
+        lines += ["    dl = cpu.dl = mem[ab]"]
+
+    # Bus drivers (wired-AND, a bus without driver reads $FF)
+    drivers: dict[str, list] = {"db": [], "sb": [], "adl": [], "adh": []}
+    for signal, bus, term in (
+        (DL_DB, "db", "dl"), (PCL_DB, "db", "cpu.pcl"), (PCH_DB, "db", "cpu.pch"), (AC_DB, "db", "cpu.ac"),
+        (P_DB, "db", f"(cpu.p | 0x{0x30 if brk else 0x20:02x})"),
+        (S_SB, "sb", "cpu.s"), (AC_SB, "sb", "cpu.ac"), (X_SB, "sb", "cpu.x"), (Y_SB, "sb", "cpu.y"),
+        (DL_ADL, "adl", "dl"), (PCL_ADL, "adl", "cpu.pcl"), (S_ADL, "adl", "cpu.s"), (ADD_ADL, "adl", "cpu.add"),
+        (O_ADL0, "adl", 0xFE), (O_ADL1, "adl", 0xFD), (O_ADL2, "adl", 0xFB),
+        (DL_ADH, "adh", "dl"), (PCH_ADH, "adh", "cpu.pch"), (O_ADH0, "adh", 0xFE), (O_ADH17, "adh", 0x01),
+    ):
+        if word & signal:
+            drivers[bus].append(term)
+    if word & ADD_SB06 and word & ADD_SB7:
+        drivers["sb"].append("cpu.add")
+    elif word & ADD_SB06:
+        drivers["sb"].append("(cpu.add | 0x80)")
+    elif word & ADD_SB7:
+        drivers["sb"].append("(cpu.add | 0x7f)")
+
+    # SB_DB and SB_ADH are one way buffers, SB drives DB and ADH but is never driven by them
+    lines.append(f"    sb = {_bus_expression(drivers['sb'])}")
+    for signal, bus in ((SB_DB, "db"), (SB_ADH, "adh")):
+        if word & signal:
+            drivers[bus].append("sb")
+    for bus in ("db", "adl", "adh"):
+        lines.append(f"    {bus} = {_bus_expression(drivers[bus])}")
+
+    # ALU flags, from the inputs latched by the previous cycle
+    carry = "1" if word & I_ADDC else "(cpu.p & 1)"
+    if word & (ACR_C | AVR_V):
+        lines += _alu_lines(word, "cpu.ai", "cpu.bi", carry, True)
+
+    # ALU input latches
+    if word & (SB_ADD | O_ADD):
+        a_terms = (["sb"] if word & SB_ADD else []) + ([0x00] if word & O_ADD else [])
+        lines.append(f"    cpu.ai = {_bus_expression(a_terms)}")
+    if word & (DB_ADD | DBx_ADD | ADL_ADD):
+        b_terms = (["db"] if word & DB_ADD else []) + (["(db ^ 0xff)"] if word & DBx_ADD else []) + (["adl"] if word & ADL_ADD else [])
+        lines.append(f"    cpu.bi = {_bus_expression(b_terms)}")
+
+    # Processor status
+    flag_updates = []
+    for signal, mask, expression in (
+        (DB0_C, 0x01, "(db & 0x01)"), (IR5_C, 0x01, "((cpu.ir >> 5) & 0x01)"), (ACR_C, 0x01, "acr"),
+        (DB1_Z, 0x02, "(db & 0x02)"), (DBZ_Z, 0x02, "(0x02 if db == 0 else 0)"),
+        (DB2_I, 0x04, "(db & 0x04)"), (IR5_I, 0x04, "((cpu.ir >> 3) & 0x04)"),
+        (DB3_D, 0x08, "(db & 0x08)"), (IR5_D, 0x08, "((cpu.ir >> 2) & 0x08)"),
+        (DB6_V, 0x40, "(db & 0x40)"), (AVR_V, 0x40, "(avr << 6)"), (I_V, 0x40, "0x40"),
+        (DB7_N, 0x80, "(db & 0x80)"),
+    ):
+        if word & signal:
+            flag_updates.append((mask, expression))
+    if flag_updates:
+        mask = 0
+        for flag_mask, _ in flag_updates:
+            mask |= flag_mask
+        lines.append(f"    cpu.p = (cpu.p & 0x{mask ^ 0xFF:02x}) | {' | '.join(expression for _, expression in flag_updates)}")
+
+    # ALU result, from the new inputs and carry in (ADD latches at the end of the cycle)
+    if word & (SUMS | ANDS | EORS | ORS | SRS):
+        lines += _alu_lines(word, "cpu.ai", "cpu.bi", carry, False)
+        lines.append("    cpu.add = res")
+    else:
+        lines.append("    cpu.add = 0x00")
+
+    # Registers
+    for signal, register, bus in ((SB_AC, "ac", "sb"), (SB_X, "x", "sb"), (SB_Y, "y", "sb"), (SB_S, "s", "sb")):
+        if word & signal:
+            lines.append(f"    cpu.{register} = {bus}")
+
+    # Program counter: PCLS/PCHS latch PCL/ADL and PCH/ADH, PCL:PCH load PCLS:PCHS + I_PC every cycle
+    if word & (PCL_PCL | ADL_PCL):
+        lines.append(f"    cpu.pcls = {_bus_expression((['cpu.pcl'] if word & PCL_PCL else []) + (['adl'] if word & ADL_PCL else []))}")
+    if word & (PCH_PCH | ADH_PCH):
+        lines.append(f"    cpu.pchs = {_bus_expression((['cpu.pch'] if word & PCH_PCH else []) + (['adh'] if word & ADH_PCH else []))}")
+    if word & I_PC:
+        lines += ["    if cpu.pcls == 0xff:", "        cpu.pcl = 0", "        cpu.pch = (cpu.pchs + 1) & 0xff",
+                  "    else:", "        cpu.pcl = cpu.pcls + 1", "        cpu.pch = cpu.pchs"]
+    else:
+        lines += ["    cpu.pcl = cpu.pcls", "    cpu.pch = cpu.pchs"]
+
+    # Data output register and address bus
+    lines.append("    cpu.dor = db")
+    if vector is not None:
+        lines += [f"    cpu.abl = 0x{vector & 0xFF:02x}", f"    cpu.abh = 0x{vector >> 8:02x}"]
+    else:
+        if word & ADL_ABL:
+            lines.append("    cpu.abl = adl")
+        if word & ADH_ABH:
+            lines.append("    cpu.abh = adh")
+
+    if load_ir:
+        lines.append("    cpu.ir = dl")
+    return lines if cpu == "cpu." else [line.replace("cpu.", cpu) for line in lines]
+
+
+def _generate_step_source(word: int, load_ir: bool, vector: int | None, brk: bool) -> str:
+    lines = ["def step(cpu, mem):"] + microcycle_lines(word, load_ir, vector, brk)
+    # Micro counter
+    if word & RST_CYCLE:
+        lines.append("    cpu.mc = 0")
+    else:
+        lines.append(f"    cpu.mc = (cpu.mc + 1) & {MICRO_COUNTER_MASK}")
+    return "\n".join(lines) + "\n"
+
+
+_STEP_CACHE: dict[tuple, object] = {}
+
+
+def compile_step(word: int, load_ir: bool = False, vector: int | None = None, brk: bool = False):
+    """
+    This function compiles a control word into a function applying one microcycle to a TurtleCore.
+    """
+    key = (word, load_ir, vector, brk and bool(word & P_DB))
+    step = _STEP_CACHE.get(key)
+    if step is None:
+        namespace: dict = {}
+        exec(compile(_generate_step_source(*key), f"<microcycle {word:063b}>", "exec"), namespace)
+        step = namespace["step"]
+        _STEP_CACHE[key] = step
+    return step
+
+
+class TurtleCore:
+    """
+    This class represents the state of a Turtle Core running the microcode.
+    """
+
+    __slots__ = ("dl", "dor", "pcl", "pch", "pcls", "pchs", "abl", "abh", "s", "x", "y", "ac", "p", "ai", "bi", "add", "ir", "mc",
+                 "cycles", "memory", "microcode", "_decode_steps", "_reset_steps", "_flag_masks", "_interrupt_steps")
+
+    def __init__(self, microcode: Microcode, memory=None):
+        self.microcode = microcode
+        self.memory = memory if memory is not None else bytearray(MEMORY_SIZE)
+        self.dl = self.dor = self.ai = self.bi = self.add = 0
+        self.pcl = self.pch = self.pcls = self.pchs = self.abl = self.abh = 0
+        self.s = self.x = self.y = self.ac = 0
+        self.p = 0x20
+        self.ir = self.mc = 0
+        self.cycles = 0
+        self._flag_masks = [FLAG_SELECT_MASKS[flag & 0x7] for flag in microcode.flag_select]
+        self._decode_steps = []
+        for address, word in enumerate(microcode.decode):
+            opcode, micro_counter = address >> 5, address & MICRO_COUNTER_MASK
+            vector = None
+            # BRK cycles are shifted by one with the fetch/execute overlap
+            brk_cycle = micro_counter + 1 - microcode.ir_load_cycle
+            if opcode == BRK_OPCODE and brk_cycle in BRK_VECTOR_STEPS:
+                vector = microcode.vectors[BRK_VECTOR_STEPS[brk_cycle]]
+            self._decode_steps.append(compile_step(word, micro_counter == microcode.ir_load_cycle, vector, opcode == BRK_OPCODE))
+        self._reset_steps = []
+        for micro_counter, word in enumerate(microcode.reset):
+            vector = microcode.vectors[RESET_VECTOR_STEPS[micro_counter]] if micro_counter in RESET_VECTOR_STEPS else None
+            self._reset_steps.append(compile_step(word, False, vector))
+        # Interrupt entry {nmi: steps}: the cycles of BRK without the PC increments (up to its reset cycle, which may fetch the handler)
+        self._interrupt_steps = {}
+        for nmi, vector_steps in ((False, BRK_VECTOR_STEPS), (True, NMI_VECTOR_STEPS)):
+            steps = []
+            for micro_counter in range(MICRO_COUNTER_MASK + 1):
+                word = microcode.decode[Instruction.create_adress(BRK_OPCODE, micro_counter)]
+                brk_cycle = micro_counter + 1 - microcode.ir_load_cycle
+                vector = microcode.vectors[vector_steps[brk_cycle]] if brk_cycle in vector_steps else None
+                steps.append(compile_step(word if word & RST_CYCLE else word & ~I_PC, False, vector))
+            self._interrupt_steps[nmi] = steps
+
+    @property
+    def pc(self) -> int:
+        return self.pch << 8 | self.pcl
+
+    @property
+    def address(self) -> int:
+        return Instruction.create_adress(self.ir, self.mc, 1 if self.p & self._flag_masks[self.ir] else 0)
+
+    @property
+    def control_word(self) -> int:
+        return self.microcode.decode[self.address]
+
+    def load(self, data: bytes, start: int = ROM_START) -> None:
+        self.memory[start:start + len(data)] = data
+
+    def reset(self) -> int:
+        """
+        This function runs the reset sequence until its RST_CYCLE and returns the number of cycles spent.
+        """
+        # The reset clears the instruction register (as in the circuit): the first fetch row carries no cycle of the previous instruction
+        self.ir = self.mc = 0
+        cycles = 0
+        while True:
+            micro_counter = self.mc
+            self._reset_steps[micro_counter](self, self.memory)
+            cycles += 1
+            if self.microcode.reset[micro_counter] & RST_CYCLE or cycles >= RESET_TABLE_SIZE:
+                break
+        self.mc = 0
+        self.cycles += cycles
+        return cycles
+
+    @property
+    def fetching(self) -> bool:
+        """
+        This property is True when the next micro cycle fetches an opcode, where the interrupts are taken.
+        """
+        if self.microcode.fetch_overlap:
+            return bool(self.control_word & RST_CYCLE)
+        return self.mc == 0
+
+    def interrupt(self, nmi: bool = False) -> int:
+        """
+        This function enters the IRQ (or NMI) handler from an opcode fetch cycle and returns the number of cycles spent, up to the reset cycle of the interrupt sequence.
+        """
+        if not self.fetching:
+            raise ValueError(f"An interrupt is only taken at an opcode fetch cycle (MC={self.mc})!")
+        compile_step(self.control_word & ~I_PC)(self, self.memory)
+        self.ir = BRK_OPCODE
+        steps = self._interrupt_steps[nmi]
+        cycles = 1
+        while cycles <= MICRO_COUNTER_MASK + 1:
+            micro_counter = self.mc
+            steps[micro_counter](self, self.memory)
+            cycles += 1
+            if self.microcode.decode[Instruction.create_adress(BRK_OPCODE, micro_counter)] & RST_CYCLE:
+                break
+        self.cycles += cycles
+        return cycles
+
+    def poll(self, irq: bool, nmi: bool = False) -> int:
+        """
+        This function takes a pending interrupt if the core is at an opcode fetch cycle: NMI, or IRQ unless the I flag masks it.
+        It returns the number of cycles spent (0 if no interrupt has been taken).
+        """
+        if not (nmi or irq and not self.p & IRQ_DISABLE) or not self.fetching:
+            return 0
+        return self.interrupt(nmi)
+
+    def step(self) -> None:
+        ir = self.ir
+        self._decode_steps[ir << 5 | (16 if self.p & self._flag_masks[ir] else 0) | self.mc](self, self.memory)
+        self.cycles += 1
+
+    def run(self, cycles: int) -> None:
+        steps = self._decode_steps
+        flag_masks = self._flag_masks
+        memory = self.memory
+        for _ in range(cycles):
+            ir = self.ir
+            steps[ir << 5 | (16 if self.p & flag_masks[ir] else 0) | self.mc](self, memory)
+        self.cycles += cycles
+
+    def run_profiled(self, cycles: int, profiler) -> None:
+        """
+        This function runs like run() and charges every micro cycle to the address of the opcode of its instruction, in the counters array of the profiler.
+        profiler.fetch(address, opcode) is called at micro cycle 0 of every instruction with the address of its opcode and the opcode of the previous instruction (IR is not loaded yet),
+        it updates profiler.counts (array indexed by address) and profiler.address.
+        """
+        steps = self._decode_steps
+        flag_masks = self._flag_masks
+        memory = self.memory
+        overlap = self.microcode.fetch_overlap
+        counts, address = profiler.counts, profiler.address
+        for _ in range(cycles):
+            if self.mc == 0:
+                # The opcode is on the address bus: fetched by this cycle, or by the reset cycle of the previous instruction with the overlap
+                profiler.fetch(self.abh << 8 | self.abl if overlap else self.pch << 8 | self.pcl, self.ir)
+                counts, address = profiler.counts, profiler.address
+            ir = self.ir
+            steps[ir << 5 | (16 if self.p & flag_masks[ir] else 0) | self.mc](self, memory)
+            counts[address] += 1
+        self.cycles += cycles
+
+    def __repr__(self) -> str:
+        return (f"TurtleCore(PC={self.pc:04x}, AC={self.ac:02x}, X={self.x:02x}, Y={self.y:02x}, S={self.s:02x}, "
+                f"P={self.p:08b}, IR={self.ir:02x}, MC={self.mc}, cycles={self.cycles})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a binary on the Turtle Core microcode.")
+    parser.add_argument("binary", help="binary image loaded at the ROM start ($8000)")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="number of microcycles to run")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--generate", action="store_true", help="build the microcode from pla_generator instead of the PLA files")
+    parser.add_argument("--fetch-overlap", action="store_true", help="microcode generated with the fetch/execute overlap")
+    parser.add_argument("--dump", type=lambda value: int(value, 0), default=0x10, help="number of zero page bytes to print")
+    args = parser.parse_args()
+
+    if args.generate:
+        instructions = build_instructions()
+        if args.fetch_overlap:
+            for instruction in instructions:
+                overlap_fetch(instruction)
+        microcode = Microcode.from_instructions(instructions, args.fetch_overlap)
+    else:
+        microcode = Microcode.from_directory(args.pla_dir, args.fetch_overlap)
+    core = TurtleCore(microcode)
+    with open(args.binary, "rb") as file:
+        core.load(file.read())
+    core.reset()
+
+    start = time.perf_counter()
+    core.run(args.cycles)
+    elapsed = time.perf_counter() - start
+
+    print(core)
+    print("Zero page:", " ".join(f"{value:02x}" for value in core.memory[:args.dump]))
+    print(f"{args.cycles} microcycles in {elapsed:.3f}s ({args.cycles / elapsed:,.0f} microcycles/s)")
+
+
+if __name__ == "__main__":
+    main()
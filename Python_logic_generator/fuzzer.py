@@ -0,0 +1,488 @@
+# pylint: disable=line-too-long
+"""
+This module contains the differential fuzzer of the microcode: random
+instruction streams made of the opcodes of the Instruction list are executed
+instruction by instruction on the cycle accurate emulator and on a small 6502
+ISA model, and the first difference of registers, flags, PC or memory is
+reported.
+
+A case is a seed (random RAM content of $0000-$7FFF), the initial registers and
+a list of instructions assembled at $8000. It ends when PC leaves the program
+(branches, JMP and BRK to an address outside of it, the vectors are 0), after a
+BRK or after MAX_STEPS_PER_INSTRUCTION executed instructions per instruction of
+the stream (loops).
+The states are compared once the next opcode is fetched: with --fuse the last
+cycle of an instruction may run during this fetch.
+
+The model follows the 6502 semantics. The Turtle Core datapath differs from
+the 6502 in a few known places (QUIRKS), each of them can be reproduced by the
+model with --quirk NAME to look for other differences (the active quirks are
+printed with the report):
+- address_carry: abs,X, abs,Y and ind,Y leave the carry of their low byte
+  addition in C (which the instruction then reads, e.g. as carry in of ADC).
+- load_carry: LDA, LDX and LDY load the byte + C (Z and N come from the byte).
+- binary_adc: ADC ignores the decimal flag.
+
+The streams are encoded as by the assembler: as BRK, the implied instructions
+skip the byte following their opcode, which is part of their encoding
+(assembler.build_padding_table) and is skipped by the model too.
+
+A failing case is shrunk before being reported: instructions are removed (by
+halves down to single instructions), then operands and registers are set to 0
+while the same opcode keeps differing on the same field. Cases are spread on a
+process pool (every worker builds its own microcode).
+"""
+import argparse
+import itertools
+import multiprocessing
+import random
+import time
+from control_model import BRK_OPCODE
+from emulator import Microcode, TurtleCore, ROM_START, MICRO_COUNTER_MASK, MEMORY_SIZE
+from microcode_optimizer import fuse_instruction, overlap_fetch
+from pla_generator import AdressModesList, Instruction, InstructionName, BRANCH_CONDITIONS, build_instructions
+from assembler import OPERAND_SIZES, build_padding_table
+
+QUIRKS = ("address_carry", "load_carry", "binary_adc")
+RAM_SIZE = 0x8000
+MAX_STEPS_PER_INSTRUCTION = 4
+# Processor status bits compared (B and the unused bit are not stored on a 6502)
+STATUS_MASK = 0xCF
+BRK_VECTOR = 0xFFFE
+# Mask in P of the flag tested by every branch {Flag name: mask}
+BRANCH_MASKS = {"C": 0x01, "Z": 0x02, "V": 0x40, "N": 0x80}
+
+
+class ReferenceCore:
+    """
+    This class is a 6502 ISA model (one call of step() per instruction) of the instructions named in InstructionName which the Turtle Core implements.
+    """
+
+    def __init__(self, modes: dict[int, tuple[InstructionName, AdressModesList]], memory: bytearray, quirks: set[str], paddings: dict[int, int] | None = None):
+        self.modes = modes
+        self.memory = memory
+        self.quirks = quirks
+        # Padding bytes following the implied opcodes (BRK skips its own)
+        self.paddings = paddings or {}
+        self.a = self.x = self.y = 0
+        self.s = 0xFF
+        self.p = 0x20
+        self.pc = ROM_START
+
+    def __fetch(self) -> int:
+        value = self.memory[self.pc]
+        self.pc = (self.pc + 1) & 0xFFFF
+        return value
+
+    def __set_carry(self, carry: int) -> None:
+        self.p = (self.p & 0xFE) | carry
+
+    def __set_zn(self, value: int) -> None:
+        self.p = (self.p & 0x7D) | (0x02 if value == 0 else 0) | (value & 0x80)
+
+    def __indexed(self, low: int, high: int, index: int) -> int:
+        if "address_carry" not in self.quirks:
+            return ((high << 8 | low) + index) & 0xFFFF
+        total = low + index
+        self.__set_carry(total >> 8)
+        return ((high + (total >> 8)) & 0xFF) << 8 | (total & 0xFF)
+
+    def __address(self, mode: AdressModesList) -> int:
+        memory = self.memory
+        if mode == AdressModesList.ZPG:
+            return self.__fetch()
+        if mode == AdressModesList.ZPGX:
+            return (self.__fetch() + self.x) & 0xFF
+        if mode == AdressModesList.ZPGY:
+            return (self.__fetch() + self.y) & 0xFF
+        if mode == AdressModesList.ABS:
+            low, high = self.__fetch(), self.__fetch()
+            return high << 8 | low
+        if mode in (AdressModesList.ABSX, AdressModesList.ABSY):
+            low, high = self.__fetch(), self.__fetch()
+            return self.__indexed(low, high, self.x if mode == AdressModesList.ABSX else self.y)
+        if mode == AdressModesList.XIND:
+            pointer = (self.__fetch() + self.x) & 0xFF
+            return memory[(pointer + 1) & 0xFF] << 8 | memory[pointer]
+        if mode == AdressModesList.INDY:
+            pointer = self.__fetch()
+            return self.__indexed(memory[pointer], memory[(pointer + 1) & 0xFF], self.y)
+        if mode == AdressModesList.IND:
+            low, high = self.__fetch(), self.__fetch()
+            # The high byte of the target does not cross the page of the pointer
+            return memory[high << 8 | ((low + 1) & 0xFF)] << 8 | memory[high << 8 | low]
+        raise ValueError(f"Addressing mode {mode.value.full_name} has no memory operand!")
+
+    def __operand(self, mode: AdressModesList) -> int:
+        if mode == AdressModesList.IMM:
+            return self.__fetch()
+        return self.memory[self.__address(mode)]
+
+    def __push(self, value: int) -> None:
+        self.memory[0x100 | self.s] = value
+        self.s = (self.s - 1) & 0xFF
+
+    def __pull(self) -> int:
+        self.s = (self.s + 1) & 0xFF
+        return self.memory[0x100 | self.s]
+
+    def step(self) -> None:
+        """
+        This function executes the instruction at PC, or raises NotImplementedError if the model does not know it.
+        """
+        opcode = self.memory[self.pc]
+        if opcode not in self.modes:
+            raise NotImplementedError(f"Opcode ${opcode:02x} at ${self.pc:04x} is not implemented!")
+        name, mode = self.modes[opcode]
+        self.pc = (self.pc + 1) & 0xFFFF
+        if name != InstructionName.BRK:
+            self.pc = (self.pc + self.paddings.get(opcode, 0)) & 0xFFFF
+        if name == InstructionName.ADC:
+            value = self.__operand(mode)
+            if self.p & 0x08 and "binary_adc" not in self.quirks:
+                self.__decimal_adc(value)
+            else:
+                total = self.a + value + (self.p & 1)
+                overflow = ~(self.a ^ value) & (self.a ^ total) & 0x80
+                self.a = total & 0xFF
+                self.p = (self.p & 0xBE) | (total >> 8) | (0x40 if overflow else 0)
+                self.__set_zn(self.a)
+        elif name in (InstructionName.LDA, InstructionName.LDX, InstructionName.LDY):
+            value = self.__operand(mode)
+            self.__set_zn(value)
+            if "load_carry" in self.quirks:
+                value = (value + (self.p & 1)) & 0xFF
+            setattr(self, {InstructionName.LDA: "a", InstructionName.LDX: "x", InstructionName.LDY: "y"}[name], value)
+        elif name in (InstructionName.STA, InstructionName.STX, InstructionName.STY):
+            target = self.__address(mode)
+            self.memory[target] = {InstructionName.STA: self.a, InstructionName.STX: self.x, InstructionName.STY: self.y}[name]
+        elif name in BRANCH_CONDITIONS:
+            flag, taken = BRANCH_CONDITIONS[name]
+            offset = self.__fetch()
+            if bool(self.p & BRANCH_MASKS[flag.name]) == bool(taken):
+                self.pc = (self.pc + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+        elif name == InstructionName.JMP:
+            self.pc = self.__address(mode)
+        elif name == InstructionName.BRK:
+            self.pc = (self.pc + 1) & 0xFFFF
+            self.__push(self.pc >> 8)
+            self.__push(self.pc & 0xFF)
+            self.__push(self.p | 0x30)
+            self.p |= 0x04
+            self.pc = self.memory[BRK_VECTOR + 1] << 8 | self.memory[BRK_VECTOR]
+        elif name == InstructionName.RTI:
+            # B and the unused bit are not stored
+            self.p = (self.__pull() & 0xCF) | (self.p & 0x30)
+            self.pc = self.__pull()
+            self.pc |= self.__pull() << 8
+        elif name in (InstructionName.SEC, InstructionName.SED, InstructionName.SEI):
+            self.p |= {InstructionName.SEC: 0x01, InstructionName.SED: 0x08, InstructionName.SEI: 0x04}[name]
+        elif name in (InstructionName.CLC, InstructionName.CLI):
+            self.p &= {InstructionName.CLC: 0xFE, InstructionName.CLI: 0xFB}[name]
+        elif name in TRANSFERS:
+            source, destination = TRANSFERS[name]
+            setattr(self, destination, getattr(self, source))
+            if destination != "s":
+                self.__set_zn(getattr(self, destination))
+        else:
+            raise NotImplementedError(f"{name.value} is not implemented by the ISA model!")
+
+    def __decimal_adc(self, value: int) -> None:
+        carry = self.p & 1
+        low = (self.a & 0x0F) + (value & 0x0F) + carry
+        if low > 0x09:
+            low += 0x06
+        total = (self.a & 0xF0) + (value & 0xF0) + (0x10 if low > 0x0F else 0) + (low & 0x0F)
+        binary = (self.a + value + carry) & 0xFF
+        # As the NMOS 6502: Z from the binary sum, N and V from the sum before the high digit adjustment
+        overflow = ~(self.a ^ value) & (self.a ^ total) & 0x80
+        self.p = (self.p & 0x3C) | (0x40 if overflow else 0) | (total & 0x80) | (0x02 if binary == 0 else 0)
+        if total > 0x9F:
+            total += 0x60
+        self.a = total & 0xFF
+        self.__set_carry(1 if total > 0xFF else 0)
+
+
+# {instruction: (source register, destination register)}
+TRANSFERS = {
+    InstructionName.TAX: ("a", "x"), InstructionName.TAY: ("a", "y"), InstructionName.TSX: ("s", "x"),
+    InstructionName.TXA: ("x", "a"), InstructionName.TXS: ("x", "s"), InstructionName.TYA: ("y", "a"),
+}
+
+
+class FuzzCase:
+    """
+    This class represents a fuzzing case: the seed of the RAM content, the initial registers and the instructions (opcode and operand bytes).
+    """
+
+    def __init__(self, seed: int, registers: dict[str, int], instructions: list[tuple[int, ...]]):
+        self.seed = seed
+        self.registers = registers
+        self.instructions = instructions
+
+    def image(self) -> bytes:
+        return bytes(byte for instruction in self.instructions for byte in instruction)
+
+    def starts(self) -> dict[int, int]:
+        """
+        This function returns the address of every instruction {address: index}.
+        """
+        starts, address = {}, ROM_START
+        for index, instruction in enumerate(self.instructions):
+            starts[address] = index
+            address += len(instruction)
+        return starts
+
+    def memory(self) -> bytearray:
+        memory = bytearray(MEMORY_SIZE)
+        memory[:RAM_SIZE] = random.Random(self.seed).randbytes(RAM_SIZE)
+        image = self.image()
+        memory[ROM_START:ROM_START + len(image)] = image
+        return memory
+
+    def copy(self, registers: dict[str, int] | None = None, instructions: list[tuple[int, ...]] | None = None) -> "FuzzCase":
+        return FuzzCase(self.seed, dict(self.registers if registers is None else registers), list(self.instructions if instructions is None else instructions))
+
+    def listing(self, names: dict[int, str]) -> str:
+        registers = " ".join(f"{name.upper()}={value:02x}" for name, value in self.registers.items())
+        lines = [f"seed {self.seed}, {registers}"]
+        address = ROM_START
+        for instruction in self.instructions:
+            operand = "".join(f"{byte:02x}" for byte in reversed(instruction[1:]))
+            lines.append(f"  ${address:04x}: {' '.join(f'{byte:02x}' for byte in instruction):<8} {names[instruction[0]]} {'$' + operand if operand else ''}".rstrip())
+            address += len(instruction)
+        return "\n".join(lines)
+
+
+class Divergence:
+    """
+    This class represents the first difference between the emulator and the ISA model.
+    """
+
+    def __init__(self, step: int, address: int, opcode: int, field: str, expected: int, actual: int):
+        self.step = step
+        self.address = address
+        self.opcode = opcode
+        self.field = field
+        self.expected = expected
+        self.actual = actual
+
+    @property
+    def signature(self) -> tuple[int, str]:
+        return self.opcode, self.field.partition(" ")[0]
+
+    def describe(self, names: dict[int, str]) -> str:
+        return f"instruction {self.step} at ${self.address:04x} ({names.get(self.opcode, '???')}, ${self.opcode:02x}): {self.field} is ${self.actual:02x} instead of ${self.expected:02x}"
+
+
+class Fuzzer:
+    """
+    This class generates, runs and shrinks the fuzzing cases of a microcode.
+    """
+
+    def __init__(self, microcode: Microcode, instructions: list[Instruction], quirks: set[str], excluded: set[int] | None = None):
+        self.microcode = microcode
+        self.quirks = quirks
+        self.modes = {instruction.opcode: (instruction.name, instruction.addressing_mode) for instruction in instructions}
+        self.names = {instruction.opcode: f"{instruction.name.value} {instruction.addressing_mode.value.short_name}" for instruction in instructions}
+        self.paddings = build_padding_table(instructions)
+        self.opcodes = sorted(opcode for opcode in self.modes if opcode not in (excluded or set()))
+        self.__fuzzed = set(self.opcodes)
+
+    def operand_size(self, opcode: int) -> int:
+        # Operand and padding bytes, as emitted by the assembler
+        return OPERAND_SIZES[self.modes[opcode][1]] + self.paddings.get(opcode, 0)
+
+    def generate(self, seed: int, length: int) -> FuzzCase:
+        generator = random.Random(seed)
+        registers = {"a": generator.randrange(256), "x": generator.randrange(256), "y": generator.randrange(256),
+                     "s": generator.randrange(256), "p": generator.randrange(256) | 0x20}
+        instructions = []
+        for _ in range(length):
+            opcode = generator.choice(self.opcodes)
+            instructions.append((opcode,) + tuple(generator.randrange(256) for _ in range(self.operand_size(opcode))))
+        return FuzzCase(seed, registers, instructions)
+
+    def __core(self, case: FuzzCase, memory: bytearray) -> TurtleCore:
+        core = TurtleCore(self.microcode, memory)
+        for name, value in case.registers.items():
+            setattr(core, "ac" if name == "a" else name, value)
+        pc = ROM_START
+        if self.microcode.fetch_overlap:
+            # The first opcode has been fetched by the last cycle of the previous instruction
+            core.abl, core.abh = pc & 0xFF, pc >> 8
+            pc += 1
+        core.pcl, core.pch = pc & 0xFF, pc >> 8
+        return core
+
+    def run(self, case: FuzzCase) -> Divergence | None:
+        """
+        This function executes a case on both models and returns their first difference (None if there is none).
+        """
+        model = ReferenceCore(self.modes, case.memory(), self.quirks, self.paddings)
+        for name, value in case.registers.items():
+            setattr(model, name, value)
+        core = self.__core(case, case.memory())
+        starts = case.starts()
+        for step in range(MAX_STEPS_PER_INSTRUCTION * len(case.instructions)):
+            address = model.pc
+            if address not in starts:
+                break
+            opcode = model.memory[address]
+            # Stored over the program, an opcode left out of the streams ends the case too
+            if opcode not in self.__fuzzed:
+                break
+            try:
+                model.step()
+            except NotImplementedError:
+                break
+            for _ in range(MICRO_COUNTER_MASK + 2):
+                core.step()
+                if core.mc == 0:
+                    break
+            else:
+                return Divergence(step, address, opcode, "micro counter (never reaches its reset cycle)", 0, core.mc)
+            if not self.microcode.fetch_overlap:
+                # The fusion may carry the last cycle into the fetch of the next opcode, which then holds its address on AB
+                core.step()
+            divergence = self.compare(model, core)
+            if divergence is not None:
+                return Divergence(step, address, opcode, *divergence)
+            if opcode == BRK_OPCODE:
+                break
+        return None
+
+    def compare(self, model: ReferenceCore, core: TurtleCore) -> tuple[str, int, int] | None:
+        pc = core.abh << 8 | core.abl
+        for name, expected, actual in (("PC", model.pc, pc), ("A", model.a, core.ac), ("X", model.x, core.x), ("Y", model.y, core.y), ("S", model.s, core.s)):
+            if expected != actual:
+                return name, expected, actual
+        if (model.p ^ core.p) & STATUS_MASK:
+            different = (model.p ^ core.p) & STATUS_MASK
+            flags = "".join(flag for flag, mask in zip("NV..DIZC", (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01)) if different & mask)
+            return f"P (flags {flags})", model.p, core.p
+        if model.memory != core.memory:
+            address = next(address for address in range(MEMORY_SIZE) if model.memory[address] != core.memory[address])
+            return f"memory ${address:04x}", model.memory[address], core.memory[address]
+        return None
+
+    def shrink(self, case: FuzzCase, divergence: Divergence) -> tuple[FuzzCase, Divergence]:
+        """
+        This function returns the smallest case found which still differs on the same opcode and field.
+        """
+        def still_fails(candidate: FuzzCase) -> Divergence | None:
+            result = self.run(candidate) if candidate.instructions else None
+            return result if result is not None and result.signature == divergence.signature else None
+
+        # Nothing after the instruction which differs is needed (unless it is reached again by a loop)
+        candidate = case.copy(instructions=case.instructions[:case.starts()[divergence.address] + 1])
+        result = still_fails(candidate)
+        if result is not None:
+            case, divergence = candidate, result
+        chunk = len(case.instructions) // 2
+        while chunk >= 1:
+            index = 0
+            while index < len(case.instructions):
+                candidate = case.copy(instructions=case.instructions[:index] + case.instructions[index + chunk:])
+                result = still_fails(candidate)
+                if result is not None:
+                    case, divergence = candidate, result
+                else:
+                    index += chunk
+            chunk //= 2
+        for index, instruction in enumerate(case.instructions):
+            for byte in range(1, len(instruction)):
+                if instruction[byte] == 0:
+                    continue
+                simplified = instruction[:byte] + (0,) + instruction[byte + 1:]
+                candidate = case.copy(instructions=case.instructions[:index] + [simplified] + case.instructions[index + 1:])
+                result = still_fails(candidate)
+                if result is not None:
+                    case, divergence, instruction = candidate, result, simplified
+        for name in case.registers:
+            value = 0x20 if name == "p" else 0
+            if case.registers[name] != value:
+                candidate = case.copy(registers={**case.registers, name: value})
+                result = still_fails(candidate)
+                if result is not None:
+                    case, divergence = candidate, result
+        return case, divergence
+
+
+_FUZZER: Fuzzer | None = None
+
+
+def _init_worker(pla_dir: str | None, fuse: bool, fetch_overlap: bool, quirks: set[str], excluded: set[int]) -> None:
+    global _FUZZER
+    instructions = build_instructions()
+    if pla_dir is None:
+        for instruction in instructions:
+            if fuse:
+                fuse_instruction(instruction)
+            if fetch_overlap:
+                overlap_fetch(instruction)
+        microcode = Microcode.from_instructions(instructions, fetch_overlap)
+    else:
+        microcode = Microcode.from_directory(pla_dir, fetch_overlap)
+    _FUZZER = Fuzzer(microcode, instructions, quirks, excluded)
+
+
+def _fuzz_case(job: tuple[int, int]) -> tuple[int, tuple[int, str] | None, str | None]:
+    """
+    This function runs (and shrinks if it fails) the case of a seed in a worker and returns the seed, the signature and the report of the failure.
+    """
+    seed, length = job
+    case = _FUZZER.generate(seed, length)
+    divergence = _FUZZER.run(case)
+    if divergence is None:
+        return seed, None, None
+    case, divergence = _FUZZER.shrink(case, divergence)
+    return seed, divergence.signature, f"{divergence.describe(_FUZZER.names)}\n{case.listing(_FUZZER.names)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the microcode with a 6502 ISA model on random instruction streams.")
+    parser.add_argument("--cases", type=int, default=10_000, help="number of cases (0: run until interrupted)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first case (case n uses seed + n)")
+    parser.add_argument("--length", type=int, default=32, help="instructions per case")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="number of worker processes")
+    parser.add_argument("--max-failures", type=int, default=20, help="stop after this number of distinct failures (opcode and field)")
+    parser.add_argument("--exclude", nargs="+", default=[], type=lambda value: int(value, 16), help="opcodes (hex) left out of the streams")
+    parser.add_argument("--quirk", action="append", default=[], choices=QUIRKS, metavar="NAME", help=f"reproduce a known difference of the Turtle Core in the model (repeatable: {', '.join(QUIRKS)})")
+    parser.add_argument("--pla-dir", help="load the microcode from the PLA tables of this directory instead of the generator")
+    parser.add_argument("--fuse", action="store_true", help="microcode generated with the microcycle fusion")
+    parser.add_argument("--fetch-overlap", action="store_true", help="microcode generated with the fetch/execute overlap")
+    args = parser.parse_args()
+
+    quirks = set(args.quirk)
+    opcodes = {instruction.opcode for instruction in build_instructions()}
+    unknown = [opcode for opcode in args.exclude if opcode not in opcodes]
+    if unknown:
+        parser.error(f"unknown opcode(s): {', '.join(f'${opcode:02x}' for opcode in unknown)}")
+
+    print(f"Quirks: {', '.join(name for name in QUIRKS if name in quirks) or 'none (6502 semantics)'}", flush=True)
+    seeds = range(args.seed, args.seed + args.cases) if args.cases > 0 else itertools.count(args.seed)
+    jobs = ((seed, args.length) for seed in seeds)
+    # Failures are grouped by opcode and field (the instruction number and values differ)
+    failures: dict[tuple[int, str], str] = {}
+    cases = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.jobs, _init_worker, (args.pla_dir, args.fuse, args.fetch_overlap, quirks, set(args.exclude))) as pool:
+        try:
+            for seed, signature, report in pool.imap_unordered(_fuzz_case, jobs, chunksize=16):
+                cases += 1
+                if report is not None:
+                    if signature not in failures:
+                        failures[signature] = report
+                        print(f"------ CASE {seed} -------\n{report}\n", flush=True)
+                    if len(failures) >= args.max_failures:
+                        break
+                if cases % 1000 == 0:
+                    print(f"{cases} cases, {len(failures)} failure(s), {cases / (time.perf_counter() - start):,.0f} cases/s", flush=True)
+        except KeyboardInterrupt:
+            pool.terminate()
+    print(f"{cases} cases in {time.perf_counter() - start:.1f}s, {len(failures)} distinct failure(s), quirks: {', '.join(name for name in QUIRKS if name in quirks) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
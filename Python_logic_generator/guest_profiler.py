@@ -0,0 +1,363 @@
+# pylint: disable=line-too-long
+"""
+This module contains the guest program profiler: every micro cycle executed by
+a TurtleCore is charged to the address of the opcode of its instruction, and
+through the symbols of the program (assembler.py, or a symbol listing) to a
+label.
+
+Collection (TurtleCore.run_profiled()) only increments counters: one array of
+cycles indexed by address per call stack, and one array of executions indexed
+by address. The profiler is only called at the opcode fetch cycles, where it
+follows the calls and returns: the instructions named JSR or BRK push a frame
+(its call site and the address of the first instruction executed after
+them), RTS and RTI pop one, and an interrupt entered with interrupt() pushes a frame for its handler
+(the cycles of the interrupt sequence are charged to the "[interrupt entry]"
+counter of the new stack). The instruction list has no JSR/RTS yet, so the call
+graph is made of the BRK and interrupt handlers; JSR and RTS are followed as
+soon as they are added to pla_generator.py. The stacks are cut to their
+MAX_DEPTH innermost frames (a BRK which never returns nests forever).
+
+Reports:
+- flat profile: exclusive cycles (charged to the instructions of a label) and
+  inclusive cycles (charged while the label is on the stack) per label,
+- call graph: call site -> callee with the number of calls,
+- folded stacks ("idle;irq 1234" lines, flamegraph.pl / speedscope),
+- heatmap: executions and cycles of every executed address (CSV), and the
+  hottest addresses with a bar in the text report.
+
+A symbol listing has one symbol per line, "$8000 start" (as printed by
+assembler.py --symbols) or "start = $8000", such as a vobjdump symbol table
+reduced to these two columns. The targets of the vectors of the image are
+labeled RESET, IRQ and NMI unless a symbol already names them.
+"""
+import argparse
+import bisect
+import re
+import time
+from array import array
+from emulator import Microcode, TurtleCore, MEMORY_SIZE, ROM_START
+from memory_map import default_memory_map, run_with_devices, IRQ_DISABLE, DEVICE_QUANTUM
+from pla_generator import Instruction, InstructionName, build_instructions
+from assembler import assemble
+
+# Kinds of instructions followed by the call stack
+CALL, RETURN = 1, 2
+CALL_NAMES = (InstructionName.JSR, InstructionName.BRK)
+RETURN_NAMES = (InstructionName.RTS, InstructionName.RTI)
+MAX_DEPTH = 32
+# Counter of the cycles of the interrupt sequences (after the 64KB of addresses)
+INTERRUPT_ENTRY = MEMORY_SIZE
+COUNTERS_SIZE = MEMORY_SIZE + 1
+
+_SYMBOL_RES = (
+    re.compile(r"^\s*\$?([0-9A-Fa-f]{1,4})\s+([A-Za-z_.][\w.]*)\s*$"),
+    re.compile(r"^\s*([A-Za-z_.][\w.]*)\s*=\s*\$?([0-9A-Fa-f]{1,4})\s*$"),
+)
+
+
+def vector_symbols(image: bytes, origin: int = ROM_START) -> dict[str, int]:
+    """
+    This function returns the targets of the vectors of an image (RESET, IRQ and NMI), used as labels of a binary without symbols.
+    """
+    symbols = {}
+    for name, vector in (("RESET", 0xFFFC), ("IRQ", 0xFFFE), ("NMI", 0xFFFA)):
+        offset = vector - origin
+        if 0 <= offset < len(image) - 1:
+            symbols[name] = image[offset] | image[offset + 1] << 8
+    return symbols
+
+
+def _counters() -> array:
+    return array("Q", bytes(8 * COUNTERS_SIZE))
+
+
+def parse_symbols(text: str) -> dict[str, int]:
+    """
+    This function parses a symbol listing ("$8000 start" or "start = $8000" lines), the other lines are ignored.
+    """
+    symbols = {}
+    for line in text.splitlines():
+        match = _SYMBOL_RES[0].match(line)
+        if match is not None:
+            symbols[match.group(2)] = int(match.group(1), 16)
+            continue
+        match = _SYMBOL_RES[1].match(line)
+        if match is not None:
+            symbols[match.group(1)] = int(match.group(2), 16)
+    return symbols
+
+
+class SymbolTable:
+    """
+    This class maps an address to the label at or before it ("label+offset").
+    """
+
+    def __init__(self, symbols: dict[str, int], start: int = 0, end: int = MEMORY_SIZE):
+        # Only the symbols of the code (the constants of the IO registers are not labels)
+        labels: dict[int, str] = {}
+        for name, address in symbols.items():
+            if start <= address < end:
+                labels.setdefault(address, name)
+        self.addresses = sorted(labels)
+        self.names = [labels[address] for address in self.addresses]
+
+    def label(self, address: int) -> str:
+        if address == INTERRUPT_ENTRY:
+            return "[interrupt entry]"
+        index = bisect.bisect_right(self.addresses, address) - 1
+        return self.names[index] if index >= 0 else f"${address:04x}"
+
+    def locate(self, address: int) -> str:
+        if address == INTERRUPT_ENTRY:
+            return "[interrupt entry]"
+        index = bisect.bisect_right(self.addresses, address) - 1
+        if index < 0:
+            return f"${address:04x}"
+        offset = address - self.addresses[index]
+        return f"{self.names[index]}+{offset}" if offset else self.names[index]
+
+
+class GuestProfiler:
+    """
+    This class holds the counters of a profiled core (cycles per call stack and address, executions per address) and follows its call stack.
+    """
+
+    def __init__(self, core: TurtleCore, instructions: list[Instruction]):
+        self.core = core
+        self.kinds = bytearray(256)
+        for instruction in instructions:
+            if instruction.name in CALL_NAMES:
+                self.kinds[instruction.opcode] = CALL
+            elif instruction.name in RETURN_NAMES:
+                self.kinds[instruction.opcode] = RETURN
+        self.executions = array("Q", bytes(8 * MEMORY_SIZE))
+        # Cycles per address of every call stack {(call site, callee) of the frames: counters}
+        self.stacks: dict[tuple[tuple[int, int], ...], array] = {(): _counters()}
+        # Call graph {(call site, callee, kind): calls}
+        self.calls: dict[tuple[int, int, str], int] = {}
+        self.stack: tuple[tuple[int, int], ...] = ()
+        self.counts = self.stacks[()]
+        # Address of the instruction running (-1 before the first fetch and after an interrupt entry)
+        self.address = -1
+
+    def _switch(self, stack: tuple[tuple[int, int], ...]) -> None:
+        self.stack = stack[-MAX_DEPTH:]
+        counts = self.stacks.get(self.stack)
+        if counts is None:
+            counts = self.stacks[self.stack] = _counters()
+        self.counts = counts
+
+    def _call(self, site: int, callee: int, kind: str) -> None:
+        key = (site, callee, kind)
+        self.calls[key] = self.calls.get(key, 0) + 1
+        self._switch(self.stack + ((site, callee),))
+
+    def _retire(self, address: int, opcode: int) -> None:
+        # The previous instruction (opcode) calls or returns to address
+        if self.address >= 0:
+            kind = self.kinds[opcode]
+            if kind == CALL:
+                self._call(self.address, address, "call")
+            elif kind == RETURN and self.stack:
+                self._switch(self.stack[:-1])
+
+    def fetch(self, address: int, opcode: int) -> None:
+        """
+        This function is called by TurtleCore.run_profiled() at the fetch of the opcode at address, opcode being the one of the previous instruction.
+        """
+        self._retire(address, opcode)
+        self.executions[address] += 1
+        self.address = address
+
+    def run(self, cycles: int) -> None:
+        self.core.run_profiled(cycles, self)
+
+    def interrupt(self, nmi: bool = False) -> int:
+        """
+        This function finishes the instruction running and enters the IRQ (or NMI) handler, it returns the number of cycles spent.
+        """
+        core = self.core
+        spent = 0
+        while not core.fetching:
+            core.run_profiled(1, self)
+            spent += 1
+        # The instruction interrupted may have called or returned (PC is the address of the next opcode)
+        self._retire(core.pc, core.ir)
+        site = core.pc
+        entry = core.interrupt(nmi)
+        # With the fetch/execute overlap the reset cycle of the sequence has fetched the first opcode of the handler
+        self._call(site, core.pc - int(core.microcode.fetch_overlap), "nmi" if nmi else "irq")
+        self.counts[INTERRUPT_ENTRY] += entry
+        self.address = -1
+        return spent + entry
+
+    def run_with_devices(self, memory, cycles: int, quantum: int = DEVICE_QUANTUM) -> None:
+        """
+        This function runs the core as memory_map.run_with_devices() does (ticking the devices and sampling the IRQ line every quantum) and profiles it.
+        """
+        while cycles > 0:
+            step = min(quantum, cycles)
+            self.run(step)
+            memory.tick(step)
+            cycles -= step
+            if memory.irq and not self.core.p & IRQ_DISABLE:
+                spent = self.interrupt()
+                memory.tick(spent)
+                cycles -= spent
+
+    def folded_stacks(self, symbols: SymbolTable) -> dict[tuple[str, ...], int]:
+        """
+        This function returns the cycles of every stack of labels: the label of the outermost call site, the labels of the callees, then the label of the instructions (if it is not the one of the innermost callee).
+        """
+        folded: dict[tuple[str, ...], int] = {}
+        for stack, counts in self.stacks.items():
+            frames = (symbols.label(stack[0][0]),) + tuple(symbols.label(callee) for _, callee in stack) if stack else ()
+            for address, cycles in enumerate(counts):
+                if cycles:
+                    leaf = symbols.label(address)
+                    path = frames if frames and frames[-1] == leaf else frames + (leaf,)
+                    folded[path] = folded.get(path, 0) + cycles
+        return folded
+
+    def address_cycles(self) -> array:
+        """
+        This function returns the cycles of every address, summed over the call stacks.
+        """
+        total = _counters()
+        for counts in self.stacks.values():
+            for address, cycles in enumerate(counts):
+                if cycles:
+                    total[address] += cycles
+        return total
+
+
+def flat_profile(folded: dict[tuple[str, ...], int]) -> list[tuple[str, int, int]]:
+    """
+    This function returns the (label, exclusive cycles, inclusive cycles) of every label, by decreasing inclusive cycles.
+    """
+    exclusive: dict[str, int] = {}
+    inclusive: dict[str, int] = {}
+    for path, cycles in folded.items():
+        exclusive[path[-1]] = exclusive.get(path[-1], 0) + cycles
+        # A recursive label is counted once per stack
+        for label in set(path):
+            inclusive[label] = inclusive.get(label, 0) + cycles
+    return sorted(((label, exclusive.get(label, 0), cycles) for label, cycles in inclusive.items()), key=lambda item: (-item[2], item[0]))
+
+
+def write_folded(folded: dict[tuple[str, ...], int], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        for stack, cycles in sorted(folded.items()):
+            file.write(f"{';'.join(stack)} {cycles}\n")
+
+
+def write_heatmap(profiler: GuestProfiler, symbols: SymbolTable, path: str) -> None:
+    cycles = profiler.address_cycles()
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("address,location,executions,cycles\n")
+        for address in range(COUNTERS_SIZE):
+            if cycles[address]:
+                executions = profiler.executions[address] if address < MEMORY_SIZE else 0
+                file.write(f"{address:04x},{symbols.locate(address)},{executions},{cycles[address]}\n")
+
+
+def _share(cycles: int, total: int) -> str:
+    return f"{100 * cycles / total:.1f}%" if total else "-"
+
+
+def format_report(profiler: GuestProfiler, symbols: SymbolTable, top: int = 20) -> str:
+    folded = profiler.folded_stacks(symbols)
+    total = sum(folded.values())
+    report = f"{total} cycles, {sum(profiler.executions)} instructions, {len(profiler.stacks)} call stacks\n\n"
+    report += "Label | Exclusive | Inclusive\n-- | -- | --\n"
+    for label, exclusive, inclusive in flat_profile(folded):
+        report += f"{label} | {exclusive} ({_share(exclusive, total)}) | {inclusive} ({_share(inclusive, total)})\n"
+    if profiler.calls:
+        report += "\nCall site | Callee | Kind | Calls\n-- | -- | -- | --\n"
+        for (site, callee, kind), calls in sorted(profiler.calls.items(), key=lambda item: -item[1]):
+            report += f"{symbols.locate(site) if site >= 0 else '-'} | {symbols.label(callee)} | {kind} | {calls}\n"
+    cycles = profiler.address_cycles()
+    hottest = sorted((address for address in range(COUNTERS_SIZE) if cycles[address]), key=lambda address: -cycles[address])[:top]
+    if hottest:
+        report += "\nAddress | Location | Executions | Cycles | Heat\n-- | -- | -- | -- | --\n"
+        for address in hottest:
+            executions = profiler.executions[address] if address < MEMORY_SIZE else "-"
+            bar = "#" * max(1, round(40 * cycles[address] / cycles[hottest[0]]))
+            report += f"${address:04x} | {symbols.locate(address)} | {executions} | {cycles[address]} ({_share(cycles[address], total)}) | {bar}\n"
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile a guest program on the Turtle Core: cycles per address, label and call stack.")
+    parser.add_argument("binary", nargs="?", help="binary image loaded at the ROM start ($8000)")
+    parser.add_argument("--source", help="assemble this source (assembler.py) instead of loading a binary, its labels are the symbols")
+    parser.add_argument("--symbols", help="symbol listing ('$8000 start' or 'start = $8000' lines)")
+    parser.add_argument("--cycles", type=int, default=100_000, help="number of microcycles to run")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--devices", action="store_true", help="run with the memory map and its IO devices (UART, timer raising the IRQ line)")
+    parser.add_argument("--folded", help="write the folded stacks (flamegraph.pl input) to this file")
+    parser.add_argument("--heatmap", help="write the executions and cycles of every executed address (CSV) to this file")
+    parser.add_argument("--top", type=int, default=20, help="number of hottest addresses reported")
+    parser.add_argument("--overhead", action="store_true", help="also run the program without profiling and report the slowdown")
+    args = parser.parse_args()
+
+    instructions = build_instructions()
+    symbols: dict[str, int] = {}
+    if args.source is not None:
+        with open(args.source, "r", encoding="utf-8") as file:
+            program = assemble(file.read())
+        image, origin = bytes(program.image), program.origin
+        symbols.update(program.symbols)
+    elif args.binary is not None:
+        with open(args.binary, "rb") as file:
+            image = file.read()
+        origin = ROM_START
+    else:
+        parser.error("a binary or --source is needed")
+    if args.symbols is not None:
+        with open(args.symbols, "r", encoding="utf-8") as file:
+            symbols.update(parse_symbols(file.read()))
+    for name, address in vector_symbols(image, origin).items():
+        symbols.setdefault(name, address)
+    table = SymbolTable(symbols, origin, origin + len(image))
+    microcode = Microcode.from_directory(args.pla_dir)
+
+    def boot() -> tuple[TurtleCore, object]:
+        if args.devices:
+            memory = default_memory_map()[0]
+            memory.map_image(image, origin)
+        else:
+            memory = bytearray(MEMORY_SIZE)
+        core = TurtleCore(microcode, memory)
+        if not args.devices:
+            core.load(image, origin)
+        core.reset()
+        return core, memory
+
+    core, memory = boot()
+    profiler = GuestProfiler(core, instructions)
+    start = time.perf_counter()
+    if args.devices:
+        profiler.run_with_devices(memory, args.cycles)
+    else:
+        profiler.run(args.cycles)
+    profiled = time.perf_counter() - start
+
+    print(format_report(profiler, table, args.top))
+    if args.folded is not None:
+        write_folded(profiler.folded_stacks(table), args.folded)
+    if args.heatmap is not None:
+        write_heatmap(profiler, table, args.heatmap)
+    if args.overhead:
+        core, memory = boot()
+        start = time.perf_counter()
+        if args.devices:
+            run_with_devices(core, memory, args.cycles)
+        else:
+            core.run(args.cycles)
+        plain = time.perf_counter() - start
+        print(f"Profiled: {profiled:.3f}s, not profiled: {plain:.3f}s ({profiled / plain:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# pylint: disable=line-too-long
+"""
+This module contains the electrical and control hazard checker of the
+generated microcode.
+
+Every control word of the tables (the decode rows of every implemented opcode
+on both flag paths, its fetch rows, which the fusion may merge with its last
+cycle, and the reset rows) is loaded into a NumPy uint64 array and every check
+is a few masks and bit counts over the whole array, so the tables are checked
+at once (fast enough to run on every generation with pla_generator.py
+--check-hazards).
+
+Checks (SB_DB and SB_ADH are one way buffers driving DB and ADH with SB):
+- bus conflict: more than one register drives a bus (ADD_SB06/ADD_SB7 are one
+  driver, SB_DB and SB_ADH are drivers of DB and ADH; the O_ADL*/O_ADH*
+  pull-downs are wired-AND masks, not drivers)
+- undriven latch: a register or a flag latches a bus that nothing drives (not
+  even a pull-down). Four idioms of the microcode read the precharged $FF on
+  purpose and are not reported: ADL_PCL with I_PC (PCL wraps around and PCH is
+  incremented), DB2_I alone (the reset and the interrupt sequence set I),
+  DB7_N and DBZ_Z alone (the branches restore N = 1 and Z = 0) and the ALU
+  inputs (listed with --precharge).
+- ALU: several operations, several A inputs (SB_ADD, O_ADD) or B inputs
+  (DB_ADD, DBx_ADD, ADL_ADD), a decimal adjust without SUMS, ACR_C without
+  SUMS or SRS, AVR_V without an ALU operation (both sample the inputs latched
+  by the previous cycle with the operations of the current one)
+- status: a flag written by several signals, PCL/PCH loaded from two sources
+- write cycle: DL driving a bus during an RW cycle (DL is not latched then)
+- path flip: a row of an instruction selecting a flag writes this flag while
+  the other path is still running and does not write it, so the next row comes
+  from the other path (the paths selected again on purpose write the flag on
+  both of them, as the carry and the restore of C in BCC/BCS, or in the next row
+  of the other path, and a reset cycle has no next row)
+- select switch: a row writes the flag selecting its path and the row of the
+  other path in the same cycle has other ALU operations, carry in, PC increment
+  or reset cycle. The flags latch with the registers (CL1) and the flag select
+  PLA switches the row at once, ADD, PC and the micro counter latch after (CL2)
+  with the signals of the new row.
+"""
+import argparse
+import sys
+import numpy as np
+from control_flags import *
+from control_model import BUS_READERS, END_OF_CYCLE_SIGNALS, SIGNAL_WRITES, signal_names
+from emulator import Microcode, DECODE_TABLE_SIZE, MICRO_COUNTER_MASK
+from microcode_optimizer import fuse_instructions, overlap_fetch_instructions, FIRST_DECODED_CYCLE
+from pla_generator import Instruction, Flag, build_instructions
+
+MICRO_CYCLES = MICRO_COUNTER_MASK + 1
+OPCODES = DECODE_TABLE_SIZE // (2 * MICRO_CYCLES)
+
+# Data drivers of every bus (a group of signals driving the same register counts once)
+BUS_DATA_DRIVERS = {
+    "DB": (DL_DB, PCL_DB, PCH_DB, AC_DB, P_DB),
+    "SB": (S_SB, AC_SB, X_SB, Y_SB, ADD_SB06 | ADD_SB7),
+    "ADL": (DL_ADL, PCL_ADL, S_ADL, ADD_ADL),
+    "ADH": (DL_ADH, PCH_ADH),
+}
+# Every driver of a bus, with the buffers driving it with SB
+BUS_DRIVERS = {bus: signals + {"DB": (SB_DB,), "ADH": (SB_ADH,)}.get(bus, ()) for bus, signals in BUS_DATA_DRIVERS.items()}
+BUS_PULL_DOWNS = {"DB": 0, "SB": 0, "ADL": O_ADL0 | O_ADL1 | O_ADL2, "ADH": O_ADH0 | O_ADH17}
+ALU_INPUTS = DB_ADD | DBx_ADD | SB_ADD | ADL_ADD
+# Registers and flags latching every bus (the ALU inputs are the other readers)
+BUS_LATCHES = {bus: readers & ~ALU_INPUTS for bus, readers in BUS_READERS.items()}
+
+ALU_OPERATIONS = (SUMS, ANDS, EORS, ORS, SRS)
+ALU_A_INPUTS = (SB_ADD, O_ADD)
+ALU_B_INPUTS = (DB_ADD, DBx_ADD, ADL_ADD)
+# Signals writing every status flag {flag: signals}
+STATUS_WRITERS = {flag: tuple(signal for signal, registers in SIGNAL_WRITES.items() if flag in registers) for flag in ("C", "Z", "I", "D", "V", "N")}
+FLAG_NAMES = {flag.value: flag.name for flag in Flag if flag.value > 0}
+
+
+class Hazard:
+    """
+    This class represents a hazard found in a control word.
+    """
+
+    def __init__(self, table: str, opcode: int | None, cycle: int, flag: int, kind: str, detail: str):
+        self.table = table
+        self.opcode = opcode
+        self.cycle = cycle
+        self.flag = flag
+        self.kind = kind
+        self.detail = detail
+
+
+def _count(words: np.ndarray, signals) -> np.ndarray:
+    """
+    This function returns, for every word, the number of signal groups of signals asserted.
+    """
+    total = np.zeros(words.shape, dtype=np.int64)
+    for signal in signals:
+        total += (words & np.uint64(signal)) != 0
+    return total
+
+
+def _any(words: np.ndarray, mask: int) -> np.ndarray:
+    return (words & np.uint64(mask)) != 0
+
+
+def _nets(words: np.ndarray) -> dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    This function returns {bus: (drivers of the bus, bus driven or pulled down, latches on the bus)} for every word.
+    SB_DB and SB_ADH are one way buffers: they drive DB and ADH with SB and count as one driver of these buses.
+    """
+    drivers = {bus: _count(words, signals) for bus, signals in BUS_DATA_DRIVERS.items()}
+    driven = {bus: (drivers[bus] > 0) | _any(words, BUS_PULL_DOWNS[bus]) for bus in BUS_DATA_DRIVERS}
+    for bus, buffer in (("DB", SB_DB), ("ADH", SB_ADH)):
+        drivers[bus] += _any(words, buffer)
+        driven[bus] |= _any(words, buffer) & driven["SB"]
+    latches = {bus: _any(words, mask) for bus, mask in BUS_LATCHES.items()}
+    # ADL_PCL|I_PC on the precharged ADL increments PCH
+    latches["ADL"] = _any(words, BUS_LATCHES["ADL"] & ~ADL_PCL) | (_any(words, ADL_PCL) & ~_any(words, I_PC))
+    # DB2_I alone on the precharged DB sets I, DB7_N sets N and DBZ_Z clears Z
+    latches["DB"] = _any(words, BUS_LATCHES["DB"] & ~(DB2_I | DB7_N | DBZ_Z))
+    return {bus: (drivers[bus], driven[bus], latches[bus]) for bus in BUS_DATA_DRIVERS}
+
+
+def word_checks(words: np.ndarray) -> list[tuple[str, np.ndarray, callable]]:
+    """
+    This function returns the checks of single control words: (hazard, mask of the failing words, function describing a failing word).
+    """
+    checks = []
+    nets = _nets(words)
+    for bus, (drivers, driven, latches) in nets.items():
+        checks.append((f"bus conflict ({bus})", drivers > 1, lambda word, bus=bus: f"{bus} driven by {_names(word, BUS_DRIVERS[bus])}"))
+        checks.append((f"undriven latch ({bus})", ~driven & latches, lambda word, bus=bus: f"{_names(word, (BUS_LATCHES[bus],))} latch the precharged {bus}"))
+    checks.append(("ALU operations", _count(words, ALU_OPERATIONS) > 1, lambda word: _names(word, ALU_OPERATIONS)))
+    checks.append(("ALU A input", _count(words, ALU_A_INPUTS) > 1, lambda word: _names(word, ALU_A_INPUTS)))
+    checks.append(("ALU B input", _count(words, ALU_B_INPUTS) > 1, lambda word: _names(word, ALU_B_INPUTS)))
+    checks.append(("decimal adjust", _any(words, DDA | DSA) & ~_any(words, SUMS), lambda word: f"{_names(word, (DDA, DSA))} without SUMS"))
+    checks.append(("ALU flag", (_any(words, ACR_C) & ~_any(words, SUMS | SRS)) | (_any(words, AVR_V) & ~_any(words, sum(ALU_OPERATIONS))), lambda word: f"{_names(word, (ACR_C, AVR_V))} without an ALU result"))
+    for flag, writers in STATUS_WRITERS.items():
+        checks.append((f"status ({flag})", _count(words, writers) > 1, lambda word, writers=writers: _names(word, writers)))
+    checks.append(("program counter", (_any(words, PCL_PCL) & _any(words, ADL_PCL)) | (_any(words, PCH_PCH) & _any(words, ADH_PCH)), lambda word: _names(word, (PCL_PCL, ADL_PCL, PCH_PCH, ADH_PCH))))
+    checks.append(("write cycle", _any(words, RW) & _any(words, DL_DB | DL_ADL | DL_ADH), lambda word: f"{_names(word, (DL_DB, DL_ADL, DL_ADH))} during RW (DL is not latched)"))
+    return checks
+
+
+def precharge_check(words: np.ndarray) -> tuple[str, np.ndarray, callable]:
+    """
+    This function returns the check listing the ALU inputs reading an undriven (precharged) net.
+    """
+    mask = np.zeros(words.shape, dtype=bool)
+    inputs = {"DB": DB_ADD | DBx_ADD, "SB": SB_ADD, "ADL": ADL_ADD, "ADH": 0}
+    for bus, (_, driven, _) in _nets(words).items():
+        mask |= ~driven & _any(words, inputs[bus])
+    return "precharged ALU input", mask, lambda word: _names(word, (DB_ADD, DBx_ADD, SB_ADD, ADL_ADD))
+
+
+def _names(word: int, signals) -> str:
+    return ", ".join(name for name in signal_names(word & sum(signals)))
+
+
+def path_flips(decode: np.ndarray, flags: np.ndarray) -> np.ndarray:
+    """
+    This function returns the (opcodes, 2, 16) mask of the rows writing the flag which selects their path while the other path is running and keeps its flag.
+    decode is the (opcodes, 2, 16) array of the decode words and flags the Flag value selected by every opcode.
+    """
+    writers = np.zeros(flags.shape, dtype=np.uint64)
+    for value, name in FLAG_NAMES.items():
+        writers[flags == value] = np.uint64(sum(STATUS_WRITERS.get(name, ())))
+    writes = (decode & writers[:, None, None]) != 0
+    other = decode[:, ::-1, :]
+    # The other path has not reached its reset cycle yet (its rows up to this one have no RST_CYCLE)
+    running = ~np.logical_or.accumulate((other & np.uint64(RST_CYCLE)) != 0, axis=2)
+    next_differs = np.zeros(decode.shape, dtype=bool)
+    next_differs[:, :, :-1] = decode[:, :, 1:] != other[:, :, 1:]
+    # The next row of the other path writes the flag again
+    next_rewrites = np.zeros(decode.shape, dtype=bool)
+    next_rewrites[:, :, :-1] = writes[:, ::-1, 1:]
+    ends = (decode & np.uint64(RST_CYCLE)) != 0
+    return writes & ~writes[:, ::-1, :] & ~ends & running & next_differs & ~next_rewrites & (flags > 0)[:, None, None]
+
+
+def select_switches(decode: np.ndarray, flags: np.ndarray) -> np.ndarray:
+    """
+    This function returns the (opcodes, 2, 16) mask of the rows writing the flag which selects their path while the row of the other
+    path in the same cycle has other end of cycle signals: the flag select PLA switches to it before ADD, PC and the micro counter latch.
+    """
+    writers = np.zeros(flags.shape, dtype=np.uint64)
+    for value, name in FLAG_NAMES.items():
+        writers[flags == value] = np.uint64(sum(STATUS_WRITERS.get(name, ())))
+    writes = (decode & writers[:, None, None]) != 0
+    end_of_cycle = decode & np.uint64(END_OF_CYCLE_SIGNALS)
+    return writes & (end_of_cycle != end_of_cycle[:, ::-1, :]) & (flags > 0)[:, None, None]
+
+
+def check_microcode(microcode: Microcode, instructions: list[Instruction], precharge: bool = False) -> list[Hazard]:
+    """
+    This function returns the hazards of the decode (both flag paths of every implemented opcode), fetch and reset rows of a microcode.
+    """
+    first_decoded = FIRST_DECODED_CYCLE - (1 if microcode.fetch_overlap else 0)
+    decode = np.array(microcode.decode, dtype=np.uint64).reshape(OPCODES, 2, MICRO_CYCLES)
+    flags = np.zeros(OPCODES, dtype=np.int64)
+    implemented = np.zeros(OPCODES, dtype=bool)
+    for instruction in instructions:
+        flags[instruction.opcode] = instruction.flag.value
+        implemented[instruction.opcode] = True
+    # Reachable rows: every cycle of the implemented opcodes, the flag set path only if a flag is selected. The fetch rows
+    # are still selected by the opcode of the previous instruction
+    reachable = np.zeros(decode.shape, dtype=bool)
+    reachable[implemented, 0, :] = True
+    reachable[implemented & (flags > 0), 1, :] = True
+    fetch = np.zeros(decode.shape, dtype=bool)
+    fetch[:, :, :first_decoded] = reachable[:, :, :first_decoded]
+    reachable[:, :, :first_decoded] = False
+    opcodes, paths, cycles = np.nonzero(reachable)
+    fetch_opcodes, fetch_paths, fetch_cycles = np.nonzero(fetch)
+
+    tables = [
+        ("decode", decode[opcodes, paths, cycles], opcodes, cycles, paths),
+        ("fetch", decode[fetch_opcodes, fetch_paths, fetch_cycles], fetch_opcodes, fetch_cycles, fetch_paths),
+        ("reset", np.array(microcode.reset, dtype=np.uint64), None, np.arange(len(microcode.reset)), np.zeros(len(microcode.reset), dtype=np.int64)),
+    ]
+    hazards = []
+    for table, words, table_opcodes, table_cycles, table_paths in tables:
+        checks = word_checks(words) + ([precharge_check(words)] if precharge else [])
+        for kind, mask, describe in checks:
+            for index in np.nonzero(mask)[0]:
+                opcode = None if table_opcodes is None else int(table_opcodes[index])
+                flag = int(flags[opcode]) if opcode is not None and table_paths[index] else 0
+                hazards.append(Hazard(table, opcode, int(table_cycles[index]), flag, kind, describe(int(words[index]))))
+
+    flips = path_flips(decode, flags) & reachable
+    for opcode, path, cycle in zip(*np.nonzero(flips)):
+        flag = int(flags[opcode])
+        word = int(decode[opcode, path, cycle])
+        hazards.append(Hazard("decode", int(opcode), int(cycle), flag if path else 0, "path flip",
+                              f"{_names(word, STATUS_WRITERS[FLAG_NAMES[flag]])} writes {FLAG_NAMES[flag]}, cycle {cycle + 1} runs the {'NULL' if path else FLAG_NAMES[flag]} path row"))
+    switches = select_switches(decode, flags) & reachable
+    for opcode, path, cycle in zip(*np.nonzero(switches)):
+        flag = int(flags[opcode])
+        word, other = int(decode[opcode, path, cycle]), int(decode[opcode, 1 - path, cycle])
+        hazards.append(Hazard("decode", int(opcode), int(cycle), flag if path else 0, "select switch",
+                              f"{_names(word, STATUS_WRITERS[FLAG_NAMES[flag]])} writes {FLAG_NAMES[flag]}, the {'NULL' if path else FLAG_NAMES[flag]} path row ends the cycle with {_names(other, (END_OF_CYCLE_SIGNALS,)) or 'no signal'} instead of {_names(word, (END_OF_CYCLE_SIGNALS,)) or 'no signal'}"))
+    return hazards
+
+
+def to_markdown(hazards: list[Hazard], instructions: list[Instruction]) -> str:
+    names = {instruction.opcode: f"{instruction.name.value} {instruction.addressing_mode.value.short_name}" for instruction in instructions}
+    report = "Table | OpCode | Instruction | Cycle | Flag | Hazard | Detail\n-- | -- | -- | -- | -- | -- | --\n"
+    for hazard in sorted(hazards, key=lambda hazard: (hazard.table, -1 if hazard.opcode is None else hazard.opcode, hazard.cycle, hazard.flag)):
+        opcode = "-" if hazard.opcode is None else f"${hazard.opcode:02x}"
+        name = names.get(hazard.opcode, "-")
+        report += f"{hazard.table} | {opcode} | {name} | {hazard.cycle} | {FLAG_NAMES.get(hazard.flag, 'NULL')} | {hazard.kind} | {hazard.detail}\n"
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check every control word of the microcode for bus conflicts and hazards.")
+    parser.add_argument("--pla-dir", help="check the PLA tables of this directory instead of the generator instructions")
+    parser.add_argument("--fuse", action="store_true", help="apply the microcycle fusion before checking")
+    parser.add_argument("--fetch-overlap", action="store_true", help="apply (or, with --pla-dir, the tables use) the fetch/execute overlap")
+    parser.add_argument("--precharge", action="store_true", help="also list the ALU inputs reading a precharged bus")
+    args = parser.parse_args()
+
+    instructions = build_instructions()
+    if args.pla_dir is not None:
+        microcode = Microcode.from_directory(args.pla_dir, args.fetch_overlap)
+    else:
+        if args.fuse is True:
+            fuse_instructions(instructions)
+        if args.fetch_overlap is True:
+            overlap_fetch_instructions(instructions)
+        microcode = Microcode.from_instructions(instructions, args.fetch_overlap)
+    hazards = check_microcode(microcode, instructions, args.precharge)
+    print(to_markdown(hazards, instructions))
+    print(f"{len(hazards)} hazard(s)")
+    if any(hazard.kind != "precharged ALU input" for hazard in hazards):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
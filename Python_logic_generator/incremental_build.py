@@ -0,0 +1,124 @@
+# pylint: disable=line-too-long
+"""
+This module contains the incremental build of the generated tables.
+
+A small JSON manifest next to the tables keeps the hash of every output file and,
+for every opcode, the hash of its validated cycle list and its decode PLA rows.
+A file is only rewritten when its content changed (so Logisim only reloads the
+tables which really changed) and the opcode rows which differ from the last
+build are reported.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pla_generator import Instruction
+
+MANIFEST_PATH = "./PLAs/.build_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def instruction_hash(instruction: "Instruction") -> str:
+    """
+    This function hashes the validated cycle list of an instruction (with its opcode and flag).
+    """
+    cycles = sorted(instruction.cycles)
+    return content_hash(f"{instruction.opcode}:{instruction.flag.value}:{cycles}")
+
+
+class IncrementalBuild:
+    """
+    This class writes the output files whose content changed and tracks them in the manifest.
+    """
+
+    def __init__(self, manifest_path: str = MANIFEST_PATH):
+        self.manifest_path = manifest_path
+        self.written: list[str] = []
+        self.skipped: list[str] = []
+        self.__manifest = {"version": MANIFEST_VERSION, "files": {}, "opcodes": {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.__manifest = manifest
+
+    def write(self, path: str, text: str) -> bool:
+        """
+        This function writes a file unless it already holds text, and returns True if it has been written.
+        """
+        path = os.path.normpath(path)
+        digest = content_hash(text)
+        entry = self.__manifest["files"].get(path)
+        unchanged = entry is not None and entry["hash"] == digest and os.path.exists(path) and os.path.getsize(path) == entry["size"]
+        if not unchanged and os.path.exists(path):
+            # No (or outdated) manifest entry: compare with the file itself
+            with open(path, "r", encoding="utf-8") as file:
+                unchanged = content_hash(file.read()) == digest
+        self.__manifest["files"][path] = {"hash": digest, "size": len(text.encode("utf-8"))}
+        if unchanged:
+            self.skipped.append(path)
+            return False
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        self.written.append(path)
+        return True
+
+    def diff_instructions(self, instructions: list["Instruction"]) -> str:
+        """
+        This function records the instructions in the manifest and returns the decode rows which differ from the last build.
+        """
+        previous = self.__manifest["opcodes"]
+        current = {}
+        report = ""
+        for instruction in instructions:
+            key = f"{instruction.opcode:02x}"
+            rows = instruction.get_decode_PLA().splitlines()
+            current[key] = {"hash": instruction_hash(instruction), "rows": rows}
+            if key not in previous:
+                report += f"${key} {instruction.name.value} {instruction.addressing_mode.value.short_name}: new opcode ({len(rows)} rows)\n"
+            elif previous[key]["hash"] != current[key]["hash"]:
+                report += f"${key} {instruction.name.value} {instruction.addressing_mode.value.short_name}:\n"
+                report += "".join(f"  - {row}\n" for row in previous[key]["rows"] if row not in rows)
+                report += "".join(f"  + {row}\n" for row in rows if row not in previous[key]["rows"])
+        for key in previous:
+            if key not in current:
+                report += f"${key}: removed opcode ({len(previous[key]['rows'])} rows)\n"
+        self.__manifest["opcodes"] = current
+        return report if report != "" else "No opcode changed\n"
+
+    def summary(self) -> str:
+        return f"{len(self.written)} file(s) written ({', '.join(self.written) or '-'}), {len(self.skipped)} unchanged\n"
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        with open(self.manifest_path, "w", encoding="utf-8") as file:
+            json.dump(self.__manifest, file, indent=1)
+
+
+def source_snapshot(directory: str) -> dict[str, float]:
+    return {name: os.path.getmtime(os.path.join(directory, name)) for name in sorted(os.listdir(directory)) if name.endswith(".py")}
+
+
+def watch(arguments: list[str], directory: str, interval: float = 0.5) -> None:
+    """
+    This function reruns the generator with arguments every time a Python source of directory changes.
+    The generator runs in a new process so the modified sources are reloaded.
+    """
+    command = [sys.executable, os.path.join(directory, "pla_generator.py")] + arguments
+    snapshot = None
+    while True:
+        current = source_snapshot(directory)
+        if current != snapshot:
+            snapshot = current
+            print(f"------ GENERATE ({time.strftime('%H:%M:%S')}) -------", flush=True)
+            subprocess.run(command, check=False)
+        time.sleep(interval)
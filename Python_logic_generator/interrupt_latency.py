@@ -0,0 +1,208 @@
+# pylint: disable=line-too-long
+"""
+This module contains the interrupt latency report: the number of micro cycles
+from the IRQ line asserting to the fetch of the first opcode of the handler,
+measured on the emulator for every opcode of the Instruction list. The TCORE
+circuit has no IRQ/NMI input: the entry is modeled by the emulators
+(TurtleCore.interrupt()/poll()), which force the instruction register to $00,
+drop the PC increments and select the NMI vector themselves, so the figures are
+those of that model, not of the generated PLAs.
+
+The line is sampled at the opcode fetch cycles (TurtleCore.fetching): an IRQ
+asserting during an instruction waits for its end, then the interrupt sequence
+(the cycles of BRK, pla_generator.set_interrupt_sequence) pushes PC and P and
+loads the vector. Every opcode is run with the line asserting at the start of
+each of its cycles, in several scenarios: flags clear and set (both paths of
+the flag select PLA), X and Y at $00 and $FF, operands $10/$02 and $F0/$02, and
+the opcode at $8000 and at the end of a page (page crossings of the indexed
+modes and of the branches). Every run is restored from a snapshot of the
+scenario (snapshot.capture()).
+
+The latency of an opcode goes from the line asserting at its last cycle (best)
+to the line asserting just after the previous fetch (worst). The opcodes
+setting I (BRK, the interrupt opcodes of the IRQ PLA, and SEI) mask the IRQ
+until the handler returns and are reported as masked. NMI is not masked and
+has the same latency (same sequence, other vector). The cycles of an opcode
+are counted as in cycle_report (the "Cycles" column of the instruction docs
++ 1).
+"""
+import argparse
+import sys
+from control_model import IRQ_PLA_BRK, IRQ_PLA_RTI, IRQ_DISABLE
+from emulator import Microcode, TurtleCore, ROM_START
+from microcode_optimizer import fuse_instructions, overlap_fetch_instructions
+from pla_generator import Instruction, build_instructions, get_irq_pla
+from pla_tables import parse_pla, compile_pla
+from snapshot import CowMemory, capture, restore
+
+HANDLER = 0x9000
+IRQ_VECTOR = 0xFFFE
+NMI_VECTOR = 0xFFFA
+# Pointers of the indirect modes (zero page $10 and $F0) and of JMP ($0210)
+POINTERS = {0x10: 0x0210, 0xF0: 0x0210, 0x0210: 0xA000}
+SCENARIO_STARTS = (ROM_START, ROM_START + 0xFD)
+SCENARIO_OPERANDS = ((0x10, 0x02), (0xF0, 0x02))
+SCENARIO_INDEXES = (0x00, 0xFF)
+# Flags clear, and N, V, Z and C set (I stays clear)
+SCENARIO_STATUSES = (0x20, 0xE3)
+
+
+class OpcodeLatency:
+    """
+    This class holds the IRQ latencies measured for one opcode.
+    """
+
+    def __init__(self, instruction: Instruction):
+        self.name = f"{instruction.name.value} {instruction.addressing_mode.value.short_name}"
+        self.cycles: set[int] = set()
+        self.best: int | None = None
+        self.worst: int | None = None
+        self.masked = False
+
+    def add(self, latency: int | None) -> None:
+        if latency is None:
+            self.masked = True
+            return
+        self.best = latency if self.best is None else min(self.best, latency)
+        self.worst = latency if self.worst is None else max(self.worst, latency)
+
+
+def _load_vectors(core: TurtleCore) -> None:
+    memory = core.memory
+    for vector in (IRQ_VECTOR, NMI_VECTOR):
+        memory[vector], memory[vector + 1] = HANDLER & 0xFF, HANDLER >> 8
+    for pointer, target in POINTERS.items():
+        memory[pointer], memory[pointer + 1] = target & 0xFF, target >> 8
+
+
+def _prepare(core: TurtleCore, opcode: int, start: int, operands: tuple[int, int], index: int, status: int) -> None:
+    memory = core.memory
+    memory[start], memory[start + 1], memory[start + 2] = opcode, *operands
+    core.x = core.y = index
+    core.p = status
+    core.s = 0xFF
+    core.mc = 0
+    pc = start
+    if core.microcode.fetch_overlap:
+        # The opcode has been fetched by the last cycle of the previous instruction
+        core.abl, core.abh = start & 0xFF, start >> 8
+        pc += 1
+    core.pcl, core.pch = pc & 0xFF, pc >> 8
+
+
+def instruction_cycles(core: TurtleCore) -> int:
+    """
+    This function runs the instruction of the core up to the next opcode fetch cycle and returns the number of cycles spent.
+    """
+    cycles = 0
+    while cycles == 0 or not core.fetching:
+        core.step()
+        cycles += 1
+        if cycles > 2 * len(core.microcode.reset):
+            raise ValueError(f"Opcode ${core.ir:02x} never reaches an opcode fetch cycle (not implemented?)")
+    return cycles
+
+
+def latency(core: TurtleCore, nmi: bool = False) -> int | None:
+    """
+    This function returns the number of cycles from now (the line asserting) to the fetch of the first opcode of the handler, or None if the IRQ is masked at the next opcode fetch cycle.
+    """
+    cycles = 0
+    while not core.fetching:
+        core.step()
+        cycles += 1
+    if not nmi and core.p & IRQ_DISABLE:
+        return None
+    cycles += core.interrupt(nmi)
+    if core.pc != HANDLER + int(core.microcode.fetch_overlap):
+        raise ValueError(f"The interrupt sequence loads PC ${core.pc:04x} instead of ${HANDLER:04x}!")
+    # With the fetch/execute overlap the reset cycle of the sequence fetches the first opcode of the handler
+    return cycles - 1 if core.microcode.fetch_overlap else cycles
+
+
+def measure_opcodes(instructions: list[Instruction], microcode: Microcode) -> dict[int, OpcodeLatency]:
+    """
+    This function measures the IRQ latency of every opcode in every scenario, for the line asserting at every cycle.
+    """
+    core = TurtleCore(microcode, CowMemory())
+    _load_vectors(core)
+    base = capture(core)
+    results = {}
+    for instruction in instructions:
+        stats = results[instruction.opcode] = OpcodeLatency(instruction)
+        for start in SCENARIO_STARTS:
+            for operands in SCENARIO_OPERANDS:
+                for index in SCENARIO_INDEXES:
+                    for status in SCENARIO_STATUSES:
+                        restore(core, base)
+                        _prepare(core, instruction.opcode, start, operands, index, status)
+                        snapshot = capture(core)
+                        cycles = instruction_cycles(core)
+                        stats.cycles.add(cycles)
+                        for cycle in range(cycles):
+                            restore(core, snapshot)
+                            core.run(cycle)
+                            stats.add(latency(core))
+    return results
+
+
+def sequence_cycles(microcode: Microcode) -> tuple[int, int, int]:
+    """
+    This function returns the cycles of the reset sequence, and of the IRQ and NMI sequences (from the opcode fetch cycle to the fetch of the handler).
+    """
+    core = TurtleCore(microcode)
+    reset = core.reset()
+    _load_vectors(core)
+    entries = []
+    for nmi in (False, True):
+        # The line asserts at the opcode fetch cycle following a TAX
+        _prepare(core, 0xAA, ROM_START, (0, 0), 0, 0x20)
+        instruction_cycles(core)
+        entries.append(latency(core, nmi))
+    return reset, entries[0], entries[1]
+
+
+def to_markdown(results: dict[int, OpcodeLatency], masking: set[int]) -> str:
+    report = "OpCode | Instruction | Cycles | IRQ latency (best - worst)\n-- | -- | -- | --\n"
+    for opcode, stats in results.items():
+        cycles = "/".join(str(cycles) for cycles in sorted(stats.cycles))
+        value = "masked" if stats.masked or opcode in masking else f"{stats.best} - {stats.worst}"
+        report += f"${opcode:02x} | {stats.name} | {cycles} | {value}\n"
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the IRQ latency of every opcode of the Turtle Core microcode.")
+    parser.add_argument("--fuse", action="store_true", help="apply the microcycle fusion before measuring")
+    parser.add_argument("--fetch-overlap", action="store_true", help="apply the fetch/execute overlap before measuring")
+    parser.add_argument("--max-latency", type=int, help="exit with an error if the worst case IRQ latency exceeds this number of micro cycles")
+    args = parser.parse_args()
+
+    instructions = build_instructions()
+    if args.fuse is True:
+        fuse_instructions(instructions)
+    if args.fetch_overlap is True:
+        overlap_fetch_instructions(instructions)
+    microcode = Microcode.from_instructions(instructions, args.fetch_overlap)
+    irq_pla = compile_pla(parse_pla(get_irq_pla(instructions)), 1 << 8)
+
+    results = measure_opcodes(instructions, microcode)
+    masking = {opcode for opcode, stats in results.items() if stats.masked or irq_pla[opcode] & IRQ_PLA_BRK}
+    print(to_markdown(results, masking))
+
+    print("IRQ/NMI entry modeled by the emulator (the TCORE circuit has no interrupt input)")
+    reset, irq, nmi = sequence_cycles(microcode)
+    print(f"Reset sequence: {reset} cycles")
+    print(f"IRQ sequence: {irq} cycles, NMI sequence: {nmi} cycles (opcode fetch cycle to the fetch of the handler)")
+    returns = [results[opcode].cycles for opcode in results if irq_pla[opcode] & IRQ_PLA_RTI]
+    if returns:
+        print(f"Return from interrupt: {'/'.join(str(cycles) for cycles in sorted(set.union(*returns)))} cycles")
+    opcode, worst = max(((opcode, stats.worst) for opcode, stats in results.items() if opcode not in masking), key=lambda item: item[1])
+    print(f"Worst case IRQ latency: {worst} cycles (line asserting during {results[opcode].name}), I set (IRQ masked) after: {', '.join(results[opcode].name for opcode in sorted(masking))}")
+    if args.max_latency is not None and worst > args.max_latency:
+        print(f"The worst case IRQ latency exceeds {args.max_latency} cycles!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# pylint: disable=line-too-long
+"""
+This module contains the memory map of the emulators: the 64KB address space
+split into 256 pages of 256 bytes, every page pointing to the object which
+holds its bytes.
+
+- RAM pages are backed by a bytearray.
+- ROM images (bin/test.bin and the other binaries assembled with .org $8000)
+  are mapped through mmap and memoryview without copying; only the bytes of a
+  last partial page are copied. Writes to ROM are ignored.
+- Devices (memory mapped IO) own a range of registers: their pages dispatch
+  every offset to the device or to the open bus (reads $FF, as the precharged
+  data bus, and writes are ignored).
+
+An access costs one lookup in the page table (a (target, base) pair read with
+target[address - base]) whatever is mapped, so there is no if-chain in the hot
+loop. A MemoryMap can replace the bytearray of a TurtleCore (or of the block
+emulator).
+
+The datapath reads the memory at the address bus at the start of every cycle
+(DL latches it even when the value is not used), so device reads must not have
+side effects: registers are acknowledged by a write. Devices are run by tick()
+between two runs of an engine (run_with_devices()) and request an interrupt
+with their irq attribute (MemoryMap.irq is the IRQ line of the core). The line
+is sampled after every tick: unless the I flag masks it, the core finishes its
+instruction cycle by cycle and enters the IRQ handler (TurtleCore.interrupt()),
+so an IRQ waits up to a quantum (--quantum 1 samples it every cycle).
+
+Default IO page ($7F00-$7FFF):
+- UART at $7F00: DATA (write: send a byte), STATUS (read: $80, transmitter ready)
+- Timer at $7F10: COUNTER low/high (read), RELOAD low/high (write), CONTROL
+  (bit 0: enabled, bit 1: IRQ enabled), STATUS (read bit 7: expired, write:
+  acknowledge). The counter counts microcycles down and is reloaded when it
+  expires.
+"""
+import argparse
+import mmap
+import sys
+import time
+from typing import BinaryIO, Callable
+from block_emulator import BlockEngine
+from control_model import IRQ_DISABLE
+from emulator import Microcode, TurtleCore, MEMORY_SIZE, ROM_START
+from microcode_optimizer import overlap_fetch
+from pla_generator import build_instructions
+
+PAGE_SIZE = 1 << 8
+PAGE_COUNT = MEMORY_SIZE // PAGE_SIZE
+IO_START = 0x7F00
+UART_ADDRESS = 0x7F00
+TIMER_ADDRESS = 0x7F10
+# Microcycles run by the engine between two ticks of the devices
+DEVICE_QUANTUM = 1000
+
+
+class _OpenBus:
+    """
+    This class represents the unmapped addresses: reads return the precharged bus ($FF) and writes are ignored.
+    """
+
+    def __getitem__(self, offset: int) -> int:
+        return 0xFF
+
+    def __setitem__(self, offset: int, value: int) -> None:
+        pass
+
+
+OPEN_BUS = _OpenBus()
+
+
+class Device:
+    """
+    This class is the base of the memory mapped devices: size registers read and written by offset.
+    """
+
+    size = 1
+
+    def __init__(self):
+        self.irq = False
+
+    def read(self, offset: int) -> int:
+        return 0xFF
+
+    def write(self, offset: int, value: int) -> None:
+        pass
+
+    def tick(self, cycles: int) -> None:
+        """
+        This function advances the device by a number of microcycles.
+        """
+
+    def __getitem__(self, offset: int) -> int:
+        return self.read(offset)
+
+    def __setitem__(self, offset: int, value: int) -> None:
+        self.write(offset, value)
+
+
+class Uart(Device):
+    """
+    This class represents a transmit only UART: every byte written to DATA is sent to the output callback.
+    """
+
+    size = 2
+    DATA = 0
+    STATUS = 1
+    TRANSMIT_READY = 0x80
+
+    def __init__(self, output: Callable[[int], None] | None = None):
+        super().__init__()
+        self.sent = bytearray()
+        self.output = output
+
+    def read(self, offset: int) -> int:
+        return self.TRANSMIT_READY if offset == self.STATUS else 0x00
+
+    def write(self, offset: int, value: int) -> None:
+        if offset == self.DATA:
+            self.sent.append(value)
+            if self.output is not None:
+                self.output(value)
+
+
+class Timer(Device):
+    """
+    This class represents a down counter of microcycles which raises an IRQ every time it expires.
+    """
+
+    size = 6
+    COUNTER_LOW, COUNTER_HIGH, RELOAD_LOW, RELOAD_HIGH, CONTROL, STATUS = range(6)
+    ENABLED = 0x01
+    IRQ_ENABLED = 0x02
+    EXPIRED = 0x80
+
+    def __init__(self):
+        super().__init__()
+        self.counter = 0xFFFF
+        self.reload = 0xFFFF
+        self.control = 0
+        self.expired = False
+        self.expirations = 0
+
+    def read(self, offset: int) -> int:
+        if offset == self.COUNTER_LOW:
+            return self.counter & 0xFF
+        if offset == self.COUNTER_HIGH:
+            return self.counter >> 8
+        if offset == self.CONTROL:
+            return self.control
+        if offset == self.STATUS:
+            return self.EXPIRED if self.expired else 0x00
+        return 0xFF
+
+    def write(self, offset: int, value: int) -> None:
+        if offset == self.RELOAD_LOW:
+            self.reload = (self.reload & 0xFF00) | value
+        elif offset == self.RELOAD_HIGH:
+            self.reload = (self.reload & 0x00FF) | value << 8
+        elif offset == self.CONTROL:
+            if value & self.ENABLED and not self.control & self.ENABLED:
+                self.counter = self.reload
+            self.control = value
+        elif offset == self.STATUS:
+            self.expired = False
+        self.irq = self.expired and bool(self.control & self.IRQ_ENABLED)
+
+    def tick(self, cycles: int) -> None:
+        if not self.control & self.ENABLED:
+            return
+        self.counter -= cycles
+        if self.counter < 0:
+            period = self.reload + 1
+            self.expirations += -self.counter // period + (1 if -self.counter % period else 0)
+            self.counter %= period
+            self.expired = True
+        self.irq = self.expired and bool(self.control & self.IRQ_ENABLED)
+
+
+class _DevicePage:
+    """
+    This class dispatches the offsets of a page to the devices mapped in it.
+    """
+
+    def __init__(self):
+        self.slots: list[tuple[object, int]] = [(OPEN_BUS, 0)] * PAGE_SIZE
+
+    def __getitem__(self, offset: int) -> int:
+        target, base = self.slots[offset]
+        return target[offset - base]
+
+    def __setitem__(self, offset: int, value: int) -> None:
+        target, base = self.slots[offset]
+        target[offset - base] = value
+
+
+class MemoryMap:
+    """
+    This class represents the address space: a page table of RAM, ROM images and devices.
+    """
+
+    def __init__(self):
+        self.ram = bytearray(MEMORY_SIZE)
+        self.devices: list[Device] = []
+        # (target, base) of every page: the byte at address is target[address - base]
+        self.__reads: list[tuple[object, int]] = [(self.ram, 0)] * PAGE_COUNT
+        self.__writes: list[tuple[object, int]] = [(self.ram, 0)] * PAGE_COUNT
+        self.__mappings: list[mmap.mmap] = []
+        self.__views: list[memoryview] = []
+
+    def __getitem__(self, address):
+        try:
+            target, base = self.__reads[address >> 8]
+        except TypeError:
+            return bytes(self.__getitem__(index) for index in range(*address.indices(MEMORY_SIZE)))
+        return target[address - base]
+
+    def __setitem__(self, address, value) -> None:
+        try:
+            target, base = self.__writes[address >> 8]
+        except TypeError:
+            for index, byte in zip(range(*address.indices(MEMORY_SIZE)), value):
+                self.__setitem__(index, byte)
+            return
+        target[address - base] = value
+
+    def __len__(self) -> int:
+        return MEMORY_SIZE
+
+    def map_image(self, image, start: int = ROM_START, writable: bool = False) -> None:
+        """
+        This function maps a buffer (bytes, bytearray, mmap...) at start without copying it, read only unless writable.
+        Its last partial page (if any) is copied into the RAM and mapped read only too.
+        """
+        view = memoryview(image).cast("B")
+        if start % PAGE_SIZE != 0 or start + len(view) > MEMORY_SIZE:
+            raise ValueError(f"Image of {len(view)} bytes at ${start:04x} is not page aligned or does not fit in memory!")
+        self.__views.append(view)
+        full_pages = len(view) // PAGE_SIZE
+        for index in range(full_pages):
+            page = (start >> 8) + index
+            self.__reads[page] = (view, start)
+            self.__writes[page] = (view, start) if writable else (OPEN_BUS, 0)
+        tail = len(view) % PAGE_SIZE
+        if tail:
+            address = start + full_pages * PAGE_SIZE
+            self.ram[address:address + tail] = view[full_pages * PAGE_SIZE:]
+            self.__reads[address >> 8] = (self.ram, 0)
+            self.__writes[address >> 8] = (self.ram, 0) if writable else (OPEN_BUS, 0)
+
+    def map_rom(self, file: BinaryIO, start: int = ROM_START) -> int:
+        """
+        This function maps a ROM image file at start through mmap and returns its size.
+        """
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__mappings.append(mapping)
+        self.map_image(mapping, start)
+        return len(mapping)
+
+    def map_device(self, device: Device, start: int) -> Device:
+        """
+        This function maps the registers of a device from start (they may share a page with other devices).
+        """
+        if any(self.is_device(address) for address in range(start, start + device.size)):
+            raise ValueError(f"Device at ${start:04x} overlaps another device!")
+        for address in range(start, start + device.size):
+            page = address >> 8
+            target = self.__reads[page][0]
+            if not isinstance(target, _DevicePage):
+                target = _DevicePage()
+                self.__reads[page] = self.__writes[page] = (target, page << 8)
+            target.slots[address & 0xFF] = (device, start - (page << 8))
+        self.devices.append(device)
+        return device
+
+    def is_device(self, address: int) -> bool:
+        target = self.__reads[address >> 8][0]
+        return isinstance(target, _DevicePage) and target.slots[address & 0xFF][0] is not OPEN_BUS
+
+    @property
+    def irq(self) -> bool:
+        return any(device.irq for device in self.devices)
+
+    def tick(self, cycles: int) -> None:
+        for device in self.devices:
+            device.tick(cycles)
+
+    def close(self) -> None:
+        """
+        This function releases the ROM files mapped (their pages must not be read afterwards).
+        """
+        for view in self.__views:
+            view.release()
+        for mapping in self.__mappings:
+            mapping.close()
+        self.__views, self.__mappings = [], []
+
+
+def default_memory_map(output: Callable[[int], None] | None = None) -> tuple[MemoryMap, Uart, Timer]:
+    """
+    This function returns a memory map with the UART and the timer of the IO page.
+    """
+    memory = MemoryMap()
+    uart = memory.map_device(Uart(output), UART_ADDRESS)
+    timer = memory.map_device(Timer(), TIMER_ADDRESS)
+    return memory, uart, timer
+
+
+def run_with_devices(engine, memory: MemoryMap, cycles: int, quantum: int = DEVICE_QUANTUM) -> None:
+    """
+    This function runs an engine (TurtleCore or BlockEngine) for a number of microcycles, ticking the devices and sampling the IRQ line every quantum.
+    """
+    core = engine.core if isinstance(engine, BlockEngine) else engine
+    while cycles > 0:
+        step = min(quantum, cycles)
+        engine.run(step)
+        memory.tick(step)
+        cycles -= step
+        if memory.irq and not core.p & IRQ_DISABLE:
+            spent = 0
+            while not core.fetching:
+                core.step()
+                spent += 1
+            spent += core.interrupt()
+            memory.tick(spent)
+            cycles -= spent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a binary on the Turtle Core with its ROM mapped from the file and the IO devices.")
+    parser.add_argument("binary", help="ROM image mapped at the ROM start ($8000)")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="number of microcycles to run")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--generate", action="store_true", help="build the microcode from pla_generator instead of the PLA files")
+    parser.add_argument("--fetch-overlap", action="store_true", help="microcode generated with the fetch/execute overlap")
+    parser.add_argument("--quantum", type=int, default=DEVICE_QUANTUM, help="microcycles run between two ticks of the devices")
+    parser.add_argument("--block", action="store_true", help="run the block emulator instead of the cycle accurate one")
+    args = parser.parse_args()
+
+    if args.generate:
+        instructions = build_instructions()
+        if args.fetch_overlap:
+            for instruction in instructions:
+                overlap_fetch(instruction)
+        microcode = Microcode.from_instructions(instructions, args.fetch_overlap)
+    else:
+        microcode = Microcode.from_directory(args.pla_dir, args.fetch_overlap)
+    memory, uart, timer = default_memory_map(lambda value: sys.stdout.write(chr(value)))
+    with open(args.binary, "rb") as file:
+        memory.map_rom(file)
+    core = TurtleCore(microcode, memory)
+    core.reset()
+    engine = core
+    if args.block:
+        engine = BlockEngine(core)
+
+    start = time.perf_counter()
+    run_with_devices(engine, memory, args.cycles, args.quantum)
+    elapsed = time.perf_counter() - start
+    memory.close()
+
+    print()
+    print(core)
+    print(f"UART: {len(uart.sent)} byte(s) sent, timer: {timer.expirations} expiration(s), IRQ line {'high' if memory.irq else 'low'}")
+    print(f"{args.cycles} microcycles in {elapsed:.3f}s ({args.cycles / elapsed:,.0f} microcycles/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# pylint: disable=line-too-long
+"""
+This module contains the microcycle fusion optimizer.
+
+Every flag path of a validated instruction is scanned and a cycle is pulled into
+the previous one whenever both control words can run in the same clock: they do
+not share a bus (or the ALU), the second one does not read a register latched by
+the first one (read-after-write) and they do not latch the same register. The
+reset cycle and the cycles driven by the vector PLA are left untouched.
+
+The micro-ops of the last cycle before the reset (e.g. the SB_AC/DBZ_Z/DB7_N
+writeback of a load or of ADC) are then moved across the instruction boundary,
+into micro cycle 0 of the next opcode fetch: its decode row is still selected
+by the instruction register of the instruction which just ended, and the PLA
+ORs it with the shared fetch row. The cycle is carried when it is the same on
+every flag path, shares no bus with the fetch, latches nothing the fetch reads
+(PC) or latches and does not write memory (DOR would be latched by the reset
+cycle). The instruction is one cycle shorter, with the 6502 semantics kept: the
+registers it latches are only read after the opcode cycle.
+
+It also contains the fetch/execute overlap pass: the fetch of the next opcode
+(micro cycle 0) and the micro counter reset are merged into the last cycle of
+every flag path, or replace the reset cycle when the last cycle uses the program
+counter or the address buses. The instruction register then latches the opcode
+at the end of micro cycle 0 and the instruction cycles start one cycle earlier.
+
+A branch rewrites the flag it tests, so its flag paths hold several reset
+cycles: it is not fused and the overlap only merges the fetch into its reset
+cycles.
+"""
+from typing import TYPE_CHECKING
+from control_flags import *
+from control_model import used_buses, word_reads, word_writes, BRK_OPCODE, FETCH_CYCLE, OPCODE_CYCLE
+
+if TYPE_CHECKING:
+    from pla_generator import Instruction
+
+FIRST_DECODED_CYCLE = 2
+# Micro cycle of the next opcode fetch, its row is selected by the opcode of the instruction which just ended
+NEXT_FETCH_CYCLE = 0
+FLAG_ANY = -1
+FLAG_NULL = 0
+MICRO_CYCLES = 16
+
+# Processor status register sampled by the flag select PLA (indexed by Flag.value)
+FLAG_REGISTERS = {1: "C", 2: "Z", 3: "I", 4: "D", 5: "B", 6: "V", 7: "N"}
+
+
+def can_fuse(first: int, second: int, following: list[int], branch_flag: str | None = None) -> bool:
+    """
+    This function checks if the control word second can be executed in the same cycle as first.
+    following are the control words that may be executed right after second.
+    """
+    if (first | second) & RST_CYCLE:
+        return False
+    if used_buses(first) & used_buses(second):
+        return False
+    first_writes = word_writes(first) - {"DOR"}
+    if word_reads(second) & (first_writes | {"DOR"}):
+        return False
+    if first_writes & word_writes(second):
+        return False
+    # The next micro-instruction is selected by the flag after first
+    if branch_flag is not None and branch_flag in first_writes:
+        return False
+    # The data output register latches DB at the end of every cycle
+    if "DB" in used_buses(first) and any(word & RW for word in following):
+        return False
+    return True
+
+
+def _fuse_words(words: list[int], following: list[int], branch_flag: str | None) -> list[int]:
+    words = list(words)
+    index = 0
+    while index < len(words) - 1:
+        next_words = [words[index + 2]] if index + 2 < len(words) else following
+        if can_fuse(words[index], words[index + 1], next_words, branch_flag):
+            words[index] |= words[index + 1]
+            del words[index + 1]
+        else:
+            index += 1
+    return words
+
+
+def _split_paths(instruction: "Instruction") -> tuple[list[int], dict[int, list[int]]]:
+    rows = sorted(instruction.cycles, key=lambda row: row[0])
+    tags = [FLAG_NULL] if instruction.flag.value == FLAG_NULL else [FLAG_NULL, instruction.flag.value]
+    any_words: dict[int, int] = {cycle: value for cycle, flag, value in rows if flag == FLAG_ANY}
+    paths: dict[int, list[int]] = {}
+    for tag in tags:
+        path = {cycle: value for cycle, flag, value in rows if flag == tag}
+        if len(path) == 0:
+            continue
+        if len(any_words) > 0 and min(path) <= max(any_words):
+            raise ValueError(f"Instruction {instruction}: flag dependent cycle before a shared cycle!")
+        first_cycle = max(any_words) + 1 if len(any_words) > 0 else FIRST_DECODED_CYCLE
+        # Missing cycles execute an empty control word
+        paths[tag] = [path.get(cycle, 0) for cycle in range(first_cycle, max(path) + 1)]
+    shared = [any_words.get(cycle, 0) for cycle in range(FIRST_DECODED_CYCLE, max(any_words) + 1)] if len(any_words) > 0 else []
+    return shared, paths
+
+
+def _join_paths(shared: list[int], paths: dict[int, list[int]], first_cycle: int = FIRST_DECODED_CYCLE) -> list[tuple[int, int, int]]:
+    cycles = [(first_cycle + index, FLAG_ANY, word) for index, word in enumerate(shared)]
+    for tag, words in paths.items():
+        cycles += [(first_cycle + len(shared) + index, tag, word) for index, word in enumerate(words)]
+    return cycles
+
+
+def _has_inner_reset(paths: dict[int, list[int]]) -> bool:
+    return any(word & RST_CYCLE for words in paths.values() for word in words[:-1])
+
+
+def fuse_instruction(instruction: "Instruction") -> None:
+    """
+    This function fuses the cycles of a validated instruction in place.
+    """
+    if instruction.opcode == BRK_OPCODE:
+        return
+    shared, paths = _split_paths(instruction)
+    if _has_inner_reset(paths):
+        return
+    branch_flag = FLAG_REGISTERS.get(instruction.flag.value)
+    shared = _fuse_words(shared, [path[0] for path in paths.values()], None)
+    paths = {tag: _fuse_words(words, [], branch_flag) for tag, words in paths.items()}
+    tail = _fetch_tail(paths)
+    if tail != 0:
+        paths = {tag: words[:-2] + words[-1:] for tag, words in paths.items()}
+    instruction.cycles = _join_paths(shared, paths) + ([(NEXT_FETCH_CYCLE, FLAG_ANY, tail)] if tail != 0 else [])
+
+
+def _fetch_tail(paths: dict[int, list[int]]) -> int:
+    """
+    This function returns the last cycle before the reset of every flag path if it can be carried into the next opcode fetch, 0 otherwise.
+    """
+    tails = {words[-2] if len(words) > 1 else 0 for words in paths.values()}
+    if len(tails) != 1:
+        return 0
+    tail = tails.pop()
+    # The data output register written by a store is latched at the end of the cycle before it, the reset cycle here
+    if tail == 0 or tail & RW or not can_fuse(tail, FETCH_CYCLE, [OPCODE_CYCLE]):
+        return 0
+    return tail
+
+
+def _pop_fetch_tail(instruction: "Instruction") -> int:
+    """
+    This function removes the cycle carried into the next opcode fetch by the fusion and returns it (0 if there is none).
+    """
+    tail = sum(value for cycle, _, value in instruction.cycles if cycle == NEXT_FETCH_CYCLE)
+    if tail != 0:
+        instruction.cycles = [row for row in instruction.cycles if row[0] != NEXT_FETCH_CYCLE]
+    return tail
+
+
+def overlap_fetch(instruction: "Instruction") -> None:
+    """
+    This function merges the opcode fetch and the micro counter reset into the last cycle of every flag path of a validated instruction.
+    """
+    # A cycle carried into the next opcode fetch by the fusion goes back before the reset: the fetch moves into it instead
+    tail = _pop_fetch_tail(instruction)
+    shared, paths = _split_paths(instruction)
+    if tail != 0:
+        paths = {tag: words[:-1] + [tail] + words[-1:] for tag, words in paths.items()}
+    if _has_inner_reset(paths):
+        # Every cycle keeps its place: the paths entered with a rewritten flag are aligned on the micro counter
+        paths = {tag: [word | FETCH_CYCLE if word & RST_CYCLE else word for word in words] for tag, words in paths.items()}
+        instruction.cycles = _join_paths(shared, paths, FIRST_DECODED_CYCLE - 1)
+        return
+    for words in paths.values():
+        if words[-1] != RST_CYCLE:
+            raise ValueError(f"Instruction {instruction}: last cycle is not a reset cycle!")
+        if len(words) > 1 and can_fuse(words[-2], FETCH_CYCLE, []):
+            words[-2] |= FETCH_CYCLE | RST_CYCLE
+            del words[-1]
+        else:
+            words[-1] |= FETCH_CYCLE
+    instruction.cycles = _join_paths(shared, paths, FIRST_DECODED_CYCLE - 1)
+
+
+def fuse_instructions(instructions: list["Instruction"]) -> str:
+    """
+    This function fuses the cycles of every instruction and returns a markdown table of the old and new cycle counts.
+    """
+    return _optimize_instructions(instructions, fuse_instruction, "Fused cycles")
+
+
+def overlap_fetch_instructions(instructions: list["Instruction"]) -> str:
+    """
+    This function applies the fetch/execute overlap to every instruction and returns a markdown table of the old and new cycle counts.
+    """
+    return _optimize_instructions(instructions, overlap_fetch, "Overlapped cycles")
+
+
+def _optimize_instructions(instructions: list["Instruction"], optimize, title: str) -> str:
+    report = f"OpCode | Instruction | Cycles | {title}\n-- | -- | -- | --\n"
+    saved = 0
+    for instruction in instructions:
+        before = path_lengths(instruction)
+        optimize(instruction)
+        after = path_lengths(instruction)
+        saved += sum(before) - sum(after)
+        report += f"${instruction.opcode:02x} | {instruction.name.value} {instruction.addressing_mode.value.short_name} | {format_cycles(before)} | {format_cycles(after)}\n"
+    report += f"\nTotal cycles removed (sum over all opcodes and flag paths): {saved}\n"
+    return report
+
+
+def exit_paths(instruction: "Instruction") -> list[list[int]]:
+    """
+    This function returns the control words of every execution path of a validated instruction, from its first decoded cycle to a reset cycle.
+    The selected flag may have any value when the instruction starts, and any value after a cycle writing it (paths never reaching a reset cycle are left out).
+    """
+    # The cycle carried into the next opcode fetch (micro cycle 0) is not part of the instruction cycles
+    words = {(cycle, flag): value for cycle, flag, value in instruction.cycles if cycle != NEXT_FETCH_CYCLE}
+    if len(words) == 0:
+        return []
+    branch_flag = FLAG_REGISTERS.get(instruction.flag.value)
+    tags = [FLAG_NULL] if branch_flag is None else [FLAG_NULL, instruction.flag.value]
+    first_cycle = min(cycle for cycle, _ in words)
+    paths = []
+    pending = [(first_cycle, tag, []) for tag in tags]
+    while pending:
+        cycle, tag, path = pending.pop()
+        if cycle >= MICRO_CYCLES:
+            # The flag was rewritten into a path which already ended: the micro counter wraps around
+            continue
+        word = words.get((cycle, FLAG_ANY), words.get((cycle, tag), 0))
+        path = path + [word]
+        if word & RST_CYCLE:
+            paths.append(path)
+        elif branch_flag is not None and branch_flag in word_writes(word):
+            pending += [(cycle + 1, next_tag, path) for next_tag in tags]
+        else:
+            pending.append((cycle + 1, tag, path))
+    return paths
+
+
+def path_lengths(instruction: "Instruction") -> list[int]:
+    """
+    This function returns the cycle count of the shortest execution path and, if another path is longer, of the longest one.
+    """
+    first_cycle = min((cycle for cycle, _, _ in instruction.cycles if cycle != NEXT_FETCH_CYCLE), default=0)
+    lengths = sorted({first_cycle + len(path) - 1 for path in exit_paths(instruction)}) or [0]
+    return [lengths[0], lengths[-1]] if len(lengths) > 1 else lengths
+
+
+def instruction_length(instruction: "Instruction") -> int:
+    """
+    This function returns the size in bytes of an instruction: the opcode and every I_PC of its shortest path (a branch not taken).
+    """
+    words = min(exit_paths(instruction), key=len, default=[])
+    length = 1 + sum(1 for word in words if word & I_PC)
+    # With the fetch/execute overlap the last cycle also increments PC for the next opcode
+    if len(words) > 0 and words[-1] & RST_CYCLE and words[-1] & I_PC:
+        length -= 1
+    return length
+
+
+def format_cycles(lengths: list[int]) -> str:
+    return f"{lengths[0]}{'' if len(lengths) < 2 or lengths[1] <= lengths[0] else ' +(' + str(lengths[1] - lengths[0]) + ')'}"
@@ -4,12 +4,17 @@
 This module contains functions for encoding decoding instructions logic
 into binary format for a PLA (Programmable Logic Array).
 """
+import argparse
+import os
+import sys
 from enum import Enum
-from numpy import vsplit
-import pandas as pd
-from functools import reduce
 import warnings
 from control_flags import *
+from control_model import END_OF_CYCLE_SIGNALS, FETCH_CYCLE, OPCODE_CYCLE, IRQ_PLA_BRK, IRQ_PLA_RTI
+from pla_minimizer import minimize_pla, count_rows
+from pla_tables import pla_to_rom_images
+from microcode_optimizer import fuse_instructions, overlap_fetch_instructions, path_lengths, format_cycles
+from incremental_build import IncrementalBuild, watch
 
 
 class AdressMode:
@@ -112,6 +117,17 @@ class InstructionName(Enum):
     TYA = "TYA"
 
 
+# Instructions writing C after their addressing mode
+CARRY_WRITERS = {InstructionName.ADC, InstructionName.SBC, InstructionName.CMP, InstructionName.CPX, InstructionName.CPY,
+                 InstructionName.ASL, InstructionName.LSR, InstructionName.ROL, InstructionName.ROR}
+
+# Instructions putting the data to store on DB in the last cycle of their addressing mode
+STORES = {InstructionName.STA, InstructionName.STX, InstructionName.STY}
+
+# Rows addressable by the 4 bits micro counter
+MICRO_CYCLES = 16
+
+
 class Flag(Enum):
     ANY = -1
     NULL = 0
@@ -124,6 +140,19 @@ class Flag(Enum):
     N = 7
 
 
+# Branch instructions {name: (flag tested, value of the flag when the branch is taken)}
+BRANCH_CONDITIONS = {
+    InstructionName.BCC: (Flag.C, 0),
+    InstructionName.BCS: (Flag.C, 1),
+    InstructionName.BNE: (Flag.Z, 0),
+    InstructionName.BEQ: (Flag.Z, 1),
+    InstructionName.BVC: (Flag.V, 0),
+    InstructionName.BVS: (Flag.V, 1),
+    InstructionName.BPL: (Flag.N, 0),
+    InstructionName.BMI: (Flag.N, 1),
+}
+
+
 class Instruction:
     """
     This class represents a single instruction.
@@ -134,7 +163,11 @@ class Instruction:
         self.__opcode = opcode
         self.__addressing_mode = addressing_mode
         self.__first_cycle_after_addressing = 0
-        self.__cycles: list[tuple[int, int, int]] = [] # (cycle, flag, value)
+        # Indexed microprogram: {flag: one slot per micro cycle (None when the row does not exist)}
+        self.__words: dict[int, list[int | None]] = {}
+        self.__rows: list[tuple[int, int]] = [] # (cycle, flag) in insertion order
+        self.__last_cycles: dict[int, int] = {} # {flag: last cycle}
+        self.__cycles: list[tuple[int, int, int]] | None = None # (cycle, flag, value) in PLA order once validated
         self.__save_raw_cycles_after_adressing: list[tuple[int, int, Flag]] = [] # (cycle, flag, value)
         self.__flag = Flag.NULL
         self.__flag_inside_addressing = False
@@ -156,8 +189,17 @@ class Instruction:
 
     @property
     def cycles(self) -> list[tuple[int, int, int]]:
+        if self.__cycles is None:
+            return self.__sorted_cycles(self.__rows)
         return self.__cycles
 
+    @cycles.setter
+    def cycles(self, cycles: list[tuple[int, int, int]]):
+        self.__words, self.__rows, self.__last_cycles = {}, [], {}
+        for cycle, flag, value in cycles:
+            self.__store(cycle, flag, value)
+        self.__cycles = list(cycles)
+
     @property
     def first_cycle_after_addressing(self) -> int:
         return self.__first_cycle_after_addressing
@@ -173,25 +215,20 @@ class Instruction:
             self.__first_cycle_after_addressing = 3
         elif self.__addressing_mode == AdressModesList.ABS:
             self.set_cycle(2, PCL_ADL | PCH_ADH | ADL_ABL | ADH_ABH | I_PC)
-            self.set_cycle(3, DL_DB | DB_ADD | O_ADD | PCL_PCL | PCH_PCH | PCL_ADL | PCH_ADH | ADL_ABL | ADH_ABH | SUMS | I_PC)
+            # The low byte goes through the ALU without carry in ($00 | DL)
+            self.set_cycle(3, DL_DB | DB_ADD | O_ADD | PCL_PCL | PCH_PCH | PCL_ADL | PCH_ADH | ADL_ABL | ADH_ABH | ORS | I_PC)
             self.set_cycle(4, DL_ADH | ADH_ABH | ADD_ADL | ADL_ABL | PCL_PCL | PCH_PCH)
             self.__first_cycle_after_addressing = 5
         elif self.__addressing_mode == AdressModesList.ABSX:
-            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC, Flag.ANY)
+            # AI = BI = 0 (DB is not driven): the sum of cycle 3 clears C before adding the low byte
+            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC|O_ADD|DBx_ADD, Flag.ANY)
             self.set_cycle(3, PCL_PCL|PCH_PCH|PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC|DL_DB|DB_ADD|SB_ADD|X_SB|SUMS|ACR_C, Flag.ANY)
-            self.set_cycle(4, PCL_PCL|PCH_PCH|ADD_ADL|ADL_ABL|DL_ADH|ADH_ABH, Flag.NULL)
-            self.set_cycle(4, PCL_PCL|PCH_PCH|ADD_ADL|ADL_ABL|DL_DB|DB_ADD|O_ADD|SUMS, Flag.C)
-            self.set_cycle(5, ADD_SB06|ADD_SB7|SB_ADH|ADH_ABH|DB0_C, Flag.C)
-            self.__flag_inside_addressing = True
-            self.__first_cycle_after_addressing = 5
+            self.__apply_page_cross(4, PCL_PCL|PCH_PCH)
         elif self.__addressing_mode == AdressModesList.ABSY:
-            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC, Flag.ANY)
+            # AI = BI = 0 (DB is not driven): the sum of cycle 3 clears C before adding the low byte
+            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC|O_ADD|DBx_ADD, Flag.ANY)
             self.set_cycle(3, PCL_PCL|PCH_PCH|PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC|DL_DB|DB_ADD|SB_ADD|Y_SB|SUMS|ACR_C, Flag.ANY)
-            self.set_cycle(4, PCL_PCL|PCH_PCH|ADD_ADL|ADL_ABL|DL_ADH|ADH_ABH, Flag.NULL)
-            self.set_cycle(4, PCL_PCL|PCH_PCH|ADD_ADL|ADL_ABL|DL_DB|DB_ADD|O_ADD|SUMS, Flag.C)
-            self.set_cycle(5, ADD_SB06|ADD_SB7|SB_ADH|ADH_ABH|DB0_C, Flag.C)
-            self.__flag_inside_addressing = True
-            self.__first_cycle_after_addressing = 5
+            self.__apply_page_cross(4, PCL_PCL|PCH_PCH)
         elif self.__addressing_mode == AdressModesList.IMM:
             self.set_cycle(2, PCL_ADL | PCH_ADH | ADL_ABL | ADH_ABH | I_PC)
             self.set_cycle(3, PCL_PCL | PCH_PCH)
@@ -201,115 +238,300 @@ class Instruction:
             self.set_cycle(3, PCL_PCL | PCH_PCH)
             self.__first_cycle_after_addressing = 3
         elif self.__addressing_mode == AdressModesList.IND:
-            raise NotImplementedError("Indirect addressing mode is not implemented yet!")
+            # The address bus holds the pointer, ADD its low byte (SB is not driven: $FF & DL)
+            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC)
+            self.set_cycle(3, PCL_PCL|PCH_PCH|PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC|DL_DB|DB_ADD|SB_ADD|ANDS)
+            self.set_cycle(4, PCL_PCL|PCH_PCH|ADD_ADL|ADL_ABL|DL_ADH|ADH_ABH)
+            self.__first_cycle_after_addressing = 5
         elif self.__addressing_mode == AdressModesList.XIND:
-            raise NotImplementedError("X-indexed, indirect addressing mode is not implemented yet!")
+            self.__add_index(X_SB)
+            # Pointer + 1 wraps around in the zero page
+            self.set_cycle(5, ADD_ADL|ADL_ABL|ADL_ADD|O_ADD|I_ADDC|SUMS)
+            self.set_cycle(6, ADD_ADL|ADL_ABL|DL_DB|DB_ADD|SB_ADD|ANDS)
+            self.set_cycle(7, ADD_ADL|ADL_ABL|DL_ADH|ADH_ABH)
+            self.__first_cycle_after_addressing = 8
         elif self.__addressing_mode == AdressModesList.INDY:
-            raise NotImplementedError("Indirect, Y-indexed addressing mode is not implemented yet!")
+            # C is cleared as for abs,X (the pointer + 1 has I_ADDC as carry in)
+            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC|O_ADD|DBx_ADD, Flag.ANY)
+            self.set_cycle(3, PCL_PCL|PCH_PCH|DL_ADL|ADL_ABL|O_ADH0|O_ADH17|ADH_ABH|DL_DB|DB_ADD|O_ADD|I_ADDC|SUMS|ACR_C, Flag.ANY)
+            self.set_cycle(4, ADD_ADL|ADL_ABL|DL_DB|DB_ADD|Y_SB|SB_ADD|SUMS, Flag.ANY)
+            self.__apply_page_cross(5)
         elif self.__addressing_mode == AdressModesList.REL:
-            raise NotImplementedError("Relative addressing mode is not implemented yet!")
+            self.__apply_relative_mode()
         elif self.__addressing_mode == AdressModesList.ZPG:
             self.set_cycle(2, PCL_ADL | PCH_ADH | ADL_ABL | ADH_ABH | I_PC)
             self.set_cycle(3, PCL_PCL | PCH_PCH | DL_ADL | ADL_ABL | O_ADH0 | O_ADH17 | ADH_ABH)
             self.__first_cycle_after_addressing = 4
         elif self.__addressing_mode == AdressModesList.ZPGX:
-            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC)
-            self.set_cycle(3, PCL_PCL|PCH_PCH|DL_DB|DB_ADD|X_SB|SB_ADD|SUMS|O_ADH0|O_ADH17|ADH_ABH)
-            self.set_cycle(4, ADD_ADL|ADL_ABL)
-            self.__first_cycle_after_addressing = 5
+            self.__add_index(X_SB)
+            self.set_cycle(5, ADD_ADL|ADL_ABL)
+            self.__first_cycle_after_addressing = 6
         elif self.__addressing_mode == AdressModesList.ZPGY:
-            self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC)
-            self.set_cycle(3, PCL_PCL|PCH_PCH|DL_DB|DB_ADD|Y_SB|SB_ADD|SUMS|O_ADH0|O_ADH17|ADH_ABH)
-            self.set_cycle(4, ADD_ADL|ADL_ABL)
-            self.__first_cycle_after_addressing = 5
+            self.__add_index(Y_SB)
+            self.set_cycle(5, ADD_ADL|ADL_ABL)
+            self.__first_cycle_after_addressing = 6
+
+    def __add_index(self, index_sb: int):
+        """
+        This function fetches a zero page address and adds the index register driving SB (index_sb) to it, ADD = zero page
+        address + index in cycle 4. The carry in of a sum is C | I_ADDC, so the sum is made with the complements:
+        ~index + ~address + 1 = ~(address + index), then inverted ($FF ^ ADD, DB is not driven). C is kept.
+        """
+        self.set_cycle(2, PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH|I_PC|index_sb|SB_DB|DBx_ADD|O_ADD|ORS)
+        self.set_cycle(3, PCL_PCL|PCH_PCH|ADD_SB06|ADD_SB7|SB_ADD|DL_DB|DBx_ADD|I_ADDC|SUMS|O_ADH0|O_ADH17|ADH_ABH)
+        self.set_cycle(4, ADD_SB06|ADD_SB7|SB_ADD|DB_ADD|EORS)
+
+    def __apply_page_cross(self, cycle: int, value: int = 0):
+        """
+        This function writes the high byte of an indexed address from DL. ACR_C samples the carry of the low byte (C is
+        clear) while BI latches the high byte (AI = 0) for the fixup, ADD = high byte + C.
+        The high byte fixup runs on the C path only, except for:
+        - the instructions writing C (CARRY_WRITERS): their C would select the path of the next rows
+        - the stores (STORES): their data would drive DB in the cycle BI latches the high byte
+        which always run it.
+        """
+        self.set_cycle(cycle, value|ADD_ADL|ADL_ABL|DL_ADH|ADH_ABH|DL_DB|DB_ADD|O_ADD|SUMS|ACR_C, Flag.ANY)
+        if self.__name in CARRY_WRITERS or self.__name in STORES:
+            self.set_cycle(cycle + 1, ADD_SB06|ADD_SB7|SB_ADH|ADH_ABH)
+            self.__first_cycle_after_addressing = cycle + 2
+            return
+        self.set_cycle(cycle + 1, ADD_SB06|ADD_SB7|SB_ADH|ADH_ABH, Flag.C)
+        self.__flag_inside_addressing = True
+        self.__first_cycle_after_addressing = cycle + 1
+
+    def __apply_relative_mode(self):
+        """
+        This function writes the cycles of a branch, the flag select PLA tests the branch condition from cycle 2.
+        Not taken, the offset is skipped and the instruction ends at cycle 3.
+        Taken, the target is the address of the offset + 1 + offset.
+        """
+        flag, taken = BRANCH_CONDITIONS[self.__name]
+        taken_flag, not_taken_flag = (flag, Flag.NULL) if taken == 1 else (Flag.NULL, flag)
+        self.set_cycle(2, PCL_PCL|PCH_PCH|I_PC, not_taken_flag)
+        self.set_cycle(2, PCL_PCL|PCH_PCH|PCL_ADL|PCH_ADH|ADL_ABL|ADH_ABH, taken_flag)
+        # The taken path goes on with both values of the flag, the reset cycle of the other path is not the last one
+        self.set_cycle(3, RST_CYCLE, not_taken_flag)
+        if flag == Flag.C:
+            # AI = $7F (ADD_SB7 alone, ADD = $00 after cycle 2), BI = offset, then C <- sign of the offset (carry of
+            # $7F + offset + 1) while AI = $FF (SB is not driven) and BI = PCL: ADD = $FF + PCL + 1 = PCL
+            self.set_cycle(3, PCL_PCL|PCH_PCH|ADD_SB7|SB_ADD|DL_DB|DB_ADD, taken_flag)
+            self.set_cycle(4, PCL_PCL|PCH_PCH|SB_ADD|PCL_DB|DB_ADD|I_ADDC|SUMS|ACR_C, taken_flag)
+            self.__set_twin(4, taken_flag, I_ADDC|SUMS)
+            # The C flag now selects the direction, then the carry of PCL + offset + 1: PCH is incremented ahead for a
+            # forward branch so that a carry (forward page cross or backward same page) ends without high byte fixup
+            # ADL is not driven (precharged to $FF): ADL_PCL|I_PC increments PCH
+            self.set_cycle(5, ADD_SB06|ADD_SB7|SB_ADD|DL_DB|DB_ADD|I_ADDC|SUMS|ADL_PCL|I_PC, Flag.NULL)
+            self.set_cycle(5, PCL_PCL|PCH_PCH|ADD_SB06|ADD_SB7|SB_ADD|DL_DB|DB_ADD|I_ADDC|SUMS, Flag.C)
+            self.set_cycle(6, PCH_PCH|ADD_ADL|ADL_PCL|I_ADDC|SUMS|ACR_C, Flag.NULL)
+            self.set_cycle(6, PCH_PCH|ADD_ADL|ADL_PCL|I_ADDC|SUMS|ACR_C, Flag.C)
+            # Carry: ADD = $FF + PCH + 1 (SB is not driven), no carry: PCH - 1
+            self.set_cycle(7, PCL_PCL|PCH_PCH|SB_ADD|PCH_DB|DB_ADD|I_ADDC|SUMS, Flag.C)
+            self.set_cycle(7, PCL_PCL|PCH_PCH|SB_ADD|PCH_DB|DB_ADD|SUMS, Flag.NULL)
+            # C is restored from the opcode by the same row on both paths (the reset cycles take no clock in the circuit)
+            for path in (Flag.NULL, Flag.C):
+                self.set_cycle(8, PCL_PCL|ADD_SB06|ADD_SB7|SB_ADH|ADH_PCH|IR5_C, path)
+                self.set_cycle(9, RST_CYCLE, path)
+        else:
+            self.__apply_flag_branch(flag, taken)
+
+    def __set_twin(self, cycle: int, path: Flag, value: int):
+        """
+        This function gives the row of the other path the end of cycle signals of a row writing the flag of the branch: the
+        flag latches with the registers and the flag select PLA switches the row before ADD, PC and the micro counter latch.
+        """
+        other = Flag.NULL if path != Flag.NULL else self.__flag
+        if value & END_OF_CYCLE_SIGNALS:
+            self.set_cycle(cycle, value & END_OF_CYCLE_SIGNALS, other)
+
+    def __copy_bit7(self, cycle: int, flag: Flag, path: Flag, value: int = 0) -> int:
+        """
+        This function copies bit 7 of ADD into the flag of a Z/N/V branch and returns the first cycle selected by the new
+        value. value is added to the last cycle (the ALU is free in it, except for V: the copy leaves the offset in ADD).
+        """
+        if flag == Flag.N:
+            self.set_cycle(cycle, value|PCL_PCL|PCH_PCH|ADD_SB06|ADD_SB7|SB_DB|DB7_N, path)
+            self.__set_twin(cycle, path, value)
+            return cycle + 1
+        # AVR of EORS is bit 7 of AI & BI: $FF (SB is not driven) & ADD, then ADD = $00 ^ offset
+        if flag == Flag.V:
+            self.set_cycle(cycle, PCL_PCL|PCH_PCH|SB_ADD|ADD_ADL|ADL_ADD, path)
+            self.set_cycle(cycle + 1, PCL_PCL|PCH_PCH|O_ADD|DL_DB|DB_ADD|EORS|AVR_V, path)
+            self.__set_twin(cycle + 1, path, EORS)
+            return cycle + 2
+        # ADD_SB7 alone reads ADD | $7F and DB is not driven (~$FF = 0): $7F + 1 is not zero, $FF + 1 is
+        self.set_cycle(cycle, PCL_PCL|PCH_PCH|ADD_SB7|SB_ADD|DBx_ADD|I_ADDC|SUMS, path)
+        self.set_cycle(cycle + 1, value|PCL_PCL|PCH_PCH|ADD_SB06|ADD_SB7|SB_DB|DBZ_Z, path)
+        self.__set_twin(cycle + 1, path, value)
+        return cycle + 2
+
+    def __apply_flag_branch(self, flag: Flag, taken: int):
+        """
+        This function writes the taken path of a Z/N/V branch. C is not written (every sum adds I_ADDC): the flag of the
+        branch, known on the taken path, selects the page cross fixup and is restored at the end.
+        With L the low byte of the address of the offset and r = L + 1 + offset:
+        - r and L in the same half page: same page, the branch ends once r is in PCL
+        - otherwise the page is crossed if r and the offset have the same bit 7, which is the direction of the branch
+        DL and PCL only reach the ALU through BI, AI gets them from ADD.
+        A row writing the flag does not come right before the reset cycle of the other path: the reset would clear the
+        micro counter in the middle of the cycle.
+        """
+        def path(value: int) -> Flag:
+            return flag if value else Flag.NULL
+
+        taken_flag, other_flag = path(taken), path(1 - taken)
+        # The EORS below invert L or r (DBx_ADD) so that the path without fixup keeps the taken value
+        invert = taken
+        # ADD = $00 | L, then ADD = L + offset + 1
+        self.set_cycle(2, O_ADD|PCL_DB|DB_ADD|ORS, taken_flag)
+        self.set_cycle(3, PCL_PCL|PCH_PCH|ADD_SB06|ADD_SB7|SB_ADD|DL_DB|DB_ADD|I_ADDC|SUMS, taken_flag)
+        # PCL <- r, bit 7 of r ^ L selects the same page path
+        self.set_cycle(4, PCH_PCH|ADD_ADL|ADL_PCL|ADD_SB06|ADD_SB7|SB_ADD|PCL_DB|(DBx_ADD if invert else DB_ADD)|EORS, taken_flag)
+        # The copies leave the offset in ADD for the next test
+        copy_offset = O_ADD|DL_ADL|ADL_ADD|ORS
+        cycle = self.__copy_bit7(5, flag, taken_flag, copy_offset)
+        self.set_cycle(cycle, RST_CYCLE, taken_flag)
+        # Bit 7 of the offset ^ r selects the page cross path
+        self.set_cycle(cycle, PCL_PCL|PCH_PCH|ADD_SB06|ADD_SB7|SB_ADD|PCL_DB|(DB_ADD if invert else DBx_ADD)|EORS, other_flag)
+        cycle = self.__copy_bit7(cycle + 1, flag, other_flag, copy_offset)
+        self.set_cycle(cycle, RST_CYCLE, taken_flag)
+        # Page cross: the sign of the offset selects PCH + 1 or PCH - 1, ADD = $00 ^ $FE (O_ADL0 on the precharged ADL)
+        minus_one = O_ADD|O_ADL0|ADL_ADD
+        if flag == Flag.N:
+            # The taken path resets in this cycle: the flag is only written in the next one
+            self.set_cycle(cycle, PCL_PCL|PCH_PCH|minus_one, other_flag)
+            self.set_cycle(cycle + 1, PCL_PCL|PCH_PCH|DL_DB|DB7_N|ORS, other_flag)
+            self.__set_twin(cycle + 1, other_flag, ORS)
+            cycle += 2
+        elif flag == Flag.V:
+            # AVR of EORS is bit 7 of AI & BI: $FF (SB is not driven) & offset
+            self.set_cycle(cycle, PCL_PCL|PCH_PCH|SB_ADD|DL_DB|DB_ADD, other_flag)
+            self.set_cycle(cycle + 1, PCL_PCL|PCH_PCH|EORS|AVR_V|minus_one, other_flag)
+            self.__set_twin(cycle + 1, other_flag, EORS)
+            cycle += 2
+        else:
+            cycle = self.__copy_bit7(cycle, flag, other_flag, minus_one|ORS)
+        self.set_cycle(cycle, PCL_PCL|PCH_PCH|O_ADD|PCH_DB|DB_ADD|I_ADDC|SUMS, Flag.NULL)
+        # PCH + $FE + 1
+        self.set_cycle(cycle, PCL_PCL|PCH_PCH|ADD_SB06|ADD_SB7|SB_ADD|PCH_DB|DB_ADD|I_ADDC|SUMS, flag)
+        # Both paths write PCH and restore the flag with the same rows, so that the restored value may select either path:
+        # with I_V or from DB = $FF (not driven) along with the PCH write, else from ADD = $00 in one more cycle.
+        # The reset cycle is not merged with the PCH write (the overlapped fetch reads the new PC)
+        writer = {Flag.N: DB7_N, Flag.Z: DBZ_Z, Flag.V: DB6_V}[flag]
+        if flag == Flag.V and taken == 1:
+            rows = [PCL_PCL|ADD_SB06|ADD_SB7|SB_ADH|ADH_PCH|I_V]
+        elif (flag == Flag.N and taken == 1) or (flag == Flag.Z and taken == 0):
+            rows = [PCL_PCL|ADD_SB06|ADD_SB7|SB_ADH|ADH_PCH|writer]
+        else:
+            rows = [PCL_PCL|ADD_SB06|ADD_SB7|SB_ADH|ADH_PCH|O_ADD|DB_ADD|ANDS, ADD_SB06|ADD_SB7|SB_DB|writer]
+        for end in (Flag.NULL, flag):
+            for offset, value in enumerate(rows + [RST_CYCLE], start=1):
+                self.set_cycle(cycle + offset, value, end)
+
+    def __store(self, cycle: int, flag: int, value: int):
+        if not 0 <= cycle < MICRO_CYCLES:
+            raise ValueError(f"Instruction {self.__name.value}({self.__opcode:02x}): cycle {cycle} does not fit in the micro counter!")
+        slots = self.__words.get(flag)
+        if slots is None:
+            slots = self.__words[flag] = [None] * MICRO_CYCLES
+        if slots[cycle] is not None:
+            slots[cycle] |= value
+            return
+        slots[cycle] = value
+        self.__rows.append((cycle, flag))
+        self.__last_cycles[flag] = max(self.__last_cycles.get(flag, cycle), cycle)
+
+    def __sorted_cycles(self, rows: list[tuple[int, int]]) -> list[tuple[int, int, int]]:
+        # Stable bucket sort by micro cycle (rows of the same cycle keep their insertion order)
+        buckets: list[list[int]] = [[] for _ in range(MICRO_CYCLES)]
+        for cycle, flag in rows:
+            buckets[cycle].append(flag)
+        return [(cycle, flag, self.__words[flag][cycle]) for cycle, flags in enumerate(buckets) for flag in flags]
+
+    def get_cycle(self, cycle: int, flag: Flag = Flag.NULL) -> int | None:
+        slots = self.__words.get(flag.value)
+        return None if slots is None or not 0 <= cycle < MICRO_CYCLES else slots[cycle]
 
     def set_cycle(self, cycle: int, value: int, flag: Flag = Flag.NULL, overwrite: bool = False):
         if self.__flag.value > 0 and flag.value > 0 and flag != self.__flag:
             raise ValueError(f"Instruction {self.__name.value}({self.__opcode:02x}): flag {flag} is not the same as previous flag {self.__flag}!")
-        
-        for i, (cycle_f, flag_f, _) in enumerate(self.__cycles):
-            if cycle_f == cycle and flag_f == flag.value:
-                if overwrite is True:
-                    self.__cycles[i] = (cycle, flag.value, value)
-                else:
-                    self.__cycles[i] = (cycle, flag.value, value | self.__cycles[i][2])
-                return
-        
+
+        previous = self.get_cycle(cycle, flag)
+        if previous is not None:
+            self.__words[flag.value][cycle] = value if overwrite is True else value | previous
+            return
+
         # If cycle is not found, add it
         if flag.value > 0 and self.__flag == Flag.NULL:
             self.__flag = flag
-            
-        max_cycle = max([ cycle for cycle, _, _ in self.__cycles ] if len(self.__cycles) > 0 else [0])
+
+        max_cycle = max(self.__last_cycles.values(), default=0)
         if cycle > max_cycle+1 and cycle > 2:
             warnings.warn(f"Instruction {self.__name.value}({self.__opcode:02x}): cycle {cycle} create a gap between micro cycle (last cycle: {max_cycle})!", RuntimeWarning)
-        self.__cycles.append((cycle, flag.value, value))
+        self.__store(cycle, flag.value, value)
 
     def new_cycle(self, cycle: int, value: int, flag: Flag = Flag.NULL):
-        self.__cycles.append((cycle, flag.value, value))
+        self.__store(cycle, flag.value, value)
 
     def set_cycle_after_adressing(self, relative_cycle: int, value: int, flag: Flag = Flag.NULL):
         self.__save_raw_cycles_after_adressing.append((relative_cycle, value, flag))
         self.set_cycle(self.__first_cycle_after_addressing + relative_cycle, value, flag)
 
     def validate_instruction(self):
-        if len(self.__cycles) == 0:
+        if len(self.__rows) == 0:
             raise ValueError(f"Instruction has no cycles: {self.__name.value}({self.__opcode:02x})!")
+        if self.__has_been_validated is True:
+            return
 
         # add reset cycle if instruction has less than 16 cycles
-        cycle_with_reset = self.__cycles.copy()
-        flag_list = list(set([ flag for _, flag, _ in self.__cycles ]))
-        
+        flag_list = sorted(flag for flag in self.__words if flag != Flag.ANY.value)
         if len([ f for f in flag_list if f > 0 ]) > 2:
             print(f"WARNING: Instruction has more than 2 flags! {self}")
-            
+
+        raw_rows = list(self.__rows)
+        sorted_rows = list(raw_rows)
+        last_rows: list[tuple[int, int]] = []
         for flag in flag_list:
-            if flag == Flag.ANY.value:
-                continue
-            
-            cycles_list =pd.Series([ cycle for cycle, flag_f, _ in cycle_with_reset if flag == flag_f ])
-            duplicated_cycles = cycles_list.duplicated()
-            # Check for duplicated cycles and merge them
-            if duplicated_cycles.any() == True:
-                print(f"WARNING: Instruction {self.__name.value}({self.__opcode:02x}) has duplicated cycles for flag {flag}!")
-                for dup_cycle in cycles_list[duplicated_cycles]:
-                    values_to_merge = [ value for cycle, flag_f, value in cycle_with_reset if cycle == dup_cycle and flag_f == flag ]
-                    new_value = reduce(lambda x, y: x | y, values_to_merge)
-                    new_cycle = (dup_cycle, flag, new_value)
-                    # Remove old cycles and insert new one
-                    cycle_with_reset = [ cycle for cycle in cycle_with_reset if cycle[0] != dup_cycle or cycle[1] != flag ]
-                    cycle_with_reset.append(new_cycle)
-                    # Sort cycles tuple by cycle number
-            
-            # Sort cycles tuple by cycle number
-            cycle_with_reset = sorted(cycle_with_reset, key=lambda x: x[0])
-            
-            max_cycle = max([ cycle for cycle,flag_f,_ in cycle_with_reset if flag == flag_f ])
+            added_rows = []
             if self.__flag_inside_addressing is True and flag != Flag.NULL.value:
                 # If flag is inside addressing mode we need to copy all instruction cycles after addressing mode
-                custom_cycles = [ (max_cycle + cycle - self.__first_cycle_after_addressing + 1, flag, value) for cycle, flag_f, value in self.__cycles if cycle >= self.__first_cycle_after_addressing and flag_f == Flag.NULL.value ]
-                cycle_with_reset += custom_cycles
-                max_cycle = max([ cycle for cycle,flag_f,_ in cycle_with_reset if flag == flag_f ])
-            if max_cycle < 16:
-                cycle_with_reset.append((max_cycle+1, flag, RST_CYCLE))
-        self.__cycles = cycle_with_reset
+                max_cycle = self.__last_cycles[flag]
+                for cycle, flag_f in raw_rows:
+                    if cycle >= self.__first_cycle_after_addressing and flag_f == Flag.NULL.value:
+                        added_rows.append((max_cycle + cycle - self.__first_cycle_after_addressing + 1, flag, self.__words[flag_f][cycle]))
+            for cycle, flag_f, value in added_rows:
+                self.__store(cycle, flag_f, value)
+            if self.__flag_inside_addressing is True and flag != Flag.NULL.value:
+                # Cycles set before the end of the addressing mode (e.g. the data of a store) are merged into the last addressing cycle of the flag path
+                for relative_cycle, value, flag_f in self.__save_raw_cycles_after_adressing:
+                    if relative_cycle < 0 and flag_f == Flag.NULL:
+                        self.__store(max_cycle + relative_cycle + 1, flag, value)
+            if self.__words[flag][self.__last_cycles[flag]] & RST_CYCLE:
+                # The flag path already ends with its reset cycle
+                sorted_rows += last_rows
+                last_rows = [(cycle, flag_f) for cycle, flag_f, _ in added_rows]
+                continue
+            if self.__last_cycles[flag] + 1 >= MICRO_CYCLES:
+                raise ValueError(f"Instruction {self.__name.value}({self.__opcode:02x}): too many cycles for flag {flag}!")
+            added_rows.append((self.__last_cycles[flag] + 1, flag, RST_CYCLE))
+            self.__store(*added_rows[-1])
+            # Rows added for the last flag stay at the end of the table, the others are sorted with the instruction rows
+            sorted_rows += last_rows
+            last_rows = [(cycle, flag_f) for cycle, flag_f, _ in added_rows]
+        self.__cycles = self.__sorted_cycles(sorted_rows) + [(cycle, flag, self.__words[flag][cycle]) for cycle, flag in last_rows]
         self.__has_been_validated = True
 
     def get_decode_PLA(self) -> str:
         if self.__has_been_validated is False:
             self.validate_instruction()
         instr_str = ""
-        for cycle, flag, value in self.__cycles:
+        for cycle, flag, value in self.cycles:
             flag_is_not_null = flag != Flag.NULL.value
             instr_str += f"{Instruction.create_adress_str(self.opcode, cycle, int(flag_is_not_null) if flag >= 0 else -1)} {value:063b}\n"
 
         return instr_str
 
     def get_last_cycle_of_instruction(self, flag: Flag = Flag.NULL) -> int:
-        cycles_with_flags = [ cycle for cycle, flag_f, _ in self.__cycles if flag.value == flag_f ]
-        if len(cycles_with_flags) == 0:
-            return 0
-        else:
-            return max(cycles_with_flags)
+        return self.__last_cycles.get(flag.value, 0)
 
     def copyInstruction(self, new_opcode: int, new_adress_mode: AdressModesList):
         new_instruction = Instruction(self.__name, new_opcode, new_adress_mode)
@@ -339,66 +561,156 @@ def generate_instruction_docs(instructions: list[Instruction]) -> str:
     """
     return_string = "OpCode | Instruction | Cycles\n-- | -- | --\n"
     for instruction in instructions:
-        last_cycle = instruction.get_last_cycle_of_instruction()
-        last_cycle_with_flag = instruction.get_last_cycle_of_instruction(instruction.flag)
-        return_string += f"${instruction.opcode:02x} | {instruction.name.value} {instruction.addressing_mode.value.short_name} | {last_cycle}{'' if last_cycle_with_flag - last_cycle <= 0 else ' +('+str(last_cycle_with_flag - last_cycle)+')' }\n"
+        return_string += f"${instruction.opcode:02x} | {instruction.name.value} {instruction.addressing_mode.value.short_name} | {format_cycles(path_lengths(instruction))}\n"
     return return_string
 
 
-def write_irq_pla() -> None:
-    file = open("./PLAs/IRQPLA.txt", "w", encoding="utf-8")
-    file.write("# Logisim PLA program table\n")
-    file.write(f"{0x00:08b} {0b1:02b}\n")
-    file.close()
+def get_irq_pla(instructions: list[Instruction]) -> str:
+    """
+    This function returns the interrupt decode PLA, indexed by the instruction register: bit 0 for the opcodes running the
+    interrupt sequence (BRK, also run by the IRQ/NMI entry with the instruction register forced to $00), which selects the
+    B flag and the vector PLA, and bit 1 for the opcodes returning from an interrupt (RTI).
+    """
+    pla_str = "# Logisim PLA program table\n"
+    for instruction in instructions:
+        outputs = (IRQ_PLA_BRK if instruction.name == InstructionName.BRK else 0) | (IRQ_PLA_RTI if instruction.name == InstructionName.RTI else 0)
+        if outputs != 0:
+            pla_str += f"{instruction.opcode:08b} {outputs:02b}\n"
+    return pla_str
+
+
+def get_decode_pla(instructions: list[Instruction], fetch_overlap: bool = False) -> str:
+    pla_str = "# Logisim PLA program table\n"
+    if fetch_overlap is True:
+        # Opcode has already been fetched by the last cycle of the previous instruction
+        pla_str += f"xxxxxxxxx0000 {OPCODE_CYCLE:063b}\n"
+    else:
+        pla_str += f"xxxxxxxxx0000 {FETCH_CYCLE:063b}\n"
+        pla_str += f"xxxxxxxxx0001 {OPCODE_CYCLE:063b}\n"
+    for instruction in instructions:
+        pla_str += instruction.get_decode_PLA()
+    return pla_str
 
 
-def write_decode_pla(instructions: list[Instruction]) -> None:
-    file = open("./PLAs/DecodePLA.txt", "w", encoding="utf-8")
-    file_flag = open("./PLAs/DecodePLA_flagSelect.txt", "w", encoding="utf-8")
-    # write first line of file
-    file.write("# Logisim PLA program table\n")
-    file_flag.write("# Logisim PLA program table\n")
-    file.write(f"xxxxxxxxx0000 {(ADH_ABH|ADL_ABL|I_PC|PCL_ADL|PCH_ADH):063b}\n")
-    file.write(f"xxxxxxxxx0001 {(PCL_PCL|PCH_PCH):063b}\n")
+def get_flag_select_pla(instructions: list[Instruction]) -> str:
+    pla_str = "# Logisim PLA program table\n"
     for instruction in instructions:
-        file.write(instruction.get_decode_PLA())
-        file_flag.write(f"{instruction.opcode:08b} {instruction.flag.value:03b}\n")
-    file.close()
+        pla_str += f"{instruction.opcode:08b} {instruction.flag.value:03b}\n"
+    return pla_str
 
 
-def write_reset_pla() -> None:
-    file = open("./PLAs/ResetPLA.txt", "w", encoding="utf-8")
-    file.write("# Logisim PLA program table\n")
-    file.write(f"0000 {0:063b}\n")
-    file.write(f"0001 {(DL_ADL|ADL_PCL|DB_ADD|O_ADD|SUMS):063b}\n")
-    file.write(f"0010 {(DL_ADH|ADH_PCH|ADD_SB06|ADD_SB7|SB_S):063b}\n")
-    file.write(f"0100 {RST_CYCLE:063b}\n")
-
-    # Close the file
-    file.close()
+def get_reset_pla(fetch_overlap: bool = False) -> str:
+    pla_str = "# Logisim PLA program table\n"
+    pla_str += f"0000 {0:063b}\n"
+    # S <- $FF (0 | DB, whatever C is) and I is set (DB is not driven: $FF)
+    pla_str += f"0001 {(DL_ADL|ADL_PCL|DB_ADD|O_ADD|ORS|DB2_I):063b}\n"
+    pla_str += f"0010 {(DL_ADH|ADH_PCH|ADD_SB06|ADD_SB7|SB_S):063b}\n"
+    pla_str += f"0011 {(RST_CYCLE|FETCH_CYCLE if fetch_overlap else RST_CYCLE):063b}\n"
+    return pla_str
 
 
-def write_vectors_pla() -> None:
-    file = open("./PLAs/Vectors.txt", "w", encoding="utf-8")
-    file.write("# Logisim PLA program table\n")
+def get_vectors_pla() -> str:
+    pla_str = "# Logisim PLA program table\n"
     # Reset vector
-    file.write(f"010 {0xfffc:016b}\n")
-    file.write(f"011 {0xfffd:016b}\n")
+    pla_str += f"010 {0xfffc:016b}\n"
+    pla_str += f"011 {0xfffd:016b}\n"
     # IRQ/BRK vector
-    file.write(f"100 {0xfffe:016b}\n")
-    file.write(f"101 {0xffff:016b}\n")
-    # Close the file
+    pla_str += f"100 {0xfffe:016b}\n"
+    pla_str += f"101 {0xffff:016b}\n"
+    # NMI vector (only selected by the IRQ/NMI entry of the emulators, the circuit has no interrupt input)
+    pla_str += f"110 {0xfffa:016b}\n"
+    pla_str += f"111 {0xfffb:016b}\n"
+    return pla_str
+
+
+def write_table(path: str, text: str, build: IncrementalBuild | None = None) -> None:
+    """
+    This function writes a generated table, or lets the incremental build write it only if its content changed.
+    """
+    if build is not None:
+        build.write(path, text)
+        return
+    file = open(path, "w", encoding="utf-8")
+    file.write(text)
     file.close()
 
 
-def main():
+def write_irq_pla(instructions: list[Instruction], build: IncrementalBuild | None = None) -> None:
+    write_table("./PLAs/IRQPLA.txt", get_irq_pla(instructions), build)
+
+
+def write_decode_pla(instructions: list[Instruction], minimize: bool = False, fetch_overlap: bool = False, build: IncrementalBuild | None = None) -> None:
+    decode_pla = get_decode_pla(instructions, fetch_overlap)
+    if minimize is True:
+        minimized_pla = minimize_pla(decode_pla)
+        print(f"Minimized decode PLA: {count_rows(decode_pla)} rows -> {count_rows(minimized_pla)} rows (equivalent)")
+        decode_pla = minimized_pla
+    write_table("./PLAs/DecodePLA.txt", decode_pla, build)
+    write_table("./PLAs/DecodePLA_flagSelect.txt", get_flag_select_pla(instructions), build)
+
+
+def write_reset_pla(fetch_overlap: bool = False, build: IncrementalBuild | None = None) -> None:
+    write_table("./PLAs/ResetPLA.txt", get_reset_pla(fetch_overlap), build)
+
+
+def write_vectors_pla(build: IncrementalBuild | None = None) -> None:
+    write_table("./PLAs/Vectors.txt", get_vectors_pla(), build)
+
+
+def write_rom(name: str, pla_text: str, build: IncrementalBuild | None = None) -> None:
+    """
+    This function writes a PLA table as Logisim "v2.0 raw" ROM images addressed like the PLA.
+    Outputs wider than 32 bits are split into several ROMs (name_0 holds the lowest bits).
+    """
+    os.makedirs("./ROMs", exist_ok=True)
+    images = pla_to_rom_images(pla_text)
+    for index, image in enumerate(images):
+        suffix = "" if len(images) == 1 else f"_{index}"
+        write_table(f"./ROMs/{name}{suffix}.txt", image, build)
+
+
+def write_roms(instructions: list[Instruction], fetch_overlap: bool = False, build: IncrementalBuild | None = None) -> None:
+    write_rom("IRQROM", get_irq_pla(instructions), build)
+    write_rom("DecodeROM", get_decode_pla(instructions, fetch_overlap), build)
+    write_rom("DecodeROM_flagSelect", get_flag_select_pla(instructions), build)
+    write_rom("ResetROM", get_reset_pla(fetch_overlap), build)
+    write_rom("VectorsROM", get_vectors_pla(), build)
+
+
+def set_interrupt_sequence(instruction: Instruction) -> None:
+    """
+    This function writes the interrupt sequence of BRK: PCH, PCL and P are pushed, I is set and PC is loaded from the vector
+    that the vector PLA drives on the address bus at micro cycles 9 and 10 (control_model.BRK_VECTOR_STEPS). The IRQ/NMI
+    entry is not generated (the decode PLA has no interrupt select input): the emulators run these cycles with the
+    instruction register forced to $00 and without the program counter increments. I is set by DB2_I from the undriven DB,
+    as IR5_I would copy bit 5 of the opcode, which is clear for $00.
+    S - 1 is computed as S + $FE (ADL forced by O_ADL0) + 1 (I_ADDC) so the pushes do not depend on C.
+    """
+    push = RW | S_SB | SB_ADD | O_ADL0 | ADL_ADD | I_ADDC | SUMS
+    instruction.set_cycle(3, S_ADL | ADL_ABL | O_ADH17 | ADH_ABH | PCH_DB)
+    instruction.set_cycle(4, push)
+    instruction.set_cycle(5, ADD_SB06 | ADD_SB7 | SB_S | ADD_ADL | ADL_ABL | PCL_DB)
+    instruction.set_cycle(6, push)
+    instruction.set_cycle(7, ADD_SB06 | ADD_SB7 | SB_S | ADD_ADL | ADL_ABL | P_DB)
+    instruction.set_cycle(8, push)
+    # DB is not driven: I <- 1 (P has been pushed)
+    instruction.set_cycle(9, ADD_SB06 | ADD_SB7 | SB_S | DB2_I)
+    instruction.set_cycle(10, DL_ADL | ADL_PCL)
+    instruction.set_cycle(11, DL_ADH | ADH_PCH)
+
+
+def build_instructions(validate: bool = True) -> list[Instruction]:
+    """
+    This function builds and validates (unless validate is False) the list of all implemented instructions.
+    """
     instructions: list[Instruction] = []
 
     ######################################### ADC #########################################
     # ADC immediate
     adc_imm = Instruction(InstructionName.ADC, 0x69, AdressModesList.IMM)
-    adc_imm.set_cycle_after_adressing(0, DL_DB | DB_ADD | AC_SB | SB_ADD | SUMS | ACR_C | AVR_V) # | DBZ_Z | DB7_N)
-    adc_imm.set_cycle_after_adressing(1, ADD_SB06 | ADD_SB7 | SB_AC | SB_DB | DBZ_Z | DB7_N)
+    adc_imm.set_cycle_after_adressing(0, DL_DB | DB_ADD | AC_SB | SB_ADD | SUMS)
+    # ACR and AVR come from the inputs latched by the previous cycle, SUMS stays selected
+    adc_imm.set_cycle_after_adressing(1, ADD_SB06 | ADD_SB7 | SB_AC | SB_DB | DBZ_Z | DB7_N | SUMS | ACR_C | AVR_V)
     instructions.append(adc_imm)
     # ADC zeropage
     adc_zpg = adc_imm.copyInstruction(0x65, AdressModesList.ZPG)
@@ -415,22 +727,81 @@ def main():
     # ADC absolute,Y
     adc_absy = adc_imm.copyInstruction(0x79, AdressModesList.ABSY)
     instructions.append(adc_absy)
+    # ADC (indirect,X)
+    adc_xind = adc_imm.copyInstruction(0x61, AdressModesList.XIND)
+    instructions.append(adc_xind)
+    # ADC (indirect),Y
+    adc_indy = adc_imm.copyInstruction(0x71, AdressModesList.INDY)
+    instructions.append(adc_indy)
+
+    ######################################### BCC #########################################
+    # BCC relative
+    bcc_rel = Instruction(InstructionName.BCC, 0x90, AdressModesList.REL)
+    instructions.append(bcc_rel)
+
+    ######################################### BCS #########################################
+    # BCS relative
+    bcs_rel = Instruction(InstructionName.BCS, 0xB0, AdressModesList.REL)
+    instructions.append(bcs_rel)
+
+    ######################################### BEQ #########################################
+    # BEQ relative
+    beq_rel = Instruction(InstructionName.BEQ, 0xF0, AdressModesList.REL)
+    instructions.append(beq_rel)
+
+    ######################################### BMI #########################################
+    # BMI relative
+    bmi_rel = Instruction(InstructionName.BMI, 0x30, AdressModesList.REL)
+    instructions.append(bmi_rel)
+
+    ######################################### BNE #########################################
+    # BNE relative
+    bne_rel = Instruction(InstructionName.BNE, 0xD0, AdressModesList.REL)
+    instructions.append(bne_rel)
+
+    ######################################### BPL #########################################
+    # BPL relative
+    bpl_rel = Instruction(InstructionName.BPL, 0x10, AdressModesList.REL)
+    instructions.append(bpl_rel)
+
+    ######################################### BVC #########################################
+    # BVC relative
+    bvc_rel = Instruction(InstructionName.BVC, 0x50, AdressModesList.REL)
+    instructions.append(bvc_rel)
+
+    ######################################### BVS #########################################
+    # BVS relative
+    bvs_rel = Instruction(InstructionName.BVS, 0x70, AdressModesList.REL)
+    instructions.append(bvs_rel)
 
     ######################################### BRK #########################################
     # BRK impl
+    # As the 6502, the byte following BRK is skipped (PC + 2 is pushed)
     brk = Instruction(InstructionName.BRK, 0x00, AdressModesList.IMP)
-    brk.set_cycle(2, DBx_ADD | O_ADD | I_ADDC | SUMS | S_ADL | ADL_ABL, overwrite=True)
-    brk.set_cycle(3, ADD_SB06 | ADD_SB7 | SB_ADH | ADH_ABH | PCH_DB, overwrite=True)
-    brk.set_cycle(4, RW | DB_ADD | S_SB | SB_ADD | SUMS)
-    brk.set_cycle(5, ADD_SB06 | ADD_SB7 | SB_S | ADD_ADL | ADL_ABL | PCL_DB)
-    brk.set_cycle(6, RW | DB_ADD | S_SB | SB_ADD | SUMS)
-    brk.set_cycle(7, ADD_SB06 | ADD_SB7 | SB_S | ADD_ADL | ADL_ABL | P_DB)
-    brk.set_cycle(8, RW | DB_ADD | S_SB | SB_ADD | SUMS)
-    brk.set_cycle(9, ADD_SB06 | ADD_SB7 | SB_S)
-    brk.set_cycle(10, DL_ADL | ADL_PCL)
-    brk.set_cycle(11, DL_ADH | ADH_PCH)
+    set_interrupt_sequence(brk)
     instructions.append(brk)
 
+    ######################################### CLC #########################################
+    # CLC impl
+    clc_impl = Instruction(InstructionName.CLC, 0x18, AdressModesList.IMP)
+    clc_impl.set_cycle_after_adressing(-1, IR5_C)
+    instructions.append(clc_impl)
+
+    ######################################### CLI #########################################
+    # CLI impl
+    cli_impl = Instruction(InstructionName.CLI, 0x58, AdressModesList.IMP)
+    cli_impl.set_cycle_after_adressing(-1, IR5_I)
+    instructions.append(cli_impl)
+
+    ######################################### JMP #########################################
+    # JMP indirect
+    jmp_ind = Instruction(InstructionName.JMP, 0x6C, AdressModesList.IND)
+    # Pointer + 1 does not cross the page (as the 6502: JMP ($xxFF) reads its high byte at $xx00)
+    jmp_ind.set_cycle_after_adressing(-1, ADL_ADD | O_ADD | I_ADDC | SUMS)
+    jmp_ind.set_cycle_after_adressing(0, ADD_ADL | ADL_ABL | DL_DB | DB_ADD | SB_ADD | ANDS)
+    jmp_ind.set_cycle_after_adressing(1, ADD_ADL | ADL_PCL | DL_ADH | ADH_PCH)
+    instructions.append(jmp_ind)
+
     ######################################### LDY #########################################
     # LDY immediate
     ldy_imm = Instruction(InstructionName.LDY, 0xA0, AdressModesList.IMM)
@@ -490,6 +861,25 @@ def main():
     # LDA absolute,Y
     lda_absy = lda_imm.copyInstruction(0xB9, AdressModesList.ABSY)
     instructions.append(lda_absy)
+    # LDA (indirect,X)
+    lda_xind = lda_imm.copyInstruction(0xA1, AdressModesList.XIND)
+    instructions.append(lda_xind)
+    # LDA (indirect),Y
+    lda_indy = lda_imm.copyInstruction(0xB1, AdressModesList.INDY)
+    instructions.append(lda_indy)
+
+    ######################################### RTI #########################################
+    # RTI impl
+    # Pulls P, PCL and PCH: S + 1 is computed as S + ~DB + 1 (DB is not driven) or 0 + S + 1, C is not used
+    rti_impl = Instruction(InstructionName.RTI, 0x40, AdressModesList.IMP)
+    rti_impl.set_cycle(2, S_SB | SB_ADD | DBx_ADD | I_ADDC | SUMS | O_ADH17 | ADH_ABH, overwrite=True)
+    rti_impl.set_cycle(3, ADD_SB06 | ADD_SB7 | SB_S | ADD_ADL | ADL_ABL, overwrite=True)
+    rti_impl.set_cycle(4, DL_DB | DB0_C | DB1_Z | DB2_I | DB3_D | DB6_V | DB7_N | S_ADL | ADL_ADD | O_ADD | I_ADDC | SUMS)
+    rti_impl.set_cycle(5, ADD_SB06 | ADD_SB7 | SB_S | ADD_ADL | ADL_ABL)
+    rti_impl.set_cycle(6, DL_ADL | ADL_PCL | S_SB | SB_ADD | DBx_ADD | I_ADDC | SUMS)
+    rti_impl.set_cycle(7, ADD_SB06 | ADD_SB7 | SB_S | ADD_ADL | ADL_ABL)
+    rti_impl.set_cycle(8, DL_ADH | ADH_PCH)
+    instructions.append(rti_impl)
 
     ######################################### SEC #########################################
     # SEC impl
@@ -528,6 +918,12 @@ def main():
     # STA absolute,Y
     sta_absy = sta_zpg.copyInstruction(0x99, AdressModesList.ABSY)
     instructions.append(sta_absy)
+    # STA (indirect,X)
+    sta_xind = sta_zpg.copyInstruction(0x81, AdressModesList.XIND)
+    instructions.append(sta_xind)
+    # STA (indirect),Y
+    sta_indy = sta_zpg.copyInstruction(0x91, AdressModesList.INDY)
+    instructions.append(sta_indy)
     
     ######################################### STX #########################################
     # STX zeropage
@@ -591,19 +987,67 @@ def main():
     tya_impl.set_cycle_after_adressing(0, Y_SB | SB_AC | SB_DB | DBZ_Z | DB7_N)
     instructions.append(tya_impl)
 
-    for instruction in instructions:
-        instruction.validate_instruction()
-
-    print("------ DOC INSTRCUTION TABLE -------")
-    print(generate_instruction_docs(instructions))
-    print("------ GENERATE IRQ -------")
-    write_irq_pla()
-    print("------ GENERATE PLA -------")
-    write_decode_pla(instructions)
-    print("------ GENERATE RESET -------")
-    write_reset_pla()
-    print("------ GENERATE VECTORS -------")
-    write_vectors_pla()
+    if validate is True:
+        for instruction in instructions:
+            instruction.validate_instruction()
+    return instructions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the PLA tables of the Turtle Core.")
+    parser.add_argument("--minimize", action="store_true", help="merge the decode PLA rows into don't care cubes")
+    parser.add_argument("--fuse", action="store_true", help="pull micro-operations into earlier cycles when no bus or register conflicts")
+    parser.add_argument("--fetch-overlap", action="store_true", help="fetch the next opcode during the last cycle of every instruction (IR latches at micro cycle 0)")
+    parser.add_argument("--backend", choices=["pla", "rom", "both"], default="pla", help="write PLA program tables (./PLAs), ROM images (./ROMs) or both")
+    parser.add_argument("--incremental", action="store_true", help="only rewrite the tables whose content changed and report the opcode rows which differ")
+    parser.add_argument("--watch", action="store_true", help="regenerate (incrementally) every time a generator source changes")
+    parser.add_argument("--check-hazards", action="store_true", help="check every generated control word for bus conflicts and hazards (needs NumPy)")
+    args = parser.parse_args()
+
+    if args.watch is True:
+        arguments = [argument for argument in sys.argv[1:] if argument != "--watch"]
+        watch(arguments + ([] if args.incremental else ["--incremental"]), os.path.dirname(os.path.abspath(__file__)))
+        return
+
+    instructions = build_instructions()
+    if args.fuse is True:
+        print("------ MICROCYCLE FUSION -------")
+        print(fuse_instructions(instructions))
+    if args.fetch_overlap is True:
+        print("------ FETCH/EXECUTE OVERLAP -------")
+        print(overlap_fetch_instructions(instructions))
+
+    build = IncrementalBuild() if args.incremental is True else None
+    if build is not None:
+        print("------ CHANGED OPCODES -------")
+        print(build.diff_instructions(instructions))
+    else:
+        print("------ DOC INSTRCUTION TABLE -------")
+        print(generate_instruction_docs(instructions))
+    if args.backend in ("pla", "both"):
+        print("------ GENERATE IRQ -------")
+        write_irq_pla(instructions, build)
+        print("------ GENERATE PLA -------")
+        write_decode_pla(instructions, args.minimize, args.fetch_overlap, build)
+        print("------ GENERATE RESET -------")
+        write_reset_pla(args.fetch_overlap, build)
+        print("------ GENERATE VECTORS -------")
+        write_vectors_pla(build)
+    if args.backend in ("rom", "both"):
+        print("------ GENERATE ROMS -------")
+        write_roms(instructions, args.fetch_overlap, build)
+    if build is not None:
+        build.save()
+        print(build.summary())
+    if args.check_hazards is True:
+        # Only the checker needs NumPy, the generator itself stays standard library only
+        from emulator import Microcode
+        from hazard_checker import check_microcode, to_markdown
+        print("------ HAZARDS -------")
+        hazards = check_microcode(Microcode.from_instructions(instructions, args.fetch_overlap), instructions)
+        print(to_markdown(hazards, instructions) if hazards else "None\n")
+        if hazards:
+            sys.exit(1)
     return
 
 
@@ -0,0 +1,137 @@
+# pylint: disable=line-too-long
+"""
+This module contains a two-level logic minimizer for the PLA program tables.
+
+Rows are merged into cubes with don't care ('x') bits in the spirit of Espresso:
+for every distinct output word the ON-set is covered by greedily expanded cubes
+(EXPAND) and redundant cubes are removed afterwards (IRREDUNDANT). As Logisim
+OR-s the outputs of every matching row, a cube of a word may also cover the
+addresses whose output is a superset of this word, which is used as don't care.
+The minimized table is then checked exhaustively against the original one.
+"""
+import argparse
+from pla_tables import parse_pla, compile_pla, get_pla_widths
+
+PLA_HEADER = "# Logisim PLA program table\n"
+
+
+class Cube:
+    """
+    This class represents a cube over the PLA inputs (every address with address & mask == value).
+    """
+
+    def __init__(self, mask: int, value: int):
+        self.mask = mask
+        self.value = value
+
+    def addresses(self, width: int) -> list[int]:
+        addresses = [self.value]
+        for bit in range(width):
+            if not self.mask >> bit & 1:
+                addresses += [address | 1 << bit for address in addresses]
+        return addresses
+
+    def pattern(self, width: int) -> str:
+        return "".join("x" if not self.mask >> bit & 1 else str(self.value >> bit & 1) for bit in reversed(range(width)))
+
+
+def _expand(minterm: int, width: int, allowed: set[int], uncovered: set[int]) -> Cube:
+    cube = Cube((1 << width) - 1, minterm)
+    cube_addresses = [minterm]
+    while True:
+        best_bit, best_gain, best_half = -1, -1, []
+        for bit in range(width):
+            if not cube.mask >> bit & 1:
+                continue
+            half = [address ^ 1 << bit for address in cube_addresses]
+            if any(address not in allowed for address in half):
+                continue
+            gain = sum(1 for address in half if address in uncovered)
+            if gain > best_gain:
+                best_bit, best_gain, best_half = bit, gain, half
+        if best_bit < 0:
+            return cube
+        cube.mask &= ~(1 << best_bit)
+        cube.value &= cube.mask
+        cube_addresses += best_half
+
+
+def minimize_table(table: list[int], width: int) -> list[tuple[Cube, int]]:
+    """
+    This function returns a cover of a dense PLA table as a list of (cube, output) rows.
+    """
+    on_sets: dict[int, set[int]] = {}
+    for address, word in enumerate(table):
+        if word != 0:
+            on_sets.setdefault(word, set()).add(address)
+
+    cover: list[tuple[Cube, int]] = []
+    for word, on_set in on_sets.items():
+        allowed = {address for address, other in enumerate(table) if other & word == word}
+        uncovered = set(on_set)
+        cubes: list[tuple[Cube, set[int]]] = []
+        while uncovered:
+            cube = _expand(min(uncovered), width, allowed, uncovered)
+            covered_on = {address for address in cube.addresses(width) if address in on_set}
+            uncovered -= covered_on
+            cubes.append((cube, covered_on))
+
+        # Irredundant: drop cubes whose ON minterms are covered by the other cubes
+        for cube, covered_on in sorted(cubes, key=lambda item: len(item[1])):
+            others = set()
+            for other, other_on in cubes:
+                if other is not cube:
+                    others |= other_on
+            if covered_on <= others:
+                cubes = [item for item in cubes if item[0] is not cube]
+        cover += [(cube, word) for cube, _ in cubes]
+    return cover
+
+
+def minimize_pla(text: str) -> str:
+    """
+    This function minimizes a Logisim PLA program table and proves the result equivalent to the input.
+    """
+    rows = parse_pla(text)
+    if len(rows) == 0:
+        return text
+    width, output_width = get_pla_widths(text)
+    table = compile_pla(rows, 1 << width)
+    cover = minimize_table(table, width)
+    minimized = PLA_HEADER + "".join(f"{cube.pattern(width)} {word:0{output_width}b}\n" for cube, word in cover)
+    if not check_equivalence(text, minimized):
+        raise ValueError("Minimized PLA is not equivalent to the original one!")
+    return minimized
+
+
+def check_equivalence(original: str, minimized: str) -> bool:
+    """
+    This function checks that two PLA tables give the same output on every input.
+    """
+    original_rows, minimized_rows = parse_pla(original), parse_pla(minimized)
+    width = len(original_rows[0][0])
+    if any(len(pattern) != width for pattern, _ in minimized_rows):
+        return False
+    return compile_pla(original_rows, 1 << width) == compile_pla(minimized_rows, 1 << width)
+
+
+def count_rows(text: str) -> int:
+    return len(parse_pla(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimize a Logisim PLA program table.")
+    parser.add_argument("pla", help="PLA program table to minimize")
+    parser.add_argument("-o", "--output", help="output file (default: overwrite the input)")
+    args = parser.parse_args()
+
+    with open(args.pla, "r", encoding="utf-8") as file:
+        text = file.read()
+    minimized = minimize_pla(text)
+    print(f"{args.pla}: {count_rows(text)} rows -> {count_rows(minimized)} rows (equivalent)")
+    with open(args.output or args.pla, "w", encoding="utf-8") as file:
+        file.write(minimized)
+
+
+if __name__ == "__main__":
+    main()
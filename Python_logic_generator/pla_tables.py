@@ -0,0 +1,96 @@
+"""
+This module contains helpers to read Logisim PLA program tables.
+"""
+
+
+def parse_pla(text: str) -> list[tuple[str, int]]:
+    """
+    This function parses a Logisim PLA program table into (pattern, value) rows.
+    """
+    rows: list[tuple[str, int]] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        pattern, value = line.split()
+        rows.append((pattern, int(value, 2)))
+    return rows
+
+
+def load_pla(path: str) -> list[tuple[str, int]]:
+    with open(path, "r", encoding="utf-8") as file:
+        return parse_pla(file.read())
+
+
+def expand_pattern(pattern: str) -> list[int]:
+    """
+    This function returns every address matched by a PLA input pattern ('x' is a don't care bit).
+    """
+    addresses = [0]
+    for bit in pattern:
+        if bit == "x":
+            addresses = [address << 1 | value for address in addresses for value in (0, 1)]
+        else:
+            addresses = [address << 1 | int(bit) for address in addresses]
+    return addresses
+
+
+def compile_pla(rows: list[tuple[str, int]], size: int) -> list[int]:
+    """
+    This function compiles PLA rows into a dense table, outputs of overlapping rows are OR-ed like in the PLA.
+    """
+    table = [0] * size
+    for pattern, value in rows:
+        for address in expand_pattern(pattern):
+            table[address] |= value
+    return table
+
+
+def get_pla_widths(text: str) -> tuple[int, int]:
+    """
+    This function returns the (input, output) bit widths of a PLA program table.
+    """
+    for line in text.splitlines():
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        pattern, value = line.split()
+        return len(pattern), len(value)
+    return 0, 0
+
+
+def format_rom_image(values: list[int], run_length: int = 4) -> str:
+    """
+    This function formats values as a Logisim "v2.0 raw" memory image, runs of identical values are written as count*value.
+    """
+    tokens: list[str] = []
+    index = 0
+    while index < len(values):
+        end = index
+        while end < len(values) and values[end] == values[index]:
+            end += 1
+        count = end - index
+        if count >= run_length:
+            tokens.append(f"{count}*{values[index]:x}")
+        else:
+            tokens += [f"{values[index]:x}"] * count
+        index = end
+    # Trailing zeros are implicit in Logisim images
+    while len(tokens) > 0 and (tokens[-1] == "0" or tokens[-1].endswith("*0")):
+        tokens.pop()
+    lines = [" ".join(tokens[i:i + 8]) for i in range(0, len(tokens), 8)]
+    return "v2.0 raw\n" + "".join(line + "\n" for line in lines)
+
+
+def pla_to_rom_images(text: str, data_width: int = 32) -> list[str]:
+    """
+    This function converts a PLA program table into ROM images of at most data_width bits (Logisim memories are limited to 32 bits),
+    the first image holds the lowest bits of the outputs.
+    """
+    input_width, output_width = get_pla_widths(text)
+    table = compile_pla(parse_pla(text), 1 << input_width)
+    images = []
+    for low_bit in range(0, max(output_width, 1), data_width):
+        mask = (1 << min(data_width, output_width - low_bit)) - 1
+        images.append(format_rom_image([value >> low_bit & mask for value in table]))
+    return images
@@ -0,0 +1,180 @@
+# pylint: disable=line-too-long
+"""
+This module contains the control signal activity profiler.
+
+A profile accumulates, for an array of control words, how many times every
+signal of control_flags.py is asserted and how many times every pair of signals
+is asserted in the same cycle (co-activation). The words are unpacked into a
+(words, signals) bit matrix so the counts are two NumPy reductions.
+
+Profiles can be built:
+- statically from the decode table: the fetch cycles and the flag cleared path
+  of every implemented opcode, weighted per opcode (uniform or from a workload),
+  plus the reset sequence (once)
+- dynamically from the control words of an execution (a binary trace written by
+  cycle_trace.py or a run of the emulator, reset sequence included)
+
+The IRQ and vector PLAs drive no control signal (they select the interrupt
+sequence of BRK, whose rows are in the decode table, and its address), so the
+decode and reset tables hold every control word of the microcode.
+
+The report lists the dead signals (never asserted) and the groups of signals
+which are always asserted together, i.e. candidates to be merged or removed
+from the control word.
+"""
+import argparse
+import numpy as np
+from control_flags import *
+from control_model import CONTROL_SIGNALS
+
+SIGNAL_NAMES = [name for name, _ in CONTROL_SIGNALS]
+CHUNK_SIZE = 1 << 16
+SIGNAL_BITS = np.array([value.bit_length() - 1 for _, value in CONTROL_SIGNALS], dtype=np.uint64)
+
+
+def signal_matrix(words) -> np.ndarray:
+    """
+    This function unpacks control words into a (words, signals) boolean matrix (columns ordered as CONTROL_SIGNALS).
+    """
+    words = np.asarray(words, dtype=np.uint64)
+    return (words[:, None] >> SIGNAL_BITS[None, :] & np.uint64(1)).astype(bool)
+
+
+class SignalProfile:
+    """
+    This class accumulates per-signal assertion counts and pairwise co-activation counts.
+    """
+
+    def __init__(self):
+        self.cycles = 0.0
+        self.counts = np.zeros(len(SIGNAL_NAMES), dtype=np.float64)
+        self.coactivation = np.zeros((len(SIGNAL_NAMES), len(SIGNAL_NAMES)), dtype=np.float64)
+
+    def add_words(self, words, weights=None) -> None:
+        """
+        This function accumulates an array of control words (with an optional weight per word).
+        """
+        words = np.asarray(words, dtype=np.uint64)
+        weights = np.ones(len(words)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.cycles += float(np.sum(weights))
+        # Chunks keep the unpacked matrix small for traces of millions of cycles
+        for start in range(0, len(words), CHUNK_SIZE):
+            matrix = signal_matrix(words[start:start + CHUNK_SIZE]).astype(np.float64)
+            weighted = matrix * weights[start:start + CHUNK_SIZE, None]
+            self.counts += weighted.sum(axis=0)
+            self.coactivation += weighted.T @ matrix
+
+    def dead_signals(self) -> list[str]:
+        return [name for name, count in zip(SIGNAL_NAMES, self.counts) if count == 0]
+
+    def always_together(self) -> list[list[str]]:
+        """
+        This function returns the groups of (asserted) signals which are never asserted without each other.
+        """
+        together = (self.coactivation == self.counts[:, None]) & (self.coactivation == self.counts[None, :]) & (self.counts[:, None] > 0)
+        groups, seen = [], set()
+        for index in range(len(SIGNAL_NAMES)):
+            if index in seen or self.counts[index] == 0:
+                continue
+            members = [other for other in np.flatnonzero(together[index]) if other != index]
+            if len(members) > 0:
+                seen.update(members)
+                groups.append([SIGNAL_NAMES[member] for member in [index] + members])
+        return groups
+
+    def to_markdown(self) -> str:
+        report = f"Cycles: {self.cycles:g}\n\nSignal | Asserted | Share of cycles\n-- | -- | --\n"
+        for index in np.argsort(-self.counts, kind="stable"):
+            report += f"{SIGNAL_NAMES[index]} | {self.counts[index]:g} | {100 * self.counts[index] / self.cycles if self.cycles else 0:.1f}%\n"
+        report += "\nDead signals: " + (", ".join(self.dead_signals()) or "none") + "\n"
+        report += "\nAlways asserted together:\n" + "".join(f"- {' + '.join(group)}\n" for group in self.always_together())
+        return report
+
+
+def opcode_words(decode: list[int], opcode: int) -> list[int]:
+    """
+    This function returns the control words of the flag cleared path of an opcode (fetch cycles included), empty if not implemented.
+    """
+    words = []
+    for micro_counter in range(16):
+        word = decode[opcode << 5 | micro_counter]
+        words.append(word)
+        if word & RST_CYCLE:
+            return words
+    return []
+
+
+def reset_words(reset: list[int]) -> list[int]:
+    """
+    This function returns the control words of the reset sequence (up to its reset cycle).
+    """
+    words = []
+    for word in reset:
+        words.append(word)
+        if word & RST_CYCLE:
+            break
+    return words
+
+
+def static_profile(decode: list[int], weights: dict[int, float] | None = None, reset: list[int] | None = None) -> SignalProfile:
+    """
+    This function profiles the decode table, every implemented opcode weighted by weights[opcode] (default 1), and the reset sequence (once) if the reset table is given.
+    """
+    profile = SignalProfile()
+    words = reset_words(reset) if reset is not None else []
+    word_weights = [1.0] * len(words)
+    for opcode in range(256):
+        path = opcode_words(decode, opcode)
+        weight = 1.0 if weights is None else weights.get(opcode, 0.0)
+        if len(path) == 0 or weight == 0:
+            continue
+        words += path
+        word_weights += [weight] * len(path)
+    profile.add_words(words, word_weights)
+    return profile
+
+
+def dynamic_profile(words) -> SignalProfile:
+    profile = SignalProfile()
+    profile.add_words(words)
+    return profile
+
+
+def main():
+    from emulator import Microcode, TurtleCore
+    from cycle_trace import read_trace, control_words
+
+    parser = argparse.ArgumentParser(description="Profile the activity of the control signals.")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--trace", help="profile the control words of a binary trace (cycle_trace.py)")
+    parser.add_argument("--binary", help="profile the execution of a binary (loaded at $8000)")
+    parser.add_argument("--cycles", type=int, default=100_000, help="number of microcycles executed with --binary")
+    parser.add_argument("--workload", help="weight the static profile with the opcode counts of a binary (cycle_report.py)")
+    args = parser.parse_args()
+
+    microcode = Microcode.from_directory(args.pla_dir)
+    if args.trace is not None:
+        profile = dynamic_profile(control_words(read_trace(args.trace)))
+    elif args.binary is not None:
+        core = TurtleCore(microcode)
+        with open(args.binary, "rb") as file:
+            core.load(file.read())
+        core.reset()
+        words = reset_words(microcode.reset)
+        for _ in range(args.cycles):
+            words.append(core.control_word)
+            core.step()
+        profile = dynamic_profile(words)
+    elif args.workload is not None:
+        from cycle_report import dynamic_report
+        from pla_generator import build_instructions
+        with open(args.workload, "rb") as file:
+            report = dynamic_report(build_instructions(), file.read())
+        profile = static_profile(microcode.decode, {opcode: stats.count for opcode, stats in report.opcodes.items()}, microcode.reset)
+    else:
+        profile = static_profile(microcode.decode, reset=microcode.reset)
+    print(profile.to_markdown())
+
+
+if __name__ == "__main__":
+    main()
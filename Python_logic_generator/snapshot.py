@@ -0,0 +1,283 @@
+# pylint: disable=line-too-long
+"""
+This module contains the snapshots of the execution engines: the registers,
+the micro counter and the memory of a core captured once (after the reset
+sequence, the vector fetch and the ROM load for example) and restored before
+every test case instead of replaying them.
+
+The memory of a snapshot is a tuple of 256 immutable pages of 256 bytes. A
+CowMemory shares these pages and copies a page the first time it is written,
+so:
+- capture() of a CowMemory only freezes the pages written since the last
+  capture or restore (O(dirty pages)),
+- restore() on the memory forked from the same snapshot only puts back the
+  dirty pages, and fork() shares every page (256 references, not 64KB).
+A bytearray memory is copied in full instead.
+
+The flag select of the next micro cycle is computed from IR and P (the
+flag select PLA is combinational), so the registers and the micro counter
+are the whole state of a TurtleCore. The block emulator keeps its
+translations across a restore, except for the blocks of the pages which were
+put back. The gate level core (circuit_compiler.GateLevelCore) saves the
+state of its sequential elements and its input pins.
+
+A snapshot is saved as a binary file (magic, JSON header, then the non zero
+pages) so a warmed up state can be loaded by worker processes. It records a
+fingerprint of the microcode tables and cannot be restored into a core
+running another microcode.
+"""
+import argparse
+import hashlib
+import json
+import struct
+import time
+import weakref
+from array import array
+from block_emulator import BlockEngine, REGISTERS
+from emulator import Microcode, TurtleCore, MEMORY_SIZE
+
+PAGE_SIZE = 1 << 8
+PAGE_COUNT = MEMORY_SIZE // PAGE_SIZE
+ZERO_PAGE = bytes(PAGE_SIZE)
+SNAPSHOT_MAGIC = b"TCSNAP02"
+HEADER = struct.Struct("<8sI")
+CORE_STATE = REGISTERS + ("mc", "cycles")
+_FINGERPRINTS: "weakref.WeakKeyDictionary[Microcode, str]" = weakref.WeakKeyDictionary()
+
+
+class CowMemory:
+    """
+    This class represents a 64KB memory made of shared immutable pages (bytes) copied into private pages (bytearray) when they are written.
+    """
+
+    __slots__ = ("pages", "base", "dirty")
+
+    def __init__(self, pages: tuple[bytes, ...] | None = None):
+        self.base = pages if pages is not None else (ZERO_PAGE,) * PAGE_COUNT
+        self.pages: list[bytes | bytearray] = list(self.base)
+        # Pages copied since the memory was forked from (or frozen into) base
+        self.dirty: set[int] = set()
+
+    def __getitem__(self, address):
+        try:
+            return self.pages[address >> 8][address & 0xFF]
+        except TypeError:
+            return bytes(self.__getitem__(index) for index in range(*address.indices(MEMORY_SIZE)))
+
+    def __setitem__(self, address, value) -> None:
+        try:
+            self.pages[address >> 8][address & 0xFF] = value
+        except TypeError:
+            # A slice, or the first write to a shared page
+            if isinstance(address, slice):
+                for index, byte in zip(range(*address.indices(MEMORY_SIZE)), value):
+                    self.__setitem__(index, byte)
+                return
+            page = address >> 8
+            self.pages[page] = bytearray(self.pages[page])
+            self.pages[page][address & 0xFF] = value
+            self.dirty.add(page)
+
+    def __len__(self) -> int:
+        return MEMORY_SIZE
+
+    def freeze(self) -> tuple[bytes, ...]:
+        """
+        This function makes the dirty pages immutable and returns the pages, which become the base of the memory.
+        """
+        for page in self.dirty:
+            self.pages[page] = bytes(self.pages[page]) if any(self.pages[page]) else ZERO_PAGE
+        self.dirty.clear()
+        self.base = tuple(self.pages)
+        return self.base
+
+    def revert(self, pages: tuple[bytes, ...]) -> set[int]:
+        """
+        This function puts back the pages of a snapshot and returns the indexes of the pages which changed.
+        """
+        if pages is self.base:
+            changed = set(self.dirty)
+            for page in changed:
+                self.pages[page] = pages[page]
+        else:
+            changed = {page for page in range(PAGE_COUNT) if self.pages[page] is not pages[page]}
+            self.pages = list(pages)
+            self.base = pages
+        self.dirty.clear()
+        return changed
+
+
+class Snapshot:
+    """
+    This class holds the state of an engine: its registers (by name) and its memory pages.
+    """
+
+    def __init__(self, engine: str, registers: dict, pages: tuple[bytes, ...], fingerprint: str):
+        self.engine = engine
+        self.registers = registers
+        self.pages = pages
+        self.fingerprint = fingerprint
+
+    def save(self, path: str) -> None:
+        stored = [page for page in range(PAGE_COUNT) if self.pages[page] is not ZERO_PAGE and any(self.pages[page])]
+        header = json.dumps({"engine": self.engine, "registers": self.registers, "fingerprint": self.fingerprint, "pages": stored}).encode()
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(SNAPSHOT_MAGIC, len(header)))
+            file.write(header)
+            for page in stored:
+                file.write(self.pages[page])
+
+    @staticmethod
+    def load(path: str) -> "Snapshot":
+        with open(path, "rb") as file:
+            magic, size = HEADER.unpack(file.read(HEADER.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a Turtle Core snapshot!")
+            header = json.loads(file.read(size))
+            pages = [ZERO_PAGE] * PAGE_COUNT
+            for page in header["pages"]:
+                pages[page] = file.read(PAGE_SIZE)
+        return Snapshot(header["engine"], header["registers"], tuple(pages), header["fingerprint"])
+
+
+def microcode_fingerprint(microcode: Microcode) -> str:
+    """
+    This function returns a hash of the tables of a microcode (and of its fetch/execute overlap).
+    """
+    fingerprint = _FINGERPRINTS.get(microcode)
+    if fingerprint is None:
+        digest = hashlib.sha256(b"overlap" if microcode.fetch_overlap else b"")
+        for table in (microcode.decode, microcode.flag_select, microcode.reset, microcode.vectors):
+            digest.update(array("Q", table).tobytes())
+        fingerprint = _FINGERPRINTS[microcode] = digest.hexdigest()
+    return fingerprint
+
+
+def _core(engine) -> TurtleCore | None:
+    return engine.core if isinstance(engine, BlockEngine) else engine if isinstance(engine, TurtleCore) else None
+
+
+def _fingerprint(engine) -> str:
+    core = _core(engine)
+    if core is not None:
+        return microcode_fingerprint(core.microcode)
+    # Gate level core: the names of its sequential elements
+    return hashlib.sha256("\n".join(engine.circuit.registers).encode()).hexdigest()
+
+
+def _freeze_memory(memory) -> tuple[bytes, ...]:
+    if isinstance(memory, CowMemory):
+        return memory.freeze()
+    if not isinstance(memory, bytearray):
+        raise TypeError(f"Snapshots need a CowMemory or a bytearray memory, not {type(memory).__name__}")
+    pages = (bytes(memory[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]) for page in range(PAGE_COUNT))
+    return tuple(page if any(page) else ZERO_PAGE for page in pages)
+
+
+def _revert_memory(memory, pages: tuple[bytes, ...]) -> set[int]:
+    if isinstance(memory, CowMemory):
+        return memory.revert(pages)
+    changed = {page for page in range(PAGE_COUNT) if memory[page * PAGE_SIZE:(page + 1) * PAGE_SIZE] != pages[page]}
+    for page in changed:
+        memory[page * PAGE_SIZE:(page + 1) * PAGE_SIZE] = pages[page]
+    return changed
+
+
+def capture(engine) -> Snapshot:
+    """
+    This function captures the state of an engine (TurtleCore, BlockEngine or GateLevelCore) at an instruction boundary or between two micro cycles.
+    """
+    core = _core(engine)
+    if core is not None:
+        registers = {name: getattr(core, name) for name in CORE_STATE}
+        memory = core.memory
+    else:
+        registers = engine.save_state()
+        memory = engine.memory
+    return Snapshot(type(engine).__name__, registers, _freeze_memory(memory), _fingerprint(engine))
+
+
+def restore(engine, snapshot: Snapshot) -> None:
+    """
+    This function puts an engine back in the state of a snapshot taken from the same kind of engine with the same microcode.
+    """
+    if snapshot.fingerprint != _fingerprint(engine):
+        raise ValueError(f"The snapshot was taken from a {snapshot.engine} running another microcode!")
+    core = _core(engine)
+    if core is not None:
+        changed = _revert_memory(core.memory, snapshot.pages)
+        for name in CORE_STATE:
+            setattr(core, name, snapshot.registers[name])
+        if isinstance(engine, BlockEngine) and changed:
+            engine.forget(changed)
+    else:
+        _revert_memory(engine.memory, snapshot.pages)
+        engine.load_state(snapshot.registers)
+
+
+def fork(snapshot: Snapshot, microcode: Microcode) -> TurtleCore:
+    """
+    This function returns a new core in the state of a snapshot, its CowMemory shares the pages of the snapshot.
+    """
+    if snapshot.fingerprint != microcode_fingerprint(microcode):
+        raise ValueError("The snapshot was taken from a core running another microcode!")
+    core = TurtleCore(microcode, CowMemory(snapshot.pages))
+    for name in CORE_STATE:
+        setattr(core, name, snapshot.registers[name])
+    return core
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot a warmed up Turtle Core and measure the restore of test cases against replaying the warm up.")
+    parser.add_argument("binary", help="binary image loaded at the ROM start ($8000)")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--warmup", type=int, default=0, help="microcycles run after the reset sequence before the snapshot")
+    parser.add_argument("--save", help="save the snapshot to this file")
+    parser.add_argument("--load", help="restore the cases from a saved snapshot instead of warming up")
+    parser.add_argument("--cases", type=int, default=1000, help="number of test cases")
+    parser.add_argument("--cycles", type=int, default=200, help="microcycles run by every case")
+    parser.add_argument("--block", action="store_true", help="run the cases on the block emulator")
+    args = parser.parse_args()
+
+    microcode = Microcode.from_directory(args.pla_dir)
+    with open(args.binary, "rb") as file:
+        image = file.read()
+
+    def warm_up(memory) -> TurtleCore:
+        core = TurtleCore(microcode, memory)
+        core.load(image)
+        core.reset()
+        core.run(args.warmup)
+        return core
+
+    if args.load is not None:
+        snapshot = Snapshot.load(args.load)
+    else:
+        snapshot = capture(warm_up(CowMemory()))
+    if args.save is not None:
+        snapshot.save(args.save)
+
+    core = fork(snapshot, microcode)
+    engine = BlockEngine(core) if args.block else core
+    start = time.perf_counter()
+    for _ in range(args.cases):
+        restore(engine, snapshot)
+        engine.run(args.cycles)
+    restored = time.perf_counter() - start
+    final = capture(engine)
+
+    start = time.perf_counter()
+    for _ in range(args.cases):
+        replay = warm_up(bytearray(MEMORY_SIZE))
+        engine = BlockEngine(replay) if args.block else replay
+        engine.run(args.cycles)
+    replayed = time.perf_counter() - start
+
+    print(f"{args.cases} cases of {args.cycles} microcycles: {restored:.3f}s with restore, {replayed:.3f}s with replay ({replayed / restored:.1f}x)")
+    print(f"Pages written by a case: {sum(page is not base for page, base in zip(final.pages, snapshot.pages))}")
+    same = final.registers == capture(replay).registers and final.pages == _freeze_memory(replay.memory)
+    print(f"Final state {'matches' if same else 'DIFFERS from'} the replayed core")
+
+
+if __name__ == "__main__":
+    main()
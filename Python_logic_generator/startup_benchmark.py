@@ -0,0 +1,178 @@
+# pylint: disable=line-too-long
+"""
+This module contains the startup benchmark of the generator scripts.
+
+Every module is imported in a fresh interpreter (so nothing is cached in
+sys.modules) and the wall time of the import is measured several times; the
+median is reported. With --ref the same modules are also measured on the
+sources of a git revision (extracted with git archive in a temporary
+directory), which gives the import time before and after a change.
+
+The generator modules must only need the standard library. They are not
+listed by hand: pla_generator.py and the local modules it imports at its top
+level (recursively) are always generator modules, and so is every other
+module of the directory whose top level imports are standard library or local
+modules (the analysis tools import NumPy at their top level, the generator
+only imports it lazily, e.g. pla_generator.py --check-hazards). Every module is imported in a new interpreter
+and the packages added to sys.modules by the import (its whole import closure)
+are checked: --stdlib-only fails if a generator module loads a third party
+package, through any local import.
+"""
+import argparse
+import ast
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Modules always measured with their local import closure: a third party import added to them is reported instead of
+# moving them out of the generator modules
+GENERATOR_ENTRY_POINTS = ("pla_generator",)
+
+IMPORT_SCRIPT = """
+import sys, time
+loaded = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(sorted(set(sys.modules) - loaded)))
+"""
+
+
+def local_modules(directory: str) -> list[str]:
+    return sorted(name[:-3] for name in os.listdir(directory) if name.endswith(".py"))
+
+
+def _parse(path: str) -> ast.Module:
+    with open(path, "r", encoding="utf-8") as file:
+        return ast.parse(file.read(), path)
+
+
+def top_level_imports(tree: ast.Module) -> set[str]:
+    """
+    This function returns the top level packages imported by the module level statements of a source file (imports inside functions are lazy).
+    """
+    names = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.update(alias.name.partition(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+            names.add(node.module.partition(".")[0])
+    return names
+
+
+def is_script(tree: ast.Module) -> bool:
+    # Modules doing their work at import time (update_control_flags.py writes control_flags.py) are not imported
+    return any(not isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef, ast.Assign, ast.AnnAssign, ast.Expr, ast.If)) for node in tree.body)
+
+
+def third_party(names, directory: str) -> list[str]:
+    local = set(local_modules(directory))
+    return sorted(name for name in names if name not in sys.stdlib_module_names and name not in local and name not in ("__main__", "__mp_main__"))
+
+
+def local_import_closure(modules, directory: str) -> set[str]:
+    """
+    This function returns the local modules of directory among modules and the local modules they import at their top level, recursively.
+    """
+    local = set(local_modules(directory))
+    closure = set()
+    pending = [module for module in modules if module in local]
+    while pending:
+        module = pending.pop()
+        if module not in closure:
+            closure.add(module)
+            pending.extend(top_level_imports(_parse(os.path.join(directory, f"{module}.py"))) & local)
+    return closure
+
+
+def generator_modules(directory: str = SOURCE_DIRECTORY) -> list[str]:
+    """
+    This function returns the import closure of GENERATOR_ENTRY_POINTS and the modules of directory which only import standard library and
+    local modules at their top level.
+    """
+    modules = local_import_closure(GENERATOR_ENTRY_POINTS, directory)
+    for module in local_modules(directory):
+        tree = _parse(os.path.join(directory, f"{module}.py"))
+        if not is_script(tree) and not third_party(top_level_imports(tree), directory):
+            modules.add(module)
+    return sorted(modules)
+
+
+def measure_import(module: str, directory: str) -> tuple[float, list[str]]:
+    """
+    This function imports module from directory in a new interpreter and returns the import time (s) and the third party packages it loaded.
+    """
+    script = IMPORT_SCRIPT.format(module=module)
+    result = subprocess.run([sys.executable, "-c", script], cwd=directory, capture_output=True, text=True, check=True, env={**os.environ, "PYTHONPATH": directory})
+    elapsed, _, loaded = result.stdout.strip().partition(" ")
+    return float(elapsed), third_party({name.partition(".")[0] for name in loaded.split(",") if name != ""}, directory)
+
+
+def benchmark(modules: list[str], directory: str, repeat: int) -> dict[str, tuple[float, list[str]]]:
+    """
+    This function returns {module: (median import time, third party packages loaded)}.
+    """
+    results = {}
+    for module in modules:
+        runs = [measure_import(module, directory) for _ in range(repeat)]
+        results[module] = (statistics.median(elapsed for elapsed, _ in runs), runs[0][1])
+    return results
+
+
+def extract_revision(revision: str, directory: str) -> str:
+    """
+    This function extracts the generator sources of a git revision into directory and returns their path.
+    """
+    archive = subprocess.run(["git", "archive", "--format=tar", revision, "."], cwd=SOURCE_DIRECTORY, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory, filter="data")
+    return directory
+
+
+def to_markdown(current: dict, reference: dict | None = None, revision: str = "") -> str:
+    report = "Module | Import (ms) | Third party"
+    report += f" | {revision} (ms) | Speedup\n-- | -- | -- | -- | --\n" if reference else "\n-- | -- | --\n"
+    for module, (elapsed, heavy) in current.items():
+        report += f"{module} | {elapsed * 1000:.1f} | {', '.join(heavy) or '-'}"
+        if reference:
+            if module in reference:
+                report += f" | {reference[module][0] * 1000:.1f} | {reference[module][0] / elapsed:.1f}x"
+            else:
+                report += " | - | -"
+        report += "\n"
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the generator modules.")
+    parser.add_argument("modules", nargs="*", help="modules to import (default: the generator modules, see generator_modules())")
+    parser.add_argument("--repeat", type=int, default=5, help="number of imports per module (the median is reported)")
+    parser.add_argument("--ref", metavar="REVISION", help="also measure the sources of a git revision")
+    parser.add_argument("--stdlib-only", action="store_true", help="fail if a module loads a third party package")
+    args = parser.parse_args()
+    if not args.modules:
+        args.modules = generator_modules()
+
+    current = benchmark(args.modules, SOURCE_DIRECTORY, args.repeat)
+    reference = None
+    if args.ref is not None:
+        with tempfile.TemporaryDirectory() as directory:
+            source = extract_revision(args.ref, directory)
+            modules = [module for module in args.modules if os.path.exists(os.path.join(source, f"{module}.py"))]
+            reference = benchmark(modules, source, args.repeat)
+    print(to_markdown(current, reference, args.ref or ""))
+
+    heavy = [module for module, (_, loaded) in current.items() if loaded]
+    if args.stdlib_only and heavy:
+        print(f"Modules loading third party packages: {', '.join(heavy)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
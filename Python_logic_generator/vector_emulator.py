@@ -0,0 +1,288 @@
+# pylint: disable=line-too-long
+"""
+This module contains a vectorized (multi-lane) emulator of the Turtle Core.
+
+N independent cores (lanes, one per program or per random seed) are kept as
+NumPy arrays and every micro cycle is applied to all the lanes at once. Each
+lane computes its own decode address (opcode, flag, micro counter) and gathers
+its control signals from a table precompiled from the DecodePLA, so lanes
+running different opcodes do not need to stay in step.
+
+The datapath model is the one of emulator.py (wired-AND buses precharged to $FF,
+DL read at the start of the cycle, registers and ALU input latches loaded at the
+end, ACR and AVR sampled from the previous inputs). A lane can be
+checked against the scalar TurtleCore with compare_lane().
+"""
+import argparse
+import time
+import numpy as np
+from control_flags import *
+from control_model import RESET_VECTOR_STEPS, BRK_VECTOR_STEPS, BRK_OPCODE
+from emulator import Microcode, TurtleCore, DECODE_TABLE_SIZE, RESET_TABLE_SIZE, MEMORY_SIZE, ROM_START, MICRO_COUNTER_MASK, FLAG_SELECT_MASKS
+
+REGISTERS = ("dl", "dor", "pcl", "pch", "pcls", "pchs", "abl", "abh", "s", "x", "y", "ac", "p", "ai", "bi", "add", "ir", "mc")
+
+# Status register bits updated by each flag signal
+FLAG_SIGNAL_MASKS = {
+    DB0_C: 0x01, IR5_C: 0x01, ACR_C: 0x01, DB1_Z: 0x02, DBZ_Z: 0x02, DB2_I: 0x04, IR5_I: 0x04,
+    DB3_D: 0x08, IR5_D: 0x08, DB6_V: 0x40, AVR_V: 0x40, I_V: 0x40, DB7_N: 0x80,
+}
+
+
+def _bit(signal: int) -> int:
+    return signal.bit_length() - 1
+
+
+def _alu(a: np.ndarray, b: np.ndarray, carry: np.ndarray, signals: np.ndarray, off: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    This function returns the ALU output, ACR and AVR of every lane for the selected operations ($00 when none is).
+    """
+    total = a + b + carry
+    acr_sum = total >> 8
+    res_sum = total & 0xFF
+    dda, dsa = signals[_bit(DDA)], signals[_bit(DSA)] & ~signals[_bit(DDA)]
+    if dda.any() or dsa.any():
+        low = (a & 0x0F) + (b & 0x0F) + carry
+        adjusted = total + np.where(low > 0x09, 0x06, 0)
+        adjusted = adjusted + np.where(adjusted > 0x99, 0x60, 0)
+        subtracted = np.where(low <= 0x0F, (res_sum & 0xF0) | ((res_sum - 0x06) & 0x0F), res_sum)
+        subtracted = np.where(acr_sum == 0, (subtracted - 0x60) & 0xFF, subtracted)
+        res_sum = np.where(dda, adjusted & 0xFF, np.where(dsa, subtracted, res_sum))
+        acr_sum = np.where(dda, adjusted > 0xFF, acr_sum)
+    result = (res_sum | off[_bit(SUMS)]) & ((a >> 1) | off[_bit(SRS)]) & ((a & b) | off[_bit(ANDS)]) & ((a ^ b) | off[_bit(EORS)]) & ((a | b) | off[_bit(ORS)])
+    srs, sums = signals[_bit(SRS)], signals[_bit(SUMS)]
+    result = np.where(srs | sums | signals[_bit(ANDS)] | signals[_bit(EORS)] | signals[_bit(ORS)], result, 0)
+    acr = (sums & (acr_sum != 0)) | (srs & ((a & 1) != 0))
+    avr = ((a ^ result) & (b ^ result)) >> 7 & 1
+    return result, acr.astype(np.int32), avr
+
+
+class VectorCore:
+    """
+    This class represents N Turtle Cores running the microcode in lockstep on NumPy arrays.
+    """
+
+    def __init__(self, microcode: Microcode, lanes: int):
+        self.microcode = microcode
+        self.lanes = lanes
+        self.memory = np.zeros((lanes, MEMORY_SIZE), dtype=np.uint8)
+        for register in REGISTERS:
+            setattr(self, register, np.zeros(lanes, dtype=np.int32))
+        self.p[:] = 0x20
+        self.cycles = 0
+        self._lane_index = np.arange(lanes)
+        self._flag_masks = np.array([FLAG_SELECT_MASKS[flag & 0x7] for flag in microcode.flag_select], dtype=np.int32)
+
+        # Rows of the decode table followed by the rows of the reset table
+        words = list(microcode.decode) + list(microcode.reset)
+        rows = len(words)
+        bits = np.array([[word >> bit & 1 for word in words] for bit in range(64)], dtype=bool)
+        # Signals are stored transposed (signal, row) so a gather gives one contiguous array per signal
+        self._signals = bits
+        self._off = np.where(bits, 0, 0xFF).astype(np.int32)
+        self._clear_flags = np.array([0xFF ^ sum(mask for signal, mask in FLAG_SIGNAL_MASKS.items() if word & signal) & 0xFF for word in words], dtype=np.int32)
+        self._vectors = np.full(rows, -1, dtype=np.int32)
+        self._p_db = np.full(rows, 0x20, dtype=np.int32)
+        # A reset cycle alone takes no clock in the circuit, it changes no register
+        self._no_clock = np.array([word == RST_CYCLE for word in words])
+        self._load_ir = np.zeros(rows, dtype=bool)
+        for address in range(DECODE_TABLE_SIZE):
+            opcode, micro_counter = address >> 5, address & MICRO_COUNTER_MASK
+            self._load_ir[address] = micro_counter == microcode.ir_load_cycle
+            if opcode == BRK_OPCODE:
+                self._p_db[address] = 0x30
+                brk_cycle = micro_counter + 1 - microcode.ir_load_cycle
+                if brk_cycle in BRK_VECTOR_STEPS:
+                    self._vectors[address] = microcode.vectors[BRK_VECTOR_STEPS[brk_cycle]]
+        for micro_counter, step in RESET_VECTOR_STEPS.items():
+            self._vectors[DECODE_TABLE_SIZE + micro_counter] = microcode.vectors[step]
+
+    def load(self, images, start: int = ROM_START) -> None:
+        """
+        This function loads one image in every lane, or a list of images (one per lane).
+        """
+        if isinstance(images, (bytes, bytearray)):
+            self.memory[:, start:start + len(images)] = np.frombuffer(images, dtype=np.uint8)
+            return
+        if len(images) != self.lanes:
+            raise ValueError(f"{len(images)} images for {self.lanes} lanes!")
+        for lane, image in enumerate(images):
+            self.memory[lane, start:start + len(image)] = np.frombuffer(image, dtype=np.uint8)
+
+    def reset(self) -> int:
+        """
+        This function runs the reset sequence on every lane and returns the number of cycles spent.
+        """
+        # The reset clears the instruction register (as in the circuit): the first fetch row carries no cycle of the previous instruction
+        self.ir[:] = 0
+        self.mc[:] = 0
+        cycles = 0
+        for micro_counter, word in enumerate(self.microcode.reset):
+            self._step(np.full(self.lanes, DECODE_TABLE_SIZE + micro_counter))
+            cycles += 1
+            if word & RST_CYCLE or cycles >= RESET_TABLE_SIZE:
+                break
+        self.mc[:] = 0
+        self.cycles += cycles
+        return cycles
+
+    def addresses(self) -> np.ndarray:
+        flag = (self.p & self._flag_masks[self.ir]) != 0
+        return self.ir << 5 | flag.astype(np.int32) << 4 | self.mc
+
+    def step(self) -> None:
+        self._step(self.addresses())
+        self.cycles += 1
+
+    def run(self, cycles: int) -> None:
+        for _ in range(cycles):
+            self._step(self.addresses())
+        self.cycles += cycles
+
+    def _step(self, rows: np.ndarray) -> None:
+        signals = self._signals[:, rows]
+        off = self._off[:, rows]
+        on = off ^ 0xFF
+        lanes = self._lane_index
+
+        # Memory access at the start of the cycle
+        ab = self.abh << 8 | self.abl
+        rw = signals[_bit(RW)]
+        if rw.any():
+            self.memory[lanes[rw], ab[rw]] = self.dor[rw]
+        no_clock = self._no_clock[rows]
+        dl = np.where(rw | no_clock, self.dl, self.memory[lanes, ab])
+        self.dl = dl
+
+        # Buses (wired-AND, an undriven bus reads $FF)
+        pcl, pch, add = self.pcl, self.pch, self.add
+        p_db = self.p | self._p_db[rows]
+        db = (dl | off[_bit(DL_DB)]) & (pcl | off[_bit(PCL_DB)]) & (pch | off[_bit(PCH_DB)]) & (self.ac | off[_bit(AC_DB)]) & (p_db | off[_bit(P_DB)])
+        add_sb = add | (off[_bit(ADD_SB06)] & 0x7F) | (off[_bit(ADD_SB7)] & 0x80)
+        sb = (self.s | off[_bit(S_SB)]) & (self.ac | off[_bit(AC_SB)]) & (self.x | off[_bit(X_SB)]) & (self.y | off[_bit(Y_SB)]) & add_sb
+        adl = ((dl | off[_bit(DL_ADL)]) & (pcl | off[_bit(PCL_ADL)]) & (self.s | off[_bit(S_ADL)]) & (add | off[_bit(ADD_ADL)])
+               & (0xFE | off[_bit(O_ADL0)]) & (0xFD | off[_bit(O_ADL1)]) & (0xFB | off[_bit(O_ADL2)]))
+        adh = (dl | off[_bit(DL_ADH)]) & (pch | off[_bit(PCH_ADH)]) & (0xFE | off[_bit(O_ADH0)]) & (0x01 | off[_bit(O_ADH17)])
+        db &= sb | off[_bit(SB_DB)]
+        adh &= sb | off[_bit(SB_ADH)]
+
+        # ALU flags, from the inputs latched by the previous cycle
+        carry_in = signals[_bit(I_ADDC)]
+        _, acr, avr = _alu(self.ai, self.bi, np.where(carry_in, 1, self.p & 1), signals, off)
+
+        # ALU input latches
+        self.ai = np.where(signals[_bit(SB_ADD)] | signals[_bit(O_ADD)], (sb | off[_bit(SB_ADD)]) & off[_bit(O_ADD)], self.ai)
+        b_load = signals[_bit(DB_ADD)] | signals[_bit(DBx_ADD)] | signals[_bit(ADL_ADD)]
+        self.bi = np.where(b_load, (db | off[_bit(DB_ADD)]) & ((db ^ 0xFF) | off[_bit(DBx_ADD)]) & (adl | off[_bit(ADL_ADD)]), self.bi)
+
+        # Processor status
+        ir = self.ir
+        flags = ((db & 0x01 & on[_bit(DB0_C)]) | (ir >> 5 & 0x01 & on[_bit(IR5_C)]) | (acr & on[_bit(ACR_C)])
+                 | (db & 0x02 & on[_bit(DB1_Z)]) | np.where(db == 0, 0x02, 0) & on[_bit(DBZ_Z)]
+                 | (db & 0x04 & on[_bit(DB2_I)]) | (ir >> 3 & 0x04 & on[_bit(IR5_I)])
+                 | (db & 0x08 & on[_bit(DB3_D)]) | (ir >> 2 & 0x08 & on[_bit(IR5_D)])
+                 | (db & 0x40 & on[_bit(DB6_V)]) | (avr << 6 & on[_bit(AVR_V)]) | (0x40 & on[_bit(I_V)])
+                 | (db & 0x80 & on[_bit(DB7_N)]))
+        self.p = self.p & self._clear_flags[rows] | flags
+
+        # ALU result, from the new inputs and carry in
+        result, _, _ = _alu(self.ai, self.bi, np.where(carry_in, 1, self.p & 1), signals, off)
+        self.add = np.where(no_clock, add, result)
+
+        # Registers
+        self.ac = np.where(signals[_bit(SB_AC)], sb, self.ac)
+        self.x = np.where(signals[_bit(SB_X)], sb, self.x)
+        self.y = np.where(signals[_bit(SB_Y)], sb, self.y)
+        self.s = np.where(signals[_bit(SB_S)], sb, self.s)
+
+        # Program counter: PCLS/PCHS latch PCL/ADL and PCH/ADH, PCL:PCH load PCLS:PCHS + I_PC
+        self.pcls = np.where(signals[_bit(PCL_PCL)] | signals[_bit(ADL_PCL)], (pcl | off[_bit(PCL_PCL)]) & (adl | off[_bit(ADL_PCL)]), self.pcls)
+        self.pchs = np.where(signals[_bit(PCH_PCH)] | signals[_bit(ADH_PCH)], (pch | off[_bit(PCH_PCH)]) & (adh | off[_bit(ADH_PCH)]), self.pchs)
+        incremented = self.pcls + signals[_bit(I_PC)]
+        self.pch = np.where(no_clock, pch, (self.pchs + (incremented >> 8)) & 0xFF)
+        self.pcl = np.where(no_clock, pcl, incremented & 0xFF)
+
+        # Data output register, address bus, instruction register and micro counter
+        self.dor = np.where(no_clock, self.dor, db)
+        vectors = self._vectors[rows]
+        self.abl = np.where(vectors >= 0, vectors & 0xFF, np.where(signals[_bit(ADL_ABL)], adl, self.abl))
+        self.abh = np.where(vectors >= 0, vectors >> 8, np.where(signals[_bit(ADH_ABH)], adh, self.abh))
+        self.ir = np.where(self._load_ir[rows], dl, ir)
+        self.mc = np.where(signals[_bit(RST_CYCLE)], 0, (self.mc + 1) & MICRO_COUNTER_MASK)
+
+    def lane_state(self, lane: int) -> dict[str, int]:
+        return {register: int(getattr(self, register)[lane]) for register in REGISTERS}
+
+    def set_lane_state(self, lane: int, **registers: int) -> None:
+        for register, value in registers.items():
+            getattr(self, register)[lane] = value
+
+    def compare_lane(self, lane: int, core: TurtleCore) -> list[str]:
+        """
+        This function returns the registers (and "memory") of a lane which differ from a scalar TurtleCore.
+        """
+        differences = [register for register, value in self.lane_state(lane).items() if getattr(core, register) != value]
+        if bytes(self.memory[lane]) != bytes(core.memory):
+            differences.append("memory")
+        return differences
+
+
+def randomize_lanes(core: VectorCore, seed: int) -> None:
+    """
+    This function gives every lane random AC, X, Y, carry and zero page values.
+    """
+    generator = np.random.default_rng(seed)
+    for register in ("ac", "x", "y"):
+        setattr(core, register, generator.integers(0, 256, core.lanes, dtype=np.int32))
+    core.p = core.p | generator.integers(0, 2, core.lanes, dtype=np.int32)
+    core.memory[:, :0x100] = generator.integers(0, 256, (core.lanes, 0x100), dtype=np.uint8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run binaries on many Turtle Core lanes at once.")
+    parser.add_argument("binaries", nargs="+", help="binary images loaded at the ROM start ($8000), spread over the lanes")
+    parser.add_argument("--lanes", type=int, default=1024, help="number of lanes")
+    parser.add_argument("--cycles", type=int, default=100, help="number of microcycles to run")
+    parser.add_argument("--pla-dir", default="./PLAs", help="directory of the generated PLA tables")
+    parser.add_argument("--seed", type=int, default=None, help="randomize AC, X, Y, carry and zero page of every lane")
+    parser.add_argument("--check", action="store_true", help="check every lane against the scalar emulator")
+    args = parser.parse_args()
+
+    microcode = Microcode.from_directory(args.pla_dir)
+    images = []
+    for path in args.binaries:
+        with open(path, "rb") as file:
+            images.append(file.read())
+    lane_images = [images[lane % len(images)] for lane in range(args.lanes)]
+
+    core = VectorCore(microcode, args.lanes)
+    core.load(lane_images)
+    if args.seed is not None:
+        randomize_lanes(core, args.seed)
+    initial = [core.lane_state(lane) for lane in range(args.lanes)] if args.check else []
+    initial_memory = core.memory.copy() if args.check else None
+
+    start = time.perf_counter()
+    core.reset()
+    core.run(args.cycles)
+    elapsed = time.perf_counter() - start
+    print(f"{args.lanes} lanes x {args.cycles} microcycles in {elapsed:.3f}s "
+          f"({args.lanes / elapsed:,.0f} programs/s, {args.lanes * args.cycles / elapsed:,.0f} microcycles/s)")
+
+    if args.check:
+        failures = 0
+        for lane in range(args.lanes):
+            scalar = TurtleCore(microcode, bytearray(initial_memory[lane].tobytes()))
+            for register, value in initial[lane].items():
+                setattr(scalar, register, value)
+            scalar.reset()
+            scalar.run(args.cycles)
+            differences = core.compare_lane(lane, scalar)
+            if differences:
+                failures += 1
+                print(f"Lane {lane}: {', '.join(differences)} differ (vector {core.lane_state(lane)}, scalar {scalar!r})")
+        print(f"{args.lanes - failures}/{args.lanes} lanes match the scalar emulator")
+
+
+if __name__ == "__main__":
+    main()
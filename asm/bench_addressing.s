@@ -0,0 +1,43 @@
+; Reference program of the benchmark suite: every addressing mode of the loads,
+; stores and ADC, with page crossing indexed accesses. BRK jumps back to start.
+	.org $8000
+start:
+	ldx #$10
+	ldy #$20
+	lda #$01
+	sta $10
+	adc $10
+	sta $11,x
+	adc $11,x
+	stx $0200
+	sty $0201
+	stx $30,y
+	sty $40,x
+	ldx $30,y
+	ldy $40,x
+	adc $0200
+	adc $01f8,x
+	adc $01f0,y
+	sta $0300,x
+	sta $0300,y
+	ldy $0300,x
+	ldx $0300,y
+	lda $02f8,x
+	lda $02f0,y
+	ldx #$10
+	ldy #$20
+	lda #$f8
+	sta $50
+	lda #$02
+	sta $51
+	sta ($40,x)
+	adc ($40,x)
+	lda ($40,x)
+	sta ($50),y
+	adc ($50),y
+	lda ($50),y
+	brk
+
+	.org $fffc
+	.word start
+	.word start
@@ -0,0 +1,27 @@
+; Reference program of the benchmark suite: taken and not taken branches of the
+; C, Z, N and V families, forward and backward. BRK jumps back to start.
+	.org $8000
+start:
+	lda #$ef
+count:
+	adc #$01
+	bne count
+	bcs carry
+	brk
+carry:
+	lda #$80
+	bmi negative
+	brk
+negative:
+	bvc no_overflow
+	brk
+no_overflow:
+	bpl start
+	bvs start
+	beq start
+	bcc start
+	brk
+
+	.org $fffc
+	.word start
+	.word start
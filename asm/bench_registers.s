@@ -0,0 +1,24 @@
+; Reference program of the benchmark suite: immediate loads, register transfers
+; and flag instructions. BRK jumps back to start.
+	.org $8000
+start:
+	ldx #$ff
+	txs
+	lda #$42
+	tax
+	tay
+	adc #$10
+	txa
+	tya
+	tsx
+	sec
+	adc #$01
+	ldy #$07
+	tya
+	adc #$80
+	sei
+	brk
+
+	.org $fffc
+	.word start
+	.word start
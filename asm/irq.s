@@ -0,0 +1,37 @@
+; Counts the timer interrupts in $00 (IRQ every 500 microcycles)
+
+TIMER_RELOAD = $7f12
+TIMER_CONTROL = $7f14
+TIMER_STATUS = $7f15
+
+	.org $8000
+start:
+	; C is added to the absolute addresses by the Turtle Core, keep it clear
+	clc
+	lda #$00
+	sta $00
+	lda #<499
+	sta TIMER_RELOAD
+	lda #>499
+	sta TIMER_RELOAD+1
+	lda #$03
+	sta TIMER_CONTROL
+	cli
+idle:
+	ldy #$00
+	beq idle
+
+irq:
+	clc
+	lda $00
+	adc #1
+	sta $00
+	; A wrap to 0 sets C, clear it before the absolute store
+	clc
+	; Acknowledge the timer (releases the IRQ line)
+	sta TIMER_STATUS
+	rti
+
+	.org $fffc
+	.word start
+	.word irq
@@ -0,0 +1,47 @@
+; Sends a message on the UART and starts the timer (IRQ every 1000 microcycles)
+
+UART_DATA = $7f00
+TIMER_RELOAD = $7f12
+TIMER_CONTROL = $7f14
+
+	.org $8000
+start:
+	lda #'H'
+	sta UART_DATA
+	lda #'e'
+	sta UART_DATA
+	lda #'l'
+	sta UART_DATA
+	lda #'l'
+	sta UART_DATA
+	lda #'o'
+	sta UART_DATA
+	lda #' '
+	sta UART_DATA
+	lda #'T'
+	sta UART_DATA
+	lda #'u'
+	sta UART_DATA
+	lda #'r'
+	sta UART_DATA
+	lda #'t'
+	sta UART_DATA
+	lda #'l'
+	sta UART_DATA
+	lda #'e'
+	sta UART_DATA
+	lda #$0a
+	sta UART_DATA
+	lda #<999
+	sta TIMER_RELOAD
+	lda #>999
+	sta TIMER_RELOAD+1
+	lda #$03
+	sta TIMER_CONTROL
+idle:
+	ldy #$00
+	beq idle
+
+	.org $fffc
+	.word start
+	.word start